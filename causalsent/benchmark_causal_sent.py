@@ -0,0 +1,786 @@
+"""
+CPU benchmarks for CausalSent performance modes.
+
+Each benchmark builds CausalSent models on synthetic token ids (no dataset
+download needed), checks numerical parity between the baseline and optimized
+paths, and reports throughput. The torch.compile benchmark varies the sequence
+length between steps to check that dynamic shapes do not recompile. The quantization benchmark additionally reports
+accuracy and ATE deltas on real data when given a trained checkpoint.
+
+Example usage:
+    python benchmark_causal_sent.py --benchmark fused --batch_size 16 --max_seq_length 100
+    python benchmark_causal_sent.py --benchmark quantize --model_path out/experiment_1/best_model.pt
+    python benchmark_causal_sent.py --benchmark compile --seq_lengths 64 100 128
+    python benchmark_causal_sent.py --benchmark packed --max_seq_length 512
+    python benchmark_causal_sent.py --benchmark checkpoint --checkpoint_every_values 0 1 2 3
+    python benchmark_causal_sent.py --benchmark l1 --lambda_l1 1e-5
+    python benchmark_causal_sent.py --benchmark bf16 --train_steps 200 --limit_data 1000
+    python benchmark_causal_sent.py --benchmark syncs --steps 20
+"""
+
+import os
+import sys
+TOP_DIR = os.path.abspath(os.path.join(os.getcwd(), '..'))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+import copy
+import time
+import argparse
+import torch
+from torch.utils.data import DataLoader
+from causalsent.modules.causal_sent import CausalSent
+from causalsent.optim.proximal_l1 import ProximalL1
+from causalsent.data.utils import load_imdb_data, load_civil_comments_data
+from causalsent.data.generators import IMDBDataset, CivilCommentsDataset, SimilarityDataset
+from causalsent.utils import (seed_everything, load_model_inference, mixed_precision, get_default_sent_training_args,
+                            SyncCounter, StreamingBinaryMetrics)
+
+
+HEAD_TYPES = ['linear', 'fcn', 'conv']
+
+
+def get_benchmark_args():
+    """
+    Parse command line arguments for the CausalSent benchmarks.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--benchmark", type=str, default="fused", choices=list(BENCHMARKS.keys()), help="Which benchmark to run.")
+    parser.add_argument("--pretrained_model_name", type=str, default="sentence-transformers/msmarco-distilbert-base-v4")
+    parser.add_argument("--head_types", type=str, nargs='+', default=HEAD_TYPES, help="Head types to benchmark. Used for both the sentiment and Riesz heads.")
+    parser.add_argument('--batch_size', type=int, default=16, help='Batch size per view.')
+    parser.add_argument("--max_seq_length", type=int, default=100, help='Sequence length of the synthetic inputs.')
+    parser.add_argument("--warmup_steps", type=int, default=2, help='Untimed steps before measuring.')
+    parser.add_argument("--steps", type=int, default=10, help='Timed steps per configuration.')
+    parser.add_argument("--num_threads", type=int, default=0, help='torch CPU threads. Values <=0 keep the torch default.')
+    parser.add_argument("--seed", type=int, default=11711)
+    # quantization benchmark
+    parser.add_argument("--model_path", type=str, default=None, help="Trained checkpoint (save_model). Required for accuracy/ATE deltas, otherwise only latency is measured.")
+    parser.add_argument("--eval_split", type=str, default="test", help="Dataset split to measure accuracy/ATE deltas on.")
+    parser.add_argument("--limit_data", type=int, default=1000, help="Rows of eval_split to use for accuracy/ATE deltas. Values <=0 use the full split.")
+    parser.add_argument("--seq_lengths", type=int, nargs='+', default=[100, 256, 512], help="Sequence lengths for latency/throughput.")
+    parser.add_argument("--quantize_heads", action='store_true', default=False, help="Also quantize the heads.")
+    # compile benchmark
+    parser.add_argument("--compile_mode", type=str, default=None, help="torch.compile mode, e.g. 'reduce-overhead' or 'max-autotune'.")
+    # checkpoint benchmark
+    parser.add_argument("--checkpoint_every_values", type=int, nargs='+', default=[0, 1, 2], help="Checkpoint every k-th backbone layer settings to compare (0 = off).")
+    # l1 benchmark
+    parser.add_argument("--lambda_l1", type=float, default=1e-5, help="L1 strength for the autograd vs. proximal L1 comparison.")
+    parser.add_argument("--lr", type=float, default=5e-5, help="AdamW learning rate for the L1 and bf16 benchmarks (sets the proximal threshold lr * lambda_l1).")
+    # bf16 benchmark
+    parser.add_argument("--train_steps", type=int, default=0, help="IMDB training steps per precision for the bf16 accuracy comparison (evaluated on --limit_data rows of --eval_split). 0 only times synthetic steps.")
+    # syncs benchmark
+    parser.add_argument("--log_every", type=int, default=10, help="Logging interval (optimizer steps) of the sync benchmark's training loops.")
+    args, unknown = parser.parse_known_args()
+    return args
+
+
+def synthetic_views(vocab_size: int, batch_size: int, max_seq_length: int):
+    """
+    Produce random (input_ids, attention_mask) pairs for the real, treated, and control views,
+    with variable-length right padding like the tokenized datasets.
+    """
+    views = []
+    for _ in range(3):
+        input_ids = torch.randint(1, vocab_size, (batch_size, max_seq_length))
+        lengths = torch.randint(max_seq_length // 4, max_seq_length + 1, (batch_size,))
+        attention_mask = (torch.arange(max_seq_length).unsqueeze(0) < lengths.unsqueeze(1)).long()
+        input_ids = input_ids * attention_mask  # pad token id 0
+        views.append((input_ids, attention_mask))
+    (input_ids_real, attention_mask_real), (input_ids_treated, attention_mask_treated), (input_ids_control, attention_mask_control) = views
+    return (input_ids_real, input_ids_treated, input_ids_control,
+            attention_mask_real, attention_mask_treated, attention_mask_control)
+
+
+def disable_dropout(model: torch.nn.Module):
+    """
+    Turn off dropout while leaving the model in training mode, so the training
+    forward pass is deterministic for parity checks.
+    """
+    for module in model.modules():
+        if isinstance(module, torch.nn.Dropout):
+            module.p = 0.0
+
+
+def benchmark_model(args, head_type: str, device: torch.device = torch.device("cpu")):
+    """
+    Seeded CausalSent with head_type sentiment and Riesz heads, a fully unfrozen backbone and
+    dropout off (see disable_dropout), plus synthetic views of --batch_size rows padded to
+    --max_seq_length on device. Returns (model, inputs).
+    """
+    seed_everything(args.seed)
+    model = CausalSent(pretrained_model_name=args.pretrained_model_name,
+                    sentiment_head_type=head_type,
+                    riesz_head_type=head_type).to(device)
+    model.unfreeze_backbone(num_layers='all')
+    disable_dropout(model)
+    inputs = tuple(view.to(device) for view in
+                synthetic_views(model.backbone.config.vocab_size, args.batch_size, args.max_seq_length))
+    return model, inputs
+
+
+def time_train_steps(model: torch.nn.Module, inputs: tuple, warmup_steps: int, steps: int) -> float:
+    """
+    Time forward + backward of the training forward pass. Returns seconds per step.
+    """
+    model.train()
+    for step in range(warmup_steps + steps):
+        if step == warmup_steps:
+            start = time.perf_counter()
+        outputs = model(*inputs)
+        loss = sum(output.float().mean() for output in outputs)
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+    return (time.perf_counter() - start) / steps
+
+
+def benchmark_fused(args):
+    """
+    Compare the three-call backbone path with the fused single-call path for each head type.
+    """
+    print("\n" + "=" * 50)
+    print("Benchmark: three backbone calls vs. fused backbone call (training step, CPU)")
+    print(f"Batch size per view: {args.batch_size}, Sequence length: {args.max_seq_length}")
+    print("=" * 50)
+
+    results = []
+    for head_type in args.head_types:
+        model, inputs = benchmark_model(args, head_type)
+
+        # ==== Parity of the training forward pass (dropout off) ====
+        model.train()
+        with torch.no_grad():
+            model.fuse_views = False
+            outputs_separate = model(*inputs)
+            model.fuse_views = True
+            outputs_fused = model(*inputs)
+        max_abs_diff = max((separate - fused).abs().max().item()
+                        for separate, fused in zip(outputs_separate, outputs_fused))
+
+        # ==== Throughput ====
+        model.fuse_views = False
+        separate_step_time = time_train_steps(model, inputs, args.warmup_steps, args.steps)
+        model.fuse_views = True
+        fused_step_time = time_train_steps(model, inputs, args.warmup_steps, args.steps)
+
+        results.append({
+            'head_type': head_type,
+            'max_abs_diff': max_abs_diff,
+            'separate_examples_per_sec': args.batch_size / separate_step_time,
+            'fused_examples_per_sec': args.batch_size / fused_step_time,
+            'speedup': separate_step_time / fused_step_time,
+        })
+
+    print(f"\n{'head':<8}{'max |diff|':>14}{'3-call ex/s':>14}{'fused ex/s':>14}{'speedup':>10}")
+    for result in results:
+        print(f"{result['head_type']:<8}"
+            f"{result['max_abs_diff']:>14.2e}"
+            f"{result['separate_examples_per_sec']:>14.2f}"
+            f"{result['fused_examples_per_sec']:>14.2f}"
+            f"{result['speedup']:>9.2f}x")
+    return results
+
+
+def counterfactual_loader(model_args, split: str, limit_data: int, batch_size: int) -> DataLoader:
+    """
+    DataLoader over a dataset split with treated and control counterfactuals, built with the
+    training arguments saved alongside a checkpoint.
+    """
+    data_args = copy.copy(model_args)
+    data_args.limit_data = limit_data
+    if data_args.dataset == "imdb":
+        ds = IMDBDataset(load_imdb_data(split=split), split="train", args=data_args)  # 'train' builds counterfactuals
+    else:
+        ds = CivilCommentsDataset(load_civil_comments_data(split=split), split="train", args=data_args)
+    return DataLoader(ds, batch_size=batch_size, collate_fn=SimilarityDataset.collate_fn)
+
+
+@torch.inference_mode()
+def accuracy_and_ate(model: CausalSent, loader: DataLoader) -> dict:
+    """
+    Eval-mode accuracy on the real texts, the direct ATE E_n[g(X, 1) - g(X, 0)] from the sentiment
+    head, and the Riesz representer ATE E_n[RR(Z) * g(Z)].
+    """
+    model.eval()
+    num_correct, num_examples, direct_te_sum, riesz_te_sum = 0, 0, 0.0, 0.0
+    for batch in loader:
+        (sentiment_real, sentiment_treated, sentiment_control,
+        riesz_real, _, _) = model.forward_views(
+            batch['input_ids_real'], batch['input_ids_treated'], batch['input_ids_control'],
+            batch['attention_mask_real'], batch['attention_mask_treated'], batch['attention_mask_control'],
+        )
+        real_out = torch.sigmoid(sentiment_real).squeeze(-1)
+        num_correct += ((real_out > 0.5).long() == batch['targets'].long()).sum().item()
+        num_examples += real_out.size(0)
+        direct_te_sum += (torch.sigmoid(sentiment_treated) - torch.sigmoid(sentiment_control)).sum().item()
+        riesz_te_sum += (riesz_real.squeeze(-1) * real_out).sum().item()
+    return {
+        'accuracy': num_correct / num_examples,
+        'direct_ate': direct_te_sum / num_examples,
+        'riesz_ate': riesz_te_sum / num_examples,
+    }
+
+
+@torch.inference_mode()
+def time_inference(model: CausalSent, batch_size: int, seq_length: int, warmup_steps: int, steps: int) -> float:
+    """
+    Time the eval sentiment path on synthetic inputs. Returns seconds per batch.
+    """
+    model.eval()
+    input_ids, _, _, attention_mask, _, _ = synthetic_views(model.backbone.config.vocab_size, batch_size, seq_length)
+    attention_mask = torch.ones_like(attention_mask)
+    for step in range(warmup_steps + steps):
+        if step == warmup_steps:
+            start = time.perf_counter()
+        model(input_ids, None, None, attention_mask, None, None)
+    return (time.perf_counter() - start) / steps
+
+
+def benchmark_quantize(args):
+    """
+    Compare fp32 and dynamic int8 CPU inference: accuracy and ATE deltas (with --model_path),
+    latency at batch size 1 and throughput at --batch_size for each of --seq_lengths.
+    """
+    seed_everything(args.seed)
+    if args.model_path is not None:
+        model_fp32, model_args = load_model_inference(args.model_path)
+    else:
+        model_fp32, model_args = CausalSent(pretrained_model_name=args.pretrained_model_name), None
+    model_fp32.eval()
+    model_int8 = copy.deepcopy(model_fp32).quantize_dynamic(quantize_heads=args.quantize_heads)
+
+    print("\n" + "=" * 50)
+    print(f"Benchmark: fp32 vs. dynamic int8 ({model_int8.quantized}) CPU inference")
+    print("=" * 50)
+
+    results = {}
+    if model_args is not None:
+        loader = counterfactual_loader(model_args, args.eval_split, args.limit_data, args.batch_size)
+        metrics_fp32 = accuracy_and_ate(model_fp32, loader)
+        metrics_int8 = accuracy_and_ate(model_int8, loader)
+        print(f"\n{'metric':<12}{'fp32':>10}{'int8':>10}{'delta':>10}")
+        for metric in metrics_fp32:
+            print(f"{metric:<12}{metrics_fp32[metric]:>10.4f}{metrics_int8[metric]:>10.4f}"
+                f"{metrics_int8[metric] - metrics_fp32[metric]:>+10.4f}")
+        results['metrics'] = {'fp32': metrics_fp32, 'int8': metrics_int8}
+    else:
+        print("\nNo --model_path given, skipping accuracy/ATE deltas.")
+
+    print(f"\n{'seq_len':<9}{'fp32 ms (bs=1)':>16}{'int8 ms (bs=1)':>16}{'fp32 ex/s':>12}{'int8 ex/s':>12}{'speedup':>10}")
+    results['timing'] = []
+    for seq_length in args.seq_lengths:
+        latency_fp32 = time_inference(model_fp32, 1, seq_length, args.warmup_steps, args.steps)
+        latency_int8 = time_inference(model_int8, 1, seq_length, args.warmup_steps, args.steps)
+        batch_time_fp32 = time_inference(model_fp32, args.batch_size, seq_length, args.warmup_steps, args.steps)
+        batch_time_int8 = time_inference(model_int8, args.batch_size, seq_length, args.warmup_steps, args.steps)
+        print(f"{seq_length:<9}{1000 * latency_fp32:>16.2f}{1000 * latency_int8:>16.2f}"
+            f"{args.batch_size / batch_time_fp32:>12.2f}{args.batch_size / batch_time_int8:>12.2f}"
+            f"{batch_time_fp32 / batch_time_int8:>9.2f}x")
+        results['timing'].append({
+            'seq_length': seq_length,
+            'latency_ms_fp32': 1000 * latency_fp32,
+            'latency_ms_int8': 1000 * latency_int8,
+            'examples_per_sec_fp32': args.batch_size / batch_time_fp32,
+            'examples_per_sec_int8': args.batch_size / batch_time_int8,
+        })
+    return results
+
+
+def time_varying_lengths(run_step, inputs_by_length: list, steps: int) -> float:
+    """
+    Time run_step over inputs cycling through several sequence lengths (one untimed pass over
+    each length first). Returns seconds per step.
+    """
+    for inputs in inputs_by_length:
+        run_step(inputs)
+    start = time.perf_counter()
+    for step in range(steps):
+        run_step(inputs_by_length[step % len(inputs_by_length)])
+    return (time.perf_counter() - start) / steps
+
+
+def benchmark_compile(args):
+    """
+    Compare eager and torch.compile (dynamic shapes) training and inference step times for each
+    head type, cycling through --seq_lengths to exercise dynamic padding. Reports parity and
+    the number of graphs compiled across sequence lengths (one, except for training 'conv'
+    heads, see CausalSent.compile_forward).
+    """
+    import torch._dynamo
+    print("\n" + "=" * 50)
+    print("Benchmark: eager vs. torch.compile (dynamic shapes, CPU)")
+    print(f"Batch size per view: {args.batch_size}, Sequence lengths: {args.seq_lengths}, mode: {args.compile_mode}")
+    print("=" * 50)
+
+    def train_step(model):
+        def run(inputs):
+            outputs = model(*inputs)
+            loss = sum(output.float().mean() for output in outputs)
+            loss.backward()
+            model.zero_grad(set_to_none=True)
+        return run
+
+    def inference_step(model):
+        @torch.inference_mode()
+        def run(inputs):
+            model(inputs[0], None, None, inputs[3], None, None)
+        return run
+
+    results = []
+    for head_type in args.head_types:
+        model, _ = benchmark_model(args, head_type)
+        compiled_model = copy.deepcopy(model).compile_forward(mode=args.compile_mode)
+        inputs_by_length = [synthetic_views(model.backbone.config.vocab_size, args.batch_size, seq_length)
+                            for seq_length in args.seq_lengths]
+
+        result = {'head_type': head_type}
+        for phase, make_step, train in [('train', train_step, True), ('inference', inference_step, False)]:
+            model.train(train)
+            compiled_model.train(train)
+            # ==== Parity (dropout off) ====
+            with torch.no_grad():
+                outputs_eager = model(*inputs_by_length[0])
+                outputs_compiled = compiled_model(*inputs_by_length[0])
+            if not train:
+                outputs_eager, outputs_compiled = [outputs_eager], [outputs_compiled]
+            result[f'{phase}_max_abs_diff'] = max((eager - compiled).abs().max().item()
+                                                for eager, compiled in zip(outputs_eager, outputs_compiled))
+            # ==== Step time ====
+            torch._dynamo.utils.counters.clear()
+            result[f'{phase}_eager_step'] = time_varying_lengths(make_step(model), inputs_by_length, args.steps)
+            result[f'{phase}_compiled_step'] = time_varying_lengths(make_step(compiled_model), inputs_by_length, args.steps)
+            result[f'{phase}_graphs'] = torch._dynamo.utils.counters['stats']['unique_graphs']
+        results.append(result)
+
+    print(f"\n{'head':<8}{'phase':<11}{'max |diff|':>12}{'eager ms':>10}{'compiled ms':>13}{'speedup':>9}{'graphs':>8}")
+    for result in results:
+        for phase in ['train', 'inference']:
+            print(f"{result['head_type']:<8}{phase:<11}"
+                f"{result[f'{phase}_max_abs_diff']:>12.2e}"
+                f"{1000 * result[f'{phase}_eager_step']:>10.2f}"
+                f"{1000 * result[f'{phase}_compiled_step']:>13.2f}"
+                f"{result[f'{phase}_eager_step'] / result[f'{phase}_compiled_step']:>8.2f}x"
+                f"{result[f'{phase}_graphs']:>8}")
+    return results
+
+
+def benchmark_packed(args):
+    """
+    Compare the padded backbone with packed (unpadded) execution for each head type on
+    variable-length synthetic batches padded to --max_seq_length: parity, training step and
+    inference throughput in real tokens/sec, and the fraction of padded tokens skipped.
+    """
+    print("\n" + "=" * 50)
+    print("Benchmark: padded vs. packed backbone (CPU)")
+    print(f"Batch size per view: {args.batch_size}, Padded length: {args.max_seq_length}")
+    print("=" * 50)
+
+    results = []
+    for head_type in args.head_types:
+        model, inputs = benchmark_model(args, head_type)
+        attention_masks = inputs[3:]
+        real_tokens = sum(attention_mask.sum().item() for attention_mask in attention_masks)
+        padded_tokens = sum(attention_mask.numel() for attention_mask in attention_masks)
+
+        # ==== Parity (dropout off). Exact for pooled heads; 'conv' heads see zeros at pad positions ====
+        model.train()
+        with torch.no_grad():
+            model.pack_sequences = False
+            outputs_padded = model(*inputs)
+            model.pack_sequences = True
+            outputs_packed = model(*inputs)
+        max_abs_diff = max((padded - packed).abs().max().item()
+                        for padded, packed in zip(outputs_padded, outputs_packed))
+
+        # ==== Throughput ====
+        step_times = {}
+        for pack_sequences in [False, True]:
+            model.pack_sequences = pack_sequences
+            step_times[('train', pack_sequences)] = time_train_steps(model, inputs, args.warmup_steps, args.steps)
+            model.eval()
+            with torch.inference_mode():
+                step_times[('inference', pack_sequences)] = time_varying_lengths(
+                    lambda views: model(views[0], None, None, views[3], None, None), [inputs], args.steps
+                )
+        results.append({
+            'head_type': head_type,
+            'max_abs_diff': max_abs_diff,
+            'padding_skipped': 1 - real_tokens / padded_tokens,
+            **{f'{phase}_{"packed" if packed else "padded"}_tokens_per_sec': (real_tokens if phase == 'train' else attention_masks[0].sum().item()) / step_time
+            for (phase, packed), step_time in step_times.items()},
+        })
+
+    print(f"\n{'head':<8}{'max |diff|':>12}{'pad skipped':>13}{'train tok/s':>13}{'packed':>10}{'infer tok/s':>13}{'packed':>10}")
+    for result in results:
+        print(f"{result['head_type']:<8}"
+            f"{result['max_abs_diff']:>12.2e}"
+            f"{result['padding_skipped']:>12.1%} "
+            f"{result['train_padded_tokens_per_sec']:>13.1f}"
+            f"{result['train_packed_tokens_per_sec']:>10.1f}"
+            f"{result['inference_padded_tokens_per_sec']:>13.1f}"
+            f"{result['inference_packed_tokens_per_sec']:>10.1f}")
+    return results
+
+
+def saved_activations_mb(model: CausalSent, inputs: tuple) -> float:
+    """
+    Memory of the tensors autograd keeps alive for backward after one training forward pass
+    (unique storages, parameters excluded), i.e. the activation memory checkpointing reduces.
+    Tensors saved inside checkpointed layers are handled by the checkpoint and not kept.
+    """
+    parameter_storages = {param.untyped_storage().data_ptr() for param in model.parameters()}
+    saved_storages = {}
+
+    def pack_hook(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in parameter_storages:
+            saved_storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    model.train()
+    with torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda tensor: tensor):
+        outputs = model(*inputs)
+    sum(output.float().mean() for output in outputs).backward()
+    model.zero_grad(set_to_none=True)
+    return sum(saved_storages.values()) / 2**20
+
+
+def benchmark_checkpoint(args):
+    """
+    Compare activation checkpointing of every k-th backbone layer (--checkpoint_every_values)
+    with a fully unfrozen backbone: parity of the gradients, saved activation memory (and peak
+    CUDA memory when available), and training step time.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print("\n" + "=" * 50)
+    print(f"Benchmark: activation checkpointing every k backbone layers (training step, {device.type})")
+    print(f"Batch size per view: {args.batch_size}, Sequence length: {args.max_seq_length}")
+    print("=" * 50)
+
+    results = []
+    for head_type in args.head_types:
+        model, inputs = benchmark_model(args, head_type, device)
+
+        reference_grads = None
+        for every in args.checkpoint_every_values:
+            model.enable_gradient_checkpointing(every=every)
+            # ==== Gradient parity with the first setting ====
+            model.train()
+            outputs = model(*inputs)
+            sum(output.float().mean() for output in outputs).backward()
+            grads = [param.grad.clone() for param in model.parameters() if param.grad is not None]
+            model.zero_grad(set_to_none=True)
+            if reference_grads is None:
+                reference_grads = grads
+            max_abs_diff = max((grad - reference).abs().max().item() for grad, reference in zip(grads, reference_grads))
+
+            activations_mb = saved_activations_mb(model, inputs)
+            if device.type == 'cuda':
+                torch.cuda.reset_peak_memory_stats(device)
+            step_time = time_train_steps(model, inputs, args.warmup_steps, args.steps)
+            results.append({
+                'head_type': head_type,
+                'checkpoint_every': every,
+                'num_checkpointed': sum(getattr(layer, 'checkpoint_activations', False) for layer in model.backbone_layers()),
+                'max_abs_grad_diff': max_abs_diff,
+                'saved_activations_mb': activations_mb,
+                'peak_cuda_mb': torch.cuda.max_memory_allocated(device) / 2**20 if device.type == 'cuda' else None,
+                'step_time': step_time,
+            })
+
+    print(f"\n{'head':<8}{'every':>6}{'layers':>8}{'max |grad diff|':>17}{'activations MB':>16}{'peak CUDA MB':>14}{'s/step':>9}{'ex/s':>9}")
+    for result in results:
+        peak = f"{result['peak_cuda_mb']:.0f}" if result['peak_cuda_mb'] is not None else "-"
+        print(f"{result['head_type']:<8}{result['checkpoint_every']:>6}{result['num_checkpointed']:>8}"
+            f"{result['max_abs_grad_diff']:>17.2e}{result['saved_activations_mb']:>16.1f}{peak:>14}"
+            f"{result['step_time']:>9.3f}{args.batch_size / result['step_time']:>9.2f}")
+    return results
+
+
+def time_optimizer_steps(model: CausalSent, inputs: tuple, lr: float, lambda_l1: float, mode: str,
+                        warmup_steps: int, steps: int, autocast: bool = False) -> float:
+    """
+    Time full AdamW training steps (forward, backward, optimizer step) with L1 regularization
+    applied as mode: 'none', 'autograd' (lambda_l1 * sum(|theta|) added to the loss), or
+    'proximal' (ProximalL1 soft-threshold after the step). With autocast the forward pass runs
+    in bfloat16. Returns seconds per step.
+    """
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr)
+    proximal_l1 = ProximalL1(optimizer, lambda_l1 if mode == 'proximal' else 0.0)
+    model.train()
+    for step in range(warmup_steps + steps):
+        if step == warmup_steps:
+            start = time.perf_counter()
+        with mixed_precision(torch.device("cpu"), autocast):
+            outputs = model(*inputs)
+        loss = sum(output.float().mean() for output in outputs)
+        if mode == 'autograd':
+            loss = loss + lambda_l1 * sum(torch.sum(torch.abs(param)) for param in model.parameters() if param.requires_grad)
+        loss.backward()
+        optimizer.step()
+        proximal_l1.step()
+        optimizer.zero_grad(set_to_none=True)
+    return (time.perf_counter() - start) / steps
+
+
+def benchmark_l1(args):
+    """
+    Compare L1 regularization as an autograd penalty in the loss with the proximal soft-threshold
+    step (ProximalL1) on a fully unfrozen model: correctness of the soft-threshold against
+    sign(theta) * max(|theta| - lr * lambda, 0), and AdamW step time without L1,
+    with the autograd penalty, and with the proximal step.
+    """
+    print("\n" + "=" * 50)
+    print("Benchmark: autograd L1 penalty vs. proximal L1 step (AdamW training step, CPU)")
+    print(f"Batch size per view: {args.batch_size}, Sequence length: {args.max_seq_length}, lambda_l1: {args.lambda_l1}, lr: {args.lr}")
+    print("=" * 50)
+
+    results = []
+    for head_type in args.head_types:
+        model, inputs = benchmark_model(args, head_type)
+
+        # ==== Soft-threshold matches the L1 proximal operator ====
+        # (large lambda so the threshold is above many weights and zeroes them)
+        threshold = args.lr * 1e2
+        for param in model.parameters():
+            param.grad = torch.zeros_like(param)
+        expected = [torch.sign(param) * torch.clamp(param.abs() - threshold, min=0) for param in model.parameters()]
+        original_state = copy.deepcopy(model.state_dict())
+        ProximalL1(torch.optim.SGD(model.parameters(), lr=args.lr), 1e2).step()
+        max_abs_diff = max((param - reference).abs().max().item() for param, reference in zip(model.parameters(), expected))
+        zero_fraction = (sum((param == 0).sum().item() for param in model.parameters())
+                        / sum(param.numel() for param in model.parameters()))
+        model.load_state_dict(original_state)
+        model.zero_grad(set_to_none=True)
+
+        step_times = {}
+        for mode in ['none', 'autograd', 'proximal']:
+            model.load_state_dict(original_state)
+            step_times[mode] = time_optimizer_steps(model, inputs, args.lr, args.lambda_l1, mode,
+                                                    args.warmup_steps, args.steps)
+        results.append({
+            'head_type': head_type,
+            'max_abs_prox_diff': max_abs_diff,
+            'zero_fraction': zero_fraction,
+            'step_times': step_times,
+        })
+
+    print(f"\n{'head':<8}{'max |prox diff|':>17}{'zeroed':>9}{'no L1 s/step':>14}{'autograd s/step':>17}{'proximal s/step':>17}{'speedup':>10}")
+    for result in results:
+        step_times = result['step_times']
+        print(f"{result['head_type']:<8}{result['max_abs_prox_diff']:>17.2e}{result['zero_fraction']:>9.2%}"
+            f"{step_times['none']:>14.3f}{step_times['autograd']:>17.3f}"
+            f"{step_times['proximal']:>17.3f}{step_times['autograd'] / step_times['proximal']:>9.2f}x")
+    return results
+
+
+def train_imdb_steps(model: CausalSent, loader: DataLoader, lr: float, steps: int, autocast: bool) -> float:
+    """
+    Train the sentiment head and backbone with BCE on the real texts of loader for steps AdamW
+    steps (cycling over the loader), with a bfloat16 or fp32 forward pass and fp32 loss.
+    Returns seconds per step.
+    """
+    optimizer = torch.optim.AdamW(model.parameters(), lr=lr)
+    bce_loss = torch.nn.BCEWithLogitsLoss()
+    model.train()
+    step, elapsed = 0, 0.0
+    while step < steps:
+        for batch in loader:
+            start = time.perf_counter()
+            with mixed_precision(torch.device("cpu"), autocast):
+                # the 'bce' term reads the real view only, the counterfactual views are not encoded
+                sentiment_real = model(batch['input_ids_real'], batch['input_ids_treated'], batch['input_ids_control'],
+                                    batch['attention_mask_real'], batch['attention_mask_treated'], batch['attention_mask_control'],
+                                    terms={'bce'})[0]
+            loss = bce_loss(sentiment_real.float().squeeze(-1), batch['targets'].float())
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            elapsed += time.perf_counter() - start
+            step += 1
+            if step == steps:
+                break
+    return elapsed / steps
+
+
+def benchmark_bf16(args):
+    """
+    Compare fp32 and bfloat16 autocast (CPU) training: output parity and AdamW step time on synthetic
+    inputs for each head type, and with --train_steps, step time and accuracy / ATE of the default
+    model after training on IMDB in each precision from the same initialization.
+    """
+    device = torch.device("cpu")
+    print("\n" + "=" * 50)
+    print("Benchmark: fp32 vs. bfloat16 autocast training (CPU)")
+    print(f"Native bf16: {torch.ops.mkldnn._is_mkldnn_bf16_supported()}, CPU capability: {torch.backends.cpu.get_cpu_capability()}")
+    print(f"Batch size per view: {args.batch_size}, Sequence length: {args.max_seq_length}")
+    print("=" * 50)
+
+    results = {'synthetic': []}
+    for head_type in args.head_types:
+        model, inputs = benchmark_model(args, head_type)
+
+        # ==== Output parity of the training forward pass ====
+        model.train()
+        with torch.no_grad():
+            outputs_fp32 = model(*inputs)
+            with mixed_precision(device):
+                outputs_bf16 = model(*inputs)
+        max_abs_diff = max((fp32 - bf16.float()).abs().max().item() for fp32, bf16 in zip(outputs_fp32, outputs_bf16))
+
+        original_state = copy.deepcopy(model.state_dict())
+        fp32_step_time = time_optimizer_steps(model, inputs, args.lr, 0.0, 'none', args.warmup_steps, args.steps)
+        model.load_state_dict(original_state)
+        bf16_step_time = time_optimizer_steps(model, inputs, args.lr, 0.0, 'none', args.warmup_steps, args.steps, autocast=True)
+        results['synthetic'].append({
+            'head_type': head_type,
+            'max_abs_diff': max_abs_diff,
+            'fp32_step_time': fp32_step_time,
+            'bf16_step_time': bf16_step_time,
+        })
+
+    print(f"\n{'head':<8}{'max |diff|':>14}{'fp32 s/step':>13}{'bf16 s/step':>13}{'fp32 ex/s':>11}{'bf16 ex/s':>11}{'speedup':>10}")
+    for result in results['synthetic']:
+        print(f"{result['head_type']:<8}{result['max_abs_diff']:>14.2e}"
+            f"{result['fp32_step_time']:>13.3f}{result['bf16_step_time']:>13.3f}"
+            f"{args.batch_size / result['fp32_step_time']:>11.2f}{args.batch_size / result['bf16_step_time']:>11.2f}"
+            f"{result['fp32_step_time'] / result['bf16_step_time']:>9.2f}x")
+
+    if args.train_steps <= 0:
+        print("\nNo --train_steps given, skipping the IMDB accuracy comparison.")
+        return results
+
+    # ==== IMDB: train the default model in each precision from the same init ====
+    data_args = get_default_sent_training_args('causal_sent')
+    data_args.max_seq_length = args.max_seq_length
+    seed_everything(args.seed)
+    train_loader = counterfactual_loader(data_args, 'train', args.limit_data, args.batch_size)
+    eval_loader = counterfactual_loader(data_args, args.eval_split, args.limit_data, args.batch_size)
+    seed_everything(args.seed)
+    initial_model = CausalSent(pretrained_model_name=args.pretrained_model_name)
+    initial_model.unfreeze_backbone(num_layers='all')
+
+    results['imdb'] = {}
+    for precision, autocast in [('fp32', False), ('bf16', True)]:
+        seed_everything(args.seed)
+        model = copy.deepcopy(initial_model)
+        step_time = train_imdb_steps(model, train_loader, args.lr, args.train_steps, autocast)
+        with mixed_precision(device, autocast):
+            metrics = accuracy_and_ate(model, eval_loader)
+        results['imdb'][precision] = {'step_time': step_time, **metrics}
+
+    print(f"\nIMDB: {args.train_steps} training steps, {args.limit_data} rows, evaluated on '{args.eval_split}'")
+    print(f"{'metric':<12}{'fp32':>10}{'bf16':>10}{'delta':>10}")
+    for metric in results['imdb']['fp32']:
+        fp32_value, bf16_value = results['imdb']['fp32'][metric], results['imdb']['bf16'][metric]
+        print(f"{metric:<12}{fp32_value:>10.4f}{bf16_value:>10.4f}{bf16_value - fp32_value:>+10.4f}")
+    return results
+
+
+def sync_training_steps(model: CausalSent, inputs: tuple, targets: torch.Tensor, flags: tuple, steps: int, 
+                        log_every: int, host_accumulators: bool) -> SyncCounter:
+    """
+    Run steps AdamW training steps (bce + reg + riesz losses, running Riesz ATE, training metrics, 
+    logging every log_every steps) under a SyncCounter, with the accumulators of train_causal_sent 
+    kept on the device, or with host_accumulators as the loop did before: .item() per step for the 
+    loss and running ATE, and predictions and targets copied to the host for sklearn metrics. 
+    Returns the counter.
+    """
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+    device = targets.device
+    metrics = StreamingBinaryMetrics(device)
+    total_loss, train_targets, train_predictions = torch.zeros((), device=device), [], []
+    running_ate_numer = 0.0 if host_accumulators else torch.zeros(1, dtype=torch.float64, device=device)
+    running_ate_denom = 0
+    sync_counter = SyncCounter()
+    model.train()
+    with sync_counter:
+        for step in range(steps):
+            optimizer.zero_grad()
+            with sync_counter.region('forward'):
+                (sentiment_real, sentiment_treated, sentiment_control, 
+                riesz_real, riesz_treated, riesz_control) = model(*inputs, *flags)
+            real_out = torch.sigmoid(sentiment_real)
+            batch_numer = torch.sum(riesz_real * real_out, dim=0).detach()
+            running_ate_denom += targets.size(0)
+            if host_accumulators:
+                running_ate_numer += batch_numer.item()
+                tau_hat = torch.Tensor([running_ate_numer / running_ate_denom]).to(device)
+            else:
+                running_ate_numer += batch_numer
+                tau_hat = (running_ate_numer / running_ate_denom).float()
+            loss = (torch.nn.functional.binary_cross_entropy_with_logits(sentiment_real.squeeze(-1), targets)
+                    + torch.mean(((torch.sigmoid(sentiment_treated) - torch.sigmoid(sentiment_control)) - tau_hat) ** 2)
+                    + torch.mean(-2 * (riesz_treated - riesz_control) + riesz_real ** 2))
+            with sync_counter.region('backward'):
+                loss.backward()
+            with sync_counter.region('optimizer'):
+                optimizer.step()
+            if host_accumulators:
+                total_loss += loss.item()
+                train_predictions.extend((real_out.squeeze(-1).detach().cpu().numpy() > 0.5).astype(int))
+                train_targets.extend(targets.cpu().numpy())
+            else:
+                total_loss += loss.detach()
+                metrics.update(real_out.squeeze(-1).detach(), targets)
+            with sync_counter.region('logging'):
+                if (step + 1) % log_every == 0:
+                    accuracy = (sum(int(p == t) for p, t in zip(train_predictions, train_targets)) / len(train_targets) 
+                                if host_accumulators else metrics.compute()['accuracy'])
+                    logged = (loss.item(), accuracy, tau_hat.item())  # values the training loop logs
+    return sync_counter
+
+
+def benchmark_syncs(args):
+    """
+    Host synchronization points per training step, before and after train_causal_sent kept its 
+    accumulators (loss, running ATE, training metrics) on the device, for the padded backbone, 
+    --pack_sequences, and deduplicated counterfactual views (about half of the rows identical to 
+    the real text). Syncs are counted in every region of the step, backward and the optimizer 
+    step included, and listed by source.
+    """
+    print("\n" + "=" * 50)
+    print("Benchmark: host sync points per training step, host vs. device accumulators")
+    print(f"Batch size per view: {args.batch_size}, Sequence length: {args.max_seq_length}, Steps: {args.steps}, log_every: {args.log_every}")
+    print("=" * 50)
+
+    results = []
+    for head_type in args.head_types:
+        for mode in ['padded', 'packed', 'dedup']:
+            model, inputs = benchmark_model(args, head_type)
+            model.pack_sequences = mode == 'packed'
+            targets = torch.randint(0, 2, (args.batch_size,)).float()
+            flags = ()
+            if mode == 'dedup':
+                flags = tuple(torch.rand(args.batch_size) < 0.5 for _ in range(2))  # treated_is_real, control_is_real
+            original_state = copy.deepcopy(model.state_dict())
+            for accumulators, host_accumulators in [('host (before)', True), ('device (after)', False)]:
+                model.load_state_dict(original_state)
+                sync_counter = sync_training_steps(model, inputs, targets, flags, args.steps, args.log_every, host_accumulators)
+                results.append({'head_type': head_type, 'mode': mode, 'accumulators': accumulators, 
+                                'syncs_per_step': sync_counter.count / args.steps, 'sources': sync_counter.report(args.steps)})
+
+    print(f"\n{'head':<8}{'backbone':<10}{'accumulators':<16}{'syncs/step':>11}")
+    for result in results:
+        print(f"{result['head_type']:<8}{result['mode']:<10}{result['accumulators']:<16}{result['syncs_per_step']:>11.2f}")
+    for result in results:
+        print(f"\n{result['head_type']}, {result['mode']}, {result['accumulators']}:\n{result['sources']}")
+    return results
+
+
+BENCHMARKS = {
+    'fused': benchmark_fused,
+    'quantize': benchmark_quantize,
+    'compile': benchmark_compile,
+    'packed': benchmark_packed,
+    'checkpoint': benchmark_checkpoint,
+    'l1': benchmark_l1,
+    'bf16': benchmark_bf16,
+    'syncs': benchmark_syncs,
+}
+
+
+if __name__ == "__main__":
+    args = get_benchmark_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    BENCHMARKS[args.benchmark](args)
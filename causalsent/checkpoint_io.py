@@ -0,0 +1,252 @@
+"""
+CausalSent checkpoints written on a background thread, as .pt or safetensors files.
+
+save_model pickles the whole model and optimizer with a synchronous torch.save.
+Here the training thread only snapshots the tensors (a host copy, so training
+can keep updating the parameters) and a background thread writes them to a
+temporary file that is atomically renamed over the checkpoint, so a reader or
+a crash never sees a partial file. Everything that is not a tensor (architecture,
+training arguments, optimizer hyperparameters, RNG state) is JSON metadata.
+
+The file format follows the extension: '.safetensors' files store the metadata in
+the safetensors header, with spare room so update_checkpoint_metadata rewrites only
+the header; any other path (best_model.pt) is a torch.save of the save_model layout.
+
+With trainable_only, only the heads and the backbone parameters being trained
+(or the LoRA adapters) are stored; the frozen backbone weights are reloaded from
+pretrained_model_name, which the checkpoint records.
+
+Resumable checkpoints also carry a training_state (epoch, batch, loop accumulators):
+its tensors are stored under 'state.' and everything else in the metadata.
+
+read_checkpoint returns the same dict layout as a torch.save checkpoint written by
+save_model, so load_model_inference handles both formats.
+
+Metadata values must be JSON types (NumPy scalars are converted); anything else raises
+a TypeError instead of being stored as its string.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import random
+import struct
+import threading
+import numpy as np
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+METADATA_KEY = 'causalsent'
+MODEL_PREFIX = 'model.'
+OPTIMIZER_PREFIX = 'optimizer.'
+STATE_PREFIX = 'state.'
+RESERVE_KEY = 'reserve'  # safetensors header padding, room for in-place metadata updates
+HEADER_RESERVE = 512  # bytes
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"[ERROR] Checkpoint metadata holds a {type(value).__name__} ({value!r}), which is not JSON serializable. "
+                    "Convert it to a JSON type (or store it as a tensor) before saving.")
+
+
+def metadata_json(metadata: dict) -> str:
+    """Serialize checkpoint metadata to JSON, raising a TypeError on values that are not JSON types."""
+    return json.dumps(metadata, default=_json_default)
+
+
+def checkpoint_contents(model, optimizer, args, trainable_only: bool = False,
+                        include_optimizer: bool = True, training_state: dict = None) -> tuple:
+    """
+    Tensors and JSON metadata of a checkpoint. Tensors are references into the live model and
+    optimizer, snapshot them (AsyncCheckpointWriter.save) before training continues.
+
+    Parameters:
+    - model: CausalSent
+        The model to save.
+    - optimizer: torch.optim.Optimizer
+        The optimizer to save (its state tensors, hyperparameters in the metadata).
+    - args: argparse.Namespace
+        Training arguments to save.
+    - trainable_only: bool, default=False
+        Store only the heads and the trainable (or LoRA adapter) backbone weights.
+    - include_optimizer: bool, default=True
+        Store the optimizer state.
+    - training_state: dict, default=None
+        Training loop state to resume from (tensor, JSON-serializable, or None values).
+
+    Returns:
+    - tensors: Dict[str, torch.Tensor]
+    - metadata: dict
+    """
+    tensors = {MODEL_PREFIX + name: tensor for name, tensor in model.trainable_state_dict(trainable_only=trainable_only).items()}
+    metadata = {
+        'model_class': f"{model.__class__.__module__}.{model.__class__.__qualname__}",
+        'pretrained_model_name': args.pretrained_model_name,
+        'sentiment_head_type': args.sentiment_head_type,
+        'riesz_head_type': args.riesz_head_type,
+        'temperature': float(getattr(model, 'temperature', 1.0)),
+        'temperature_fitted': getattr(model, 'temperature_fitted', False),
+        'lora_config': getattr(model, 'lora_config', None),
+        'num_treatment_phrases': getattr(model, 'num_treatment_phrases', 1),
+        'trainable_only': trainable_only,
+        'args': vars(args),
+        'system_rng': random.getstate(),
+    }
+    numpy_rng = np.random.get_state()
+    metadata['numpy_rng'] = [numpy_rng[0], None, *numpy_rng[2:]]  # key array stored as a tensor
+    tensors['rng.numpy'] = torch.from_numpy(numpy_rng[1].astype(np.int64))
+    tensors['rng.torch'] = torch.random.get_rng_state()
+    if torch.cuda.is_available():
+        tensors['rng.cuda'] = torch.cuda.get_rng_state()
+    if include_optimizer:
+        optimizer_state = optimizer.state_dict()
+        metadata['optimizer_param_groups'] = optimizer_state['param_groups']
+        for index, state in optimizer_state['state'].items():
+            for name, value in state.items():
+                tensors[f"{OPTIMIZER_PREFIX}{index}.{name}"] = value if torch.is_tensor(value) else torch.tensor(value)
+    if training_state is not None:
+        metadata['training_state'] = {name: value for name, value in training_state.items() if not torch.is_tensor(value)}
+        for name, value in training_state.items():
+            if torch.is_tensor(value):
+                tensors[STATE_PREFIX + name] = value
+    return tensors, metadata
+
+
+def write_checkpoint(tensors: dict, metadata: dict, filepath: str):
+    """
+    Write tensors and metadata to filepath (safetensors for '.safetensors' paths, torch.save of the
+    save_model layout otherwise), through a temporary file in the same directory that is flushed and 
+    atomically renamed over filepath.
+    """
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    temporary_path = f"{filepath}.tmp"
+    if filepath.endswith('.safetensors'):
+        save_file(tensors, temporary_path, metadata={METADATA_KEY: metadata_json(metadata), RESERVE_KEY: ' ' * HEADER_RESERVE})
+    else:
+        torch.save(_as_checkpoint(tensors, json.loads(metadata_json(metadata))), temporary_path)
+    with open(temporary_path, 'rb') as file:
+        os.fsync(file.fileno())
+    os.replace(temporary_path, filepath)
+
+
+def _read(filepath: str) -> tuple:
+    with safe_open(filepath, framework='pt', device='cpu') as file:
+        metadata = json.loads(file.metadata()[METADATA_KEY])
+        tensors = {name: file.get_tensor(name) for name in file.keys()}
+    return tensors, metadata
+
+
+def read_checkpoint(filepath: str) -> dict:
+    """
+    Read a safetensors checkpoint written by write_checkpoint into the layout of a save_model 
+    checkpoint (model_state_dict, optimizer_state_dict, args, model_class, ...), plus 'trainable_only' 
+    and, for resumable checkpoints, 'training_state'.
+    """
+    return _as_checkpoint(*_read(filepath))
+
+
+def _as_checkpoint(tensors: dict, metadata: dict) -> dict:
+    """Checkpoint tensors and metadata in the layout of a save_model checkpoint (see read_checkpoint)."""
+    module_name, class_name = metadata['model_class'].rsplit('.', 1)
+    checkpoint = {key: value for key, value in metadata.items()
+                if key not in ['model_class', 'args', 'system_rng', 'numpy_rng', 'optimizer_param_groups']}
+    checkpoint['model_class'] = getattr(importlib.import_module(module_name), class_name)
+    checkpoint['args'] = argparse.Namespace(**metadata['args'])
+    checkpoint['model_state_dict'] = {name[len(MODEL_PREFIX):]: tensor for name, tensor in tensors.items()
+                                    if name.startswith(MODEL_PREFIX)}
+    if 'optimizer_param_groups' in metadata:
+        optimizer_state = {}
+        for name, tensor in tensors.items():
+            if name.startswith(OPTIMIZER_PREFIX):
+                index, state_name = name[len(OPTIMIZER_PREFIX):].split('.', 1)
+                optimizer_state.setdefault(int(index), {})[state_name] = tensor
+        checkpoint['optimizer_state_dict'] = {'state': optimizer_state, 'param_groups': metadata['optimizer_param_groups']}
+    system_rng = metadata['system_rng']
+    checkpoint['system_rng'] = (system_rng[0], tuple(system_rng[1]), system_rng[2])
+    numpy_rng = metadata['numpy_rng']
+    checkpoint['numpy_rng'] = (numpy_rng[0], tensors['rng.numpy'].numpy().astype(np.uint32), *numpy_rng[2:])
+    checkpoint['torch_rng'] = tensors['rng.torch']
+    if 'rng.cuda' in tensors:
+        checkpoint['cuda_rng'] = tensors['rng.cuda']
+    if 'training_state' in metadata:
+        for name, tensor in tensors.items():
+            if name.startswith(STATE_PREFIX):
+                checkpoint['training_state'][name[len(STATE_PREFIX):]] = tensor
+    return checkpoint
+
+
+def set_rng_state(checkpoint: dict):
+    """Restore the Python, NumPy, torch (and CUDA, if saved and available) RNG states of a checkpoint."""
+    random.setstate(checkpoint['system_rng'])
+    np.random.set_state(checkpoint['numpy_rng'])
+    torch.random.set_rng_state(checkpoint['torch_rng'])
+    if 'cuda_rng' in checkpoint and torch.cuda.is_available():
+        torch.cuda.set_rng_state(checkpoint['cuda_rng'])
+
+
+def update_checkpoint_metadata(filepath: str, **fields):
+    """
+    Overwrite or add top-level metadata fields of a safetensors checkpoint written by write_checkpoint.
+
+    The header is rewritten in place when the updated metadata fits in the header's reserved room
+    (a single small write, the tensor data is untouched). Otherwise the whole file is rewritten
+    atomically.
+    """
+    with open(filepath, 'r+b') as file:
+        header_size = struct.unpack('<Q', file.read(8))[0]
+        header = json.loads(file.read(header_size))
+        metadata = json.loads(header['__metadata__'][METADATA_KEY])
+        metadata.update(fields)
+        header['__metadata__'][METADATA_KEY] = metadata_json(metadata)
+        header['__metadata__'].pop(RESERVE_KEY, None)  # its room becomes trailing header padding
+        encoded_header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        if len(encoded_header) <= header_size:
+            file.seek(8)
+            file.write(encoded_header.ljust(header_size, b' '))  # safetensors headers may end in spaces
+            file.flush()
+            os.fsync(file.fileno())
+            return
+    tensors, _ = _read(filepath)
+    write_checkpoint(tensors, metadata, filepath)
+
+
+class AsyncCheckpointWriter:
+    """
+    Write checkpoints on a background thread. save() blocks only to snapshot the tensors to host
+    memory (and, if the previous write is still running, until it finishes, so at most one
+    snapshot is held). Call wait() before reading a checkpoint back; errors of a background
+    write are raised by the next save() or wait().
+    """
+    def __init__(self):
+        self._thread: threading.Thread = None
+        self._error: BaseException = None
+
+    def save(self, tensors: dict, metadata: dict, filepath: str):
+        """
+        Snapshot tensors (copies on the CPU) and write them with metadata to filepath in the background.
+        """
+        self.wait()
+        snapshot = {name: tensor.detach().to('cpu', copy=True).contiguous() for name, tensor in tensors.items()}
+        metadata = json.loads(metadata_json(metadata))  # snapshot the metadata too, raising here on unsupported values
+        self._thread = threading.Thread(target=self._write, args=(snapshot, metadata, filepath), daemon=True)
+        self._thread.start()
+
+    def _write(self, tensors: dict, metadata: dict, filepath: str):
+        try:
+            write_checkpoint(tensors, metadata, filepath)
+            print(f"Model saved to {filepath}")
+        except BaseException as error:
+            self._error = error
+
+    def wait(self):
+        """Block until the pending write (if any) is on disk, re-raising its error."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
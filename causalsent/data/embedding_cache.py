@@ -0,0 +1,299 @@
+"""
+Precomputed backbone embedding caches.
+
+When the backbone is fully frozen (--unfreeze_backbone top0), its outputs for a
+given text never change, so each split is encoded once and the pooled embeddings
+(or full sequences for 'conv' heads) are stored as memory-mapped float16 .npy files.
+Training then feeds the Riesz and sentiment heads straight from the store.
+
+When only the top layers are unfrozen (--unfreeze_backbone top{n}), the hidden
+states out of the last frozen layer are cached the same way and training only
+runs the trainable top layers (--cache_frozen_layers).
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+from tqdm.auto import tqdm
+from typing import Callable, Dict
+
+
+VIEWS = ['real', 'treated', 'control']
+
+
+def encodings_fingerprint(dataset) -> str:
+    """
+    Hash the tokenized inputs of every view in a SimilarityDataset, so a store is only
+    reused for exactly the same texts (e.g. same --limit_data sample, same synthetic ATE labels).
+    """
+    hasher = hashlib.sha256()
+    for view in VIEWS:
+        encodings = getattr(dataset, f"encodings_{view}", None)
+        if encodings is None:
+            continue
+        hasher.update(view.encode())
+        for encoding in encodings:
+            hasher.update(encoding['input_ids'].numpy().tobytes())
+            hasher.update(encoding['attention_mask'].numpy().tobytes())
+    return hasher.hexdigest()
+
+
+def embedding_cache_key(pretrained_model_name: str,
+                        max_seq_length: int,
+                        treatment_phrase: str,
+                        split: str,
+                        store_sequences: bool,
+                        fingerprint: str,
+                        num_frozen_layers: int = None,
+                        zero_pad_states: bool = False) -> str:
+    """
+    Directory name for an embedding store. Keyed by model, max_seq_length, treatment
+    phrase, split, pooled vs. sequence storage, the tokenized inputs fingerprint, for
+    layer stores the number of frozen layers the activations come out of, and whether
+    stored sequences hold zeros at pad positions (--pack_sequences).
+    """
+    key_info = json.dumps({
+        'pretrained_model_name': pretrained_model_name,
+        'max_seq_length': max_seq_length,
+        'treatment_phrase': treatment_phrase,
+        'split': split,
+        'store_sequences': store_sequences,
+        'fingerprint': fingerprint,
+        'num_frozen_layers': num_frozen_layers,
+        'zero_pad_states': zero_pad_states,
+    }, sort_keys=True)
+    readable_name = pretrained_model_name.replace('/', '_')
+    layer_tag = f"_layer{num_frozen_layers}" if num_frozen_layers is not None else ""
+    return f"{readable_name}_{split}_len{max_seq_length}{layer_tag}_{hashlib.sha256(key_info.encode()).hexdigest()[:16]}"
+
+
+class EmbeddingStore:
+    def __init__(self, store_dir: str):
+        """
+        Read-only view of a built embedding store. Arrays are opened memory-mapped,
+        so only the rows touched by a batch are read from disk.
+
+        Args:
+        - store_dir: Directory written by build_embedding_store or build_layer_store.
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.views: Dict[str, np.ndarray] = {
+            view: np.load(os.path.join(store_dir, f"{view}.npy"), mmap_mode='r')
+            for view in self.meta['views']
+        }
+
+    def __len__(self):
+        return self.meta['num_examples']
+
+    def remove(self):
+        """Delete the store from disk, e.g. once it has been invalidated."""
+        self.views = {}
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+        print(f"Removed embedding store {self.store_dir}")
+
+
+def _build_store(model,
+                dataset,
+                store_dir: str,
+                meta: dict,
+                encode_batch: Callable[[torch.Tensor, torch.Tensor], torch.Tensor],
+                batch_size: int,
+                device: torch.device) -> EmbeddingStore:
+    """
+    Encode every available view of a SimilarityDataset with encode_batch and write the results
+    as float16 .npy files plus a meta.json. Written to a temporary directory and renamed once
+    complete, so an interrupted build is never reused. Reuses an existing store at store_dir.
+    """
+    if os.path.exists(os.path.join(store_dir, 'meta.json')):
+        print(f"Using cached {dataset.split} embeddings from {store_dir}")
+        return EmbeddingStore(store_dir)
+
+    tmp_dir = store_dir + '.tmp'
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    views = [view for view in VIEWS if getattr(dataset, f"encodings_{view}", None) is not None]
+    num_examples = len(dataset)
+    was_training = model.training
+    model.eval()
+    with torch.inference_mode():
+        for view in views:
+            encodings = getattr(dataset, f"encodings_{view}")
+            store = None
+            for start in tqdm(range(0, num_examples, batch_size), desc=f"Caching {dataset.split} {view} embeddings"):
+                batch_encodings = encodings[start:start + batch_size]
+                input_ids = torch.cat([encoding['input_ids'] for encoding in batch_encodings]).to(device)
+                attention_mask = torch.cat([encoding['attention_mask'] for encoding in batch_encodings]).to(device)
+
+                embedding = encode_batch(input_ids, attention_mask)
+
+                if store is None:
+                    store = np.lib.format.open_memmap(os.path.join(tmp_dir, f"{view}.npy"), mode='w+',
+                                                    dtype=np.float16, shape=(num_examples, *embedding.shape[1:]))
+                store[start:start + embedding.size(0)] = embedding.to(torch.float16).cpu().numpy()
+            if store is not None:
+                store.flush()
+                del store
+    model.train(was_training)
+
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+        json.dump({**meta, 'split': dataset.split, 'num_examples': num_examples, 'views': views}, f, indent=2)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_dir, store_dir)
+    print(f"Cached {dataset.split} embeddings to {store_dir}")
+    return EmbeddingStore(store_dir)
+
+
+def build_embedding_store(model,
+                        dataset,
+                        args,
+                        device: torch.device,
+                        cache_dir: str) -> EmbeddingStore:
+    """
+    Encode every view of a SimilarityDataset once with the (frozen) backbone of a CausalSent
+    model and store the results as memory-mapped float16 arrays. Reuses an existing store
+    with the same key.
+
+    Pooled embeddings (CLS or last token) are stored for 'fcn'/'linear' heads. If either head
+    is 'conv', full sequences are stored instead and pooled on the fly. Views are encoded with
+    CausalSent.backbone_hidden_states, so with pack_sequences the stored sequences have zeros
+    at pad positions, like the states the model sees outside the cache.
+
+    Note that embeddings are computed in eval mode, i.e. without backbone dropout.
+
+    Args:
+    - model: CausalSent model whose backbone is frozen.
+    - dataset: SimilarityDataset split to encode.
+    - args: Namespace object with training hyperparameters.
+    - device: Device to run the backbone on.
+    - cache_dir: Root directory for embedding stores.
+
+    Returns:
+    - EmbeddingStore for the dataset.
+    """
+    store_sequences = not (model.pool_sentiment and model.pool_riesz)
+    zero_pad_states = store_sequences and model.pack_sequences  # pooled embeddings are the same either way
+    key = embedding_cache_key(pretrained_model_name=args.pretrained_model_name,
+                            max_seq_length=args.max_seq_length,
+                            treatment_phrase=args.treatment_phrase,
+                            split=dataset.split,
+                            store_sequences=store_sequences,
+                            fingerprint=encodings_fingerprint(dataset),
+                            zero_pad_states=zero_pad_states)
+
+    def encode_batch(input_ids, attention_mask):
+        last_hidden_state = model.backbone_hidden_states(input_ids, attention_mask)
+        return last_hidden_state if store_sequences else model.pool_embedding(last_hidden_state)
+
+    meta = {
+        'pretrained_model_name': args.pretrained_model_name,
+        'max_seq_length': args.max_seq_length,
+        'treatment_phrase': args.treatment_phrase,
+        'store_sequences': store_sequences,
+        'zero_pad_states': zero_pad_states,
+    }
+    return _build_store(model, dataset, os.path.join(cache_dir, key), meta, encode_batch, args.batch_size, device)
+
+
+def build_layer_store(model,
+                    dataset,
+                    args,
+                    device: torch.device,
+                    cache_dir: str,
+                    num_frozen_layers: int) -> EmbeddingStore:
+    """
+    Cache the DistilBERT hidden states out of the last frozen transformer layer
+    (layer num_frozen_layers - 1) for every view of a SimilarityDataset, so training only
+    runs the trainable top layers. Stored as memory-mapped float16 sequences.
+
+    The store is only valid while the embeddings and the bottom num_frozen_layers layers stay
+    frozen (see CausalSent.frozen_layer_boundary); a different boundary maps to a different key.
+
+    Note that the hidden states are computed in eval mode, i.e. without dropout in the embeddings
+    and frozen layers, whereas uncached training applies it there. The trainable top layers still
+    train with dropout.
+
+    Args:
+    - model: DistilBERT-backed CausalSent model.
+    - dataset: SimilarityDataset split to encode.
+    - args: Namespace object with training hyperparameters.
+    - device: Device to run the backbone on.
+    - cache_dir: Root directory for embedding stores.
+    - num_frozen_layers: Number of bottom transformer layers to run and cache the output of.
+
+    Returns:
+    - EmbeddingStore for the dataset.
+    """
+    key = embedding_cache_key(pretrained_model_name=args.pretrained_model_name,
+                            max_seq_length=args.max_seq_length,
+                            treatment_phrase=args.treatment_phrase,
+                            split=dataset.split,
+                            store_sequences=True,
+                            fingerprint=encodings_fingerprint(dataset),
+                            num_frozen_layers=num_frozen_layers)
+
+    def encode_batch(input_ids, attention_mask):
+        return model.encode_lower_layers(input_ids, attention_mask, num_frozen_layers)
+
+    meta = {
+        'pretrained_model_name': args.pretrained_model_name,
+        'max_seq_length': args.max_seq_length,
+        'treatment_phrase': args.treatment_phrase,
+        'store_sequences': True,
+        'num_frozen_layers': num_frozen_layers,
+    }
+    return _build_store(model, dataset, os.path.join(cache_dir, key), meta, encode_batch, args.batch_size, device)
+
+
+class CachedEmbeddingDataset(Dataset):
+    def __init__(self, store: EmbeddingStore, dataset):
+        """
+        Dataset over a built EmbeddingStore. Yields float16 embeddings for each available
+        view plus the target, in the same order as the SimilarityDataset it was built from.
+        Layer stores (hidden states out of frozen layers) also yield each view's attention
+        mask, which the remaining transformer layers need.
+
+        Args:
+        - store: EmbeddingStore to read from.
+        - dataset: SimilarityDataset the store was built from.
+        """
+        if len(store) != len(dataset.targets):
+            raise ValueError(f"Embedding store has {len(store)} rows but the dataset has {len(dataset.targets)} targets.")
+        self.store = store
+        self.targets = dataset.targets
+        self.prefix = 'hidden_states' if store.meta.get('num_frozen_layers') is not None else 'embedding'
+        self.encodings = {view: getattr(dataset, f"encodings_{view}") for view in store.views} \
+            if self.prefix == 'hidden_states' else {}
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        output = {}
+        for view in VIEWS:
+            output[f"{self.prefix}_{view}"] = self.store.views[view][idx] if view in self.store.views else None
+            if view in self.encodings:
+                output[f"attention_mask_{view}"] = self.encodings[view][idx]['attention_mask'].squeeze(0)
+        output['target'] = self.targets[idx]
+        return output
+
+    def collate_fn(batch):
+        """Stack cached float16 embeddings into float32 tensors (and attention masks, if present)."""
+        collated_data = {}
+        for key in batch[0].keys():
+            if key == 'target' or batch[0][key] is None:
+                continue
+            if key.startswith('attention_mask'):
+                collated_data[key] = torch.stack([item[key] for item in batch])
+            else:
+                collated_data[key] = torch.from_numpy(np.stack([item[key] for item in batch])).float()
+        collated_data['targets'] = torch.tensor([item['target'] for item in batch])
+        return collated_data
@@ -60,6 +60,47 @@ def tokenize_texts(texts: List[str],
         ))
                         
     return encodings
+
+def tokenize_text_groups(text_groups: List[List[str]], 
+                        tokenizer: DistilBertTokenizer, 
+                        args):
+    """ 
+    Tokenize a fixed-size group of texts per example (e.g. one counterfactual per 
+    treatment phrase).
+    
+    Args:
+    - text_groups: List with one list of K texts per example.
+    - tokenizer: Tokenizer object to use for encoding.
+    
+    Returns:
+    - encodings: List of encodings, one per example, with 'input_ids' and 
+    'attention_mask' of shape (K, max_seq_length).
+    """
+    group_size = len(text_groups[0]) if text_groups else 1
+    encodings = tokenize_texts(texts = [text for group in text_groups for text in group], 
+                                tokenizer = tokenizer, 
+                                args = args)
+    return [{key: torch.cat([encoding[key] for encoding in encodings[start:start + group_size]]) 
+            for key in ['input_ids', 'attention_mask']}
+            for start in range(0, len(encodings), group_size)]
+
+def load_tokenizer(pretrained_model_name: str) -> Union[DistilBertTokenizer, AutoTokenizer]:
+    """ 
+    Load the tokenizer matching a supported backbone. LLaMA has no pad token, 
+    so its eos token is used for padding.
+    """
+    tokenizer = None
+    if pretrained_model_name in ['bert-base-uncased', 'meta-llama/Llama-3.1-8B']:
+        tokenizer = AutoTokenizer.from_pretrained(pretrained_model_name, token = HF_TOKEN)
+        if 'llama' in pretrained_model_name:
+            tokenizer.pad_token = tokenizer.eos_token  #llama doesnt have a pad token
+            print(f"Set llama pad token: {tokenizer.pad_token}")     
+    elif pretrained_model_name in DISTILBERT_SUPPORTED_MODELS:
+        # Tokenizer initialization is not necessary since SentenceTransformer handles it
+        tokenizer = DistilBertTokenizer.from_pretrained(pretrained_model_name, token = HF_TOKEN)                
+    else:
+        raise ValueError(f"Model {pretrained_model_name} not supported. Tokenizer could not be initialized.")
+    return tokenizer
 # =============================================================================     
         
 class SimilarityDataset(Dataset):
@@ -112,6 +153,8 @@ class SimilarityDataset(Dataset):
         self.split = split
         self.treated_only = args.treated_only  # only use treated data for training (ATT instead of ATE)
         self.treatment_phrase = args.treatment_phrase  # treatment word for causal regularization
+        # counterfactual views are built for every phrase (multi-phrase Riesz bank), default just treatment_phrase
+        self.treatment_phrases = getattr(args, 'treatment_phrases', None) or [args.treatment_phrase]
 
         if self.treated_only: # only include texts that include treatment phrase
             self.texts = [text for text in self.texts if self.treatment_phrase.lower() in text.lower()]
@@ -119,17 +162,7 @@ class SimilarityDataset(Dataset):
         self.texts = list(self.texts)
         
         # ========= Tokenizer initialization =========
-        self.tokenizer = None
-        if args.pretrained_model_name in ['bert-base-uncased', 'meta-llama/Llama-3.1-8B']:
-            self.tokenizer = AutoTokenizer.from_pretrained(args.pretrained_model_name, token = HF_TOKEN)
-            if 'llama' in args.pretrained_model_name:
-                self.tokenizer.pad_token = self.tokenizer.eos_token  #llama doesnt have a pad token
-                print(f"Set llama pad token: {self.tokenizer.pad_token}")     
-        elif args.pretrained_model_name in DISTILBERT_SUPPORTED_MODELS:
-            # Tokenizer initialization is not necessary since SentenceTransformer handles it
-            self.tokenizer = DistilBertTokenizer.from_pretrained(args.pretrained_model_name, token = HF_TOKEN)                
-        else:
-            raise ValueError(f"Model {args.pretrained_model_name} not supported. Tokenizer could not be initialized.")
+        self.tokenizer = load_tokenizer(args.pretrained_model_name)
 
         # ======== Synthetically alter ATE (or ATT if --treated_only) ========
         if args.adjust_ate:
@@ -141,10 +174,35 @@ class SimilarityDataset(Dataset):
         # ===== Create training counterfactuals (NOT synthetic ATE, just used for training Riesz and estimating ATE) =====
         self.texts_treated = None
         self.texts_control = None
+        self.treated_is_real = None
+        self.control_is_real = None
+        self.multi_phrase = len(self.treatment_phrases) > 1
         if split == 'train':
             print("Creating treated and control counterfactuals...")
-            self.texts_treated = [self.treat_if_untreated(text, self.treatment_phrase) for text in self.texts]
-            self.texts_control = [self.mask_if_present(text, self.treatment_phrase, self.tokenizer) for text in self.texts]       
+            if self.multi_phrase:
+                # one treated and one control text per phrase, shape [num_texts][num_phrases]
+                print(f"Treatment phrases: {self.treatment_phrases}")
+                self.texts_treated = [[self.treat_if_untreated(text, phrase) for phrase in self.treatment_phrases] 
+                                    for text in self.texts]
+                self.texts_control = [[self.mask_if_present(text, phrase, self.tokenizer) for phrase in self.treatment_phrases] 
+                                    for text in self.texts]
+                self.treated_is_real = [[treated == text for treated in treated_texts] 
+                                        for treated_texts, text in zip(self.texts_treated, self.texts)]
+                self.control_is_real = [[control == text for control in control_texts] 
+                                        for control_texts, text in zip(self.texts_control, self.texts)]
+            else:
+                self.texts_treated = [self.treat_if_untreated(text, self.treatment_phrase) for text in self.texts]
+                self.texts_control = [self.mask_if_present(text, self.treatment_phrase, self.tokenizer) for text in self.texts]       
+                
+                # flag counterfactuals identical to the real text (phrase already present -> treated == real,
+                # phrase absent -> control == real) so the model can skip re-encoding them
+                self.treated_is_real = [treated == text for treated, text in zip(self.texts_treated, self.texts)]
+                self.control_is_real = [control == text for control, text in zip(self.texts_control, self.texts)]
+            num_duplicate_views = int(np.sum(self.treated_is_real) + np.sum(self.control_is_real))
+            num_views = (1 + 2 * len(self.treatment_phrases)) * len(self.texts)
+            if len(self.texts) > 0:
+                print(f"{num_duplicate_views}/{num_views} "
+                    f"({100 * num_duplicate_views / num_views:.1f}%) of real/treated/control views duplicate the real text.")
         # =============================================================================
         
         # ====== Produce encodings in parallel and cache =======
@@ -153,12 +211,14 @@ class SimilarityDataset(Dataset):
                                         tokenizer = self.tokenizer, 
                                         args = args)
         if split == 'train':
-            self.encodings_treated = tokenize_texts(texts = self.texts_treated,
-                                                    tokenizer = self.tokenizer,
-                                                    args = args)
-            self.encodings_control = tokenize_texts(texts = self.texts_control,
-                                                    tokenizer = self.tokenizer,
-                                                    args = args)
+            # multi-phrase encodings stack the per-phrase counterfactuals, shape (num_phrases, max_seq_length)
+            tokenize = tokenize_text_groups if self.multi_phrase else tokenize_texts
+            self.encodings_treated = tokenize(self.texts_treated,
+                                            tokenizer = self.tokenizer,
+                                            args = args)
+            self.encodings_control = tokenize(self.texts_control,
+                                            tokenizer = self.tokenizer,
+                                            args = args)
             
     
     # ======== Create treated and control counterfactuals for each example ========
@@ -401,7 +461,9 @@ class SimilarityDataset(Dataset):
             'input_ids_control': encoding_control.get('input_ids') if encoding_control else None,
             'attention_mask_real': encoding_real['attention_mask'],
             'attention_mask_treated': encoding_treated.get('attention_mask') if encoding_treated else None,
-            'attention_mask_control': encoding_control.get('attention_mask') if encoding_control else None
+            'attention_mask_control': encoding_control.get('attention_mask') if encoding_control else None,
+            'treated_is_real': self.treated_is_real[idx] if self.treated_is_real else None,
+            'control_is_real': self.control_is_real[idx] if self.control_is_real else None
         }
 
         return output
@@ -438,6 +500,13 @@ class SimilarityDataset(Dataset):
                 collated_data[input_ids_key] = None
                 collated_data[attention_mask_key] = None
 
+        # Duplicate-view flags are only present for the train split
+        for flag_key in ['treated_is_real', 'control_is_real']:
+            if batch[0].get(flag_key) is not None:
+                collated_data[flag_key] = torch.tensor([item[flag_key] for item in batch], dtype=torch.bool)
+            else:
+                collated_data[flag_key] = None
+
         # Targets should always be present
         collated_data['targets'] = torch.tensor([item['target'] for item in batch])
 
@@ -0,0 +1,135 @@
+"""
+Background input pipeline for the training loop.
+
+DevicePrefetcher pulls batches from a DataLoader in a background thread (the
+DataLoader's own workers collate them), moves their tensors to the training
+device, and keeps up to `depth` ready batches queued, so batch assembly and the
+host-to-device copy overlap with compute. On CUDA the copies are issued on a
+side stream from pinned memory and the compute stream waits on a per-batch event.
+
+It also measures how long the loop waits for input and how full the queue is
+when a batch is requested: a queue that is usually empty and a large wait
+fraction mean the loop is input-bound.
+"""
+
+import queue
+import threading
+import time
+import torch
+
+_END = object()  # end of the loader
+
+
+class DevicePrefetcher:
+    def __init__(self,
+                loader: torch.utils.data.DataLoader,
+                device: torch.device,
+                depth: int = 2):
+        """
+        Parameters:
+        - loader: torch.utils.data.DataLoader
+            Loader yielding dict batches (tensor values are moved, other values passed through).
+        - device: torch.device
+            Device to move the batches to.
+        - depth: int, default=2
+            Number of batches prepared ahead. 0 moves each batch synchronously in the loop.
+        """
+        self.loader = loader
+        self.device = device
+        self.depth = depth
+        self.stream = torch.cuda.Stream(device) if device.type == 'cuda' and depth > 0 else None
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def reset_stats(self):
+        """Zero the wait time and queue depth counters."""
+        self.wait_time = 0.0
+        self.num_batches = 0
+        self.queue_depth_sum = 0
+
+    def stats(self) -> dict:
+        """
+        Input pipeline metrics since the last reset_stats(): total seconds the loop blocked waiting
+        for a batch, mean seconds per batch, and the mean number of ready batches queued when the
+        loop asked for the next one (0 = input-bound).
+        """
+        num_batches = max(self.num_batches, 1)
+        return {
+            'data_wait_s': self.wait_time,
+            'data_wait_per_batch_s': self.wait_time / num_batches,
+            'queue_depth': self.queue_depth_sum / num_batches,
+        }
+
+    def _to_device(self, batch: dict) -> dict:
+        return {key: value.to(self.device, non_blocking=True) if torch.is_tensor(value) else value
+                for key, value in batch.items()}
+
+    def _put(self, batches: queue.Queue, item, stop: threading.Event) -> bool:
+        # block until there is room, unless the consumer stopped iterating
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, batches: queue.Queue, stop: threading.Event):
+        try:
+            for batch in self.loader:
+                event = None
+                if self.stream is not None:
+                    with torch.cuda.stream(self.stream):
+                        batch = self._to_device(batch)
+                    event = torch.cuda.Event()
+                    event.record(self.stream)
+                else:
+                    batch = self._to_device(batch)
+                if not self._put(batches, (batch, event), stop):
+                    return
+            self._put(batches, (_END, None), stop)
+        except Exception as error:  # re-raised in the training loop
+            self._put(batches, (error, None), stop)
+
+    def __iter__(self):
+        if self.depth <= 0:
+            iterator = iter(self.loader)
+            while True:
+                start = time.perf_counter()
+                batch = next(iterator, _END)
+                if batch is _END:
+                    return
+                batch = self._to_device(batch)
+                self.wait_time += time.perf_counter() - start
+                self.num_batches += 1
+                yield batch
+
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                self.queue_depth_sum += batches.qsize()
+                start = time.perf_counter()
+                batch, event = batches.get()
+                self.wait_time += time.perf_counter() - start
+                if batch is _END:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                if event is not None:
+                    # compute waits for this batch's copies, and the allocator must not reuse its
+                    # memory (allocated on the side stream) before compute is done with it
+                    compute_stream = torch.cuda.current_stream(self.device)
+                    compute_stream.wait_event(event)
+                    for value in batch.values():
+                        if torch.is_tensor(value):
+                            value.record_stream(compute_stream)
+                self.num_batches += 1
+                yield batch
+        finally:
+            stop.set()
+            producer.join()
@@ -0,0 +1,49 @@
+"""
+Training sampler that can continue an epoch from a given batch.
+
+The shuffle order of an epoch is a function of (seed, epoch) only, drawn from the
+sampler's own generator rather than the global torch RNG, so a resumed run sees
+exactly the batches the interrupted run had not trained on yet.
+"""
+
+import torch
+from torch.utils.data.distributed import DistributedSampler
+
+
+class ResumableSampler(DistributedSampler):
+    def __init__(self,
+                dataset: torch.utils.data.Dataset,
+                num_replicas: int = 1,
+                rank: int = 0,
+                seed: int = 0,
+                drop_last: bool = False):
+        """
+        Shuffling DistributedSampler (also used outside of distributed runs, as a single replica)
+        that skips the first batches of the epoch set with set_start_batch.
+
+        Parameters:
+        - dataset: torch.utils.data.Dataset
+            Dataset to sample from.
+        - num_replicas: int, default=1
+            Number of ranks sharing the dataset.
+        - rank: int, default=0
+            This rank.
+        - seed: int, default=0
+            Shuffle seed, combined with the epoch passed to set_epoch.
+        - drop_last: bool, default=False
+            Drop the tail of the shuffle that does not split evenly between the ranks, instead of
+            padding the last shards with duplicated rows.
+        """
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, seed=seed, drop_last=drop_last)
+        self.start_index = 0
+
+    def set_start_batch(self, start_batch: int, batch_size: int):
+        """Start the next iteration at loader batch start_batch of this epoch (0 = the whole epoch)."""
+        self.start_index = start_batch * batch_size
+
+    def __iter__(self):
+        indices = list(super().__iter__())
+        return iter(indices[self.start_index:])
+
+    def __len__(self):
+        return max(self.num_samples - self.start_index, 0)
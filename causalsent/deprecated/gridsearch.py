@@ -1,10 +1,188 @@
-""" 
-TODO: Implement grid search for hyperparameter tuning. 
+"""
+Parallel hyperparameter sweep over train_causal_sent.py configurations with successive halving.
 
-Use initial experimentation to derive a reasonable search space. 
-Invoke train_causal_sent.py with different hyperparameters and evaluate the performance. 
+Every configuration of the grid is trained as its own train_causal_sent.py process, --parallel
+at a time. Training proceeds in rungs of min_epochs, min_epochs * eta, ... epochs (the last rung
+is --epochs): after each rung the trials pause (--stop_after_epoch, writing last.safetensors),
+are scored on their per-epoch metrics, and only the best 1/eta continue (--resume) to the next
+rung. Trials that stop early on their own finish with their final evaluation.
 
-Save results in out/ directory.
+Score of a trial = best validation accuracy so far - ate_weight * ATE instability, the mean
+absolute change (largest over treatment phrases) between its successive epoch ATE estimates.
 
-Produce various plots and analysis of the results in notebooks/gridsearch.ipynb.
-"""
\ No newline at end of file
+Argument rows, per-epoch and final metrics, and every promote/prune decision are recorded in the
+experiments DB ('<project_name>_arguments', '_epoch_metrics', '_metrics', '_sweeps'), trial logs
+in out/sweeps/<sweep_name>/. Visualize with notebooks/visualize_gridsearch.ipynb.
+
+Usage (from causalsent/, arguments not listed below are passed to every trial):
+    python deprecated/gridsearch.py --grid lambda_reg=0,0.1,1 sentiment_head_type=fcn,linear \
+        --parallel 4 --eta 3 --min_epochs 1 --epochs 9 --running_ate --interleave_training --num_workers 0
+Boolean flags take true/false grid values, e.g. doubly_robust=true,false.
+"""
+
+import os
+import sys
+TOP_DIR = os.path.abspath(os.path.join(os.getcwd(), '..'))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+import argparse
+import json
+import math
+import sqlite3
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from causalsent.utils import (get_default_sent_training_args, connect_db, initialize_database, save_arguments_to_db,
+                    save_sweep_trial_to_db, parse_grid, config_argv)
+
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'train_causal_sent.py')
+DB_PATH = "out/experiments.db"
+
+
+def rung_epochs(min_epochs: int, eta: int, max_epochs: int) -> list:
+    """Epochs trained by the end of each rung: min_epochs * eta^k below max_epochs, then max_epochs."""
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    return rungs + [max_epochs]
+
+
+def epoch_metrics(experiment_id: int, project_name: str) -> list:
+    """Per-epoch (val_acc, epoch_ate) rows of an experiment, in epoch order."""
+    conn = connect_db(DB_PATH)
+    rows = conn.execute(f"SELECT val_acc, epoch_ate FROM {project_name}_epoch_metrics WHERE experiment_id = ? ORDER BY epoch",
+                        (experiment_id,)).fetchall()
+    conn.close()
+    return [(val_acc, json.loads(epoch_ate)) for val_acc, epoch_ate in rows]
+
+
+def is_completed(experiment_id: int, project_name: str) -> bool:
+    """True once the experiment wrote its final metrics (trained all epochs or stopped early)."""
+    conn = connect_db(DB_PATH)
+    try:
+        row = conn.execute(f"SELECT 1 FROM {project_name}_metrics WHERE experiment_id = ?", (experiment_id,)).fetchone()
+    except sqlite3.OperationalError:  # no experiment finished yet
+        row = None
+    conn.close()
+    return row is not None
+
+
+def trial_score(rows: list, ate_weight: float) -> tuple:
+    """
+    (score, best val accuracy, ATE instability) of per-epoch (val_acc, epoch_ate) rows. ATE estimates
+    repeated by epochs that do not update it (interleaved sentiment epochs) count once, estimates with
+    a non-finite component (a diverged epoch) are skipped. The score is NaN without a finite val accuracy.
+    """
+    val_accs = [val_acc for val_acc, _ in rows if val_acc is not None and math.isfinite(val_acc)]
+    best_val_acc = max(val_accs) if val_accs else float('nan')
+    estimates = []
+    for _, epoch_ate in rows:
+        if epoch_ate is None or not all(value is not None and math.isfinite(value) for value in epoch_ate):
+            continue
+        if not estimates or epoch_ate != estimates[-1]:
+            estimates.append(epoch_ate)
+    changes = [max(abs(current - previous) for current, previous in zip(estimates[k], estimates[k - 1]))
+            for k in range(1, len(estimates))]
+    ate_instability = sum(changes) / len(changes) if changes else 0.0
+    return best_val_acc - ate_weight * ate_instability, best_val_acc, ate_instability
+
+
+def ranking_key(trial: dict) -> tuple:
+    """Sort key of a scored trial, best first with reverse=True: NaN scores rank last."""
+    return (math.isfinite(trial['score']), trial['score'] if math.isfinite(trial['score']) else 0.0)
+
+
+def run_trial(trial: dict, stop_after_epoch: int, log_dir: str, num_threads: int) -> int:
+    """
+    Train a trial up to stop_after_epoch epochs (0 = to completion) in a train_causal_sent.py process,
+    starting it or resuming its last checkpoint. Returns the process exit code.
+    """
+    if trial['trained_epochs'] == 0:
+        argv = [*trial['argv'], '--experiment_id', str(trial['experiment_id'])]
+    else:
+        argv = ['--resume', os.path.join("out", f"experiment_{trial['experiment_id']}", "last.safetensors")]
+    argv += ['--stop_after_epoch', str(stop_after_epoch)]
+    env = {**os.environ, 'OMP_NUM_THREADS': str(num_threads)}
+    with open(os.path.join(log_dir, f"experiment_{trial['experiment_id']}.log"), 'a') as log:
+        log.write(f"\n===== {' '.join(argv)} =====\n")
+        log.flush()
+        return subprocess.run([sys.executable, TRAIN_SCRIPT, *argv], stdout=log, stderr=subprocess.STDOUT,
+                            cwd=os.getcwd(), env=env).returncode
+
+
+def run_sweep(sweep_args, train_argv: list):
+    configs = parse_grid(sweep_args.grid)
+    base_args = get_default_sent_training_args("causal_sent", argv=train_argv)
+    project_name = base_args.project_name
+    sweep_name = sweep_args.sweep_name or time.strftime("sweep_%Y%m%d_%H%M%S")
+    log_dir = os.path.join("out", "sweeps", sweep_name)
+    os.makedirs(log_dir, exist_ok=True)
+    rungs = rung_epochs(sweep_args.min_epochs, sweep_args.eta, base_args.epochs)
+    num_threads = max(1, (os.cpu_count() or 1) // sweep_args.parallel)
+    print(f"Sweep {sweep_name}: {len(configs)} configurations, rungs at epochs {rungs}, "
+        f"{sweep_args.parallel} parallel trials with {num_threads} threads each")
+
+    # one DB row per configuration, created here so concurrent trials never race on the arguments table
+    initialize_database(DB_PATH)
+    trials = []
+    for config in configs:
+        argv = [*train_argv, *config_argv(config)]
+        experiment_id = save_arguments_to_db(get_default_sent_training_args("causal_sent", argv=argv),
+                                            project_name=project_name, db_path=DB_PATH)
+        trials.append({'config': config, 'argv': argv, 'experiment_id': experiment_id, 'trained_epochs': 0})
+
+    # ====== Successive Halving ======
+    active = trials
+    for rung, epochs in enumerate(rungs):
+        final_rung = rung == len(rungs) - 1
+        print(f"\n===== Rung {rung}: training {len(active)} trial(s) to epoch {epochs} =====")
+        with ThreadPoolExecutor(max_workers=sweep_args.parallel) as pool:
+            exit_codes = list(pool.map(lambda trial: run_trial(trial, 0 if final_rung else epochs, log_dir, num_threads), active))
+
+        scored = []
+        for trial, exit_code in zip(active, exit_codes):
+            trial['trained_epochs'] = epochs
+            rows = epoch_metrics(trial['experiment_id'], project_name) if exit_code == 0 else []
+            if not rows:
+                print(f"[WARNING] Experiment {trial['experiment_id']} failed (exit code {exit_code}), "
+                    f"see {log_dir}/experiment_{trial['experiment_id']}.log")
+                save_sweep_trial_to_db(sweep_name, trial['experiment_id'], trial['config'], rung, epochs, None, 'failed', project_name, DB_PATH)
+                continue
+            trial['score'], best_val_acc, ate_instability = trial_score(rows, sweep_args.ate_weight)
+            print(f"Experiment {trial['experiment_id']} {trial['config']}: score {trial['score']:.4f} "
+                f"(val acc {best_val_acc:.4f}, ATE instability {ate_instability:.4f})")
+            if final_rung or is_completed(trial['experiment_id'], project_name):
+                save_sweep_trial_to_db(sweep_name, trial['experiment_id'], trial['config'], rung, len(rows), trial['score'], 'completed', project_name, DB_PATH)
+            else:
+                scored.append(trial)
+
+        if final_rung:
+            break
+        scored.sort(key=ranking_key, reverse=True)
+        num_promoted = max(1, math.ceil(len(scored) / sweep_args.eta))
+        for position, trial in enumerate(scored):
+            status = 'promoted' if position < num_promoted else 'pruned'
+            save_sweep_trial_to_db(sweep_name, trial['experiment_id'], trial['config'], rung, epochs, trial['score'], status, project_name, DB_PATH)
+        active = scored[:num_promoted]
+        if not active:
+            break
+
+    finished = sorted((trial for trial in trials if 'score' in trial and is_completed(trial['experiment_id'], project_name)),
+                    key=ranking_key, reverse=True)
+    print(f"\n===== Sweep {sweep_name} finished =====")
+    for trial in finished:
+        print(f"Experiment {trial['experiment_id']}: score {trial['score']:.4f} {trial['config']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Successive halving sweep over train_causal_sent.py configurations.", allow_abbrev=False)
+    parser.add_argument("--grid", nargs='+', required=True, help="Search space entries name=value1,value2,... (cartesian product).")
+    parser.add_argument("--parallel", type=int, default=2, help="Trials trained at the same time (one process each, CPU threads split between them).")
+    parser.add_argument("--eta", type=int, default=3, help="Keep the best 1/eta of the trials after each rung; rungs grow by a factor eta in epochs.")
+    parser.add_argument("--min_epochs", type=int, default=1, help="Epochs trained by every configuration before the first pruning.")
+    parser.add_argument("--ate_weight", type=float, default=1.0, help="Penalty per unit of mean absolute epoch-to-epoch ATE change in the trial score.")
+    parser.add_argument("--sweep_name", type=str, default=None, help="Name of the sweep in the DB and out/sweeps/ (default: timestamp).")
+    sweep_args, train_argv = parser.parse_known_args()
+    run_sweep(sweep_args, [arg for arg in train_argv if arg != '--'])
@@ -0,0 +1,224 @@
+"""
+Export the sentiment path of a trained CausalSent checkpoint (backbone + pooling +
+SentimentHead) to ONNX and TorchScript for serving.
+
+The exported graphs take (input_ids, attention_mask) with dynamic batch and sequence
+axes and return sentiment logits of shape (batch_size,). Serving only needs
+onnxruntime or torch (torch.jit.load), not transformers or this package. The
+calibration temperature, pooling and tokenizer settings are written to
+export_meta.json and the tokenizer vocabulary is saved next to the graphs.
+
+Every export is checked for numerical parity against eager CausalSent on random
+inputs of several shapes, and optionally benchmarked against eager PyTorch.
+
+Example usage:
+    python export_causal_sent.py --model_path out/experiment_1/best_model.pt --benchmark
+"""
+
+import os
+import sys
+TOP_DIR = os.path.abspath(os.path.join(os.getcwd(), '..'))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+import json
+import time
+import argparse
+import torch
+from transformers import DistilBertModel
+from causalsent.modules.causal_sent import CausalSent
+from causalsent.modules import distilbert_layers
+from causalsent.utils import load_model_inference
+
+
+def get_export_args():
+    """
+    Parse command line arguments for exporting a CausalSent checkpoint.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, required=True, help="Checkpoint written by training (save_model or the background checkpoint writer), e.g. out/experiment_1/best_model.pt")
+    parser.add_argument("--output_dir", type=str, default=None, help="Directory for the exported graphs. Defaults to <model_path dir>/export.")
+    parser.add_argument("--formats", type=str, nargs='+', default=['onnx', 'torchscript'], choices=['onnx', 'torchscript'])
+    parser.add_argument("--opset", type=int, default=18, help="ONNX opset version.")
+    parser.add_argument("--atol", type=float, default=1e-4, help="Max absolute logit difference tolerated by the parity check.")
+    parser.add_argument("--parity_shapes", type=str, nargs='+', default=['1x16', '4x100', '8x37'], help="(batch_size)x(seq_len) shapes for the parity check.")
+    parser.add_argument("--benchmark", action='store_true', default=False, help="Benchmark exported graphs against eager PyTorch on the CPU.")
+    parser.add_argument("--benchmark_batch_size", type=int, default=32)
+    parser.add_argument("--benchmark_seq_length", type=int, default=0, help="Values <=0 use the training max_seq_length.")
+    parser.add_argument("--steps", type=int, default=10, help="Timed steps per benchmark.")
+    args, unknown = parser.parse_known_args()
+    return args
+
+
+class SentimentPath(torch.nn.Module):
+    def __init__(self, model: CausalSent):
+        """
+        Eval-mode sentiment path of a DistilBERT CausalSent model written with plain tensor ops
+        (see modules/distilbert_layers.py), so tracing does not capture transformers' mask
+        construction or output classes.
+        """
+        super().__init__()
+        if not isinstance(model.backbone, DistilBertModel):
+            raise ValueError("[ERROR] Export is only supported for DistilBERT backbones.")
+        self.backbone = model.backbone
+        self.sentiment = model.sentiment
+        self.pool_token_index = model.pool_token_index
+        self.pool = model.pool_sentiment
+        # packed models hand 'conv' heads zero hidden states at pad positions
+        self.zero_pad_states = model.pack_sequences and not self.pool
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        hidden_states = distilbert_layers.embed(self.backbone, input_ids)
+        hidden_states = distilbert_layers.run_layers(self.backbone, hidden_states, attention_mask)
+        if self.pool:
+            hidden_states = hidden_states[:, self.pool_token_index, :]
+        elif self.zero_pad_states:
+            hidden_states = hidden_states * attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+        return self.sentiment(hidden_states).squeeze(-1)
+
+
+def random_inputs(vocab_size: int, batch_size: int, seq_length: int):
+    """
+    Random right-padded (input_ids, attention_mask); the first row is always unpadded.
+    """
+    input_ids = torch.randint(1, vocab_size, (batch_size, seq_length))
+    lengths = torch.randint(1, seq_length + 1, (batch_size,))
+    lengths[0] = seq_length
+    attention_mask = (torch.arange(seq_length).unsqueeze(0) < lengths.unsqueeze(1)).long()
+    return input_ids * attention_mask, attention_mask
+
+
+def export_torchscript(sentiment_path: SentimentPath, example_inputs: tuple, output_path: str):
+    with torch.no_grad():
+        traced = torch.jit.trace(sentiment_path, example_inputs)
+    traced = torch.jit.freeze(traced)
+    traced.save(output_path)
+    print(f"TorchScript graph saved to {output_path}")
+
+
+def export_onnx(sentiment_path: SentimentPath, example_inputs: tuple, output_path: str, opset: int):
+    with torch.no_grad():
+        torch.onnx.export(
+            sentiment_path,
+            example_inputs,
+            output_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch_size', 1: 'seq_len'},
+                'attention_mask': {0: 'batch_size', 1: 'seq_len'},
+                'logits': {0: 'batch_size'},
+            },
+            opset_version=opset,
+        )
+    print(f"ONNX graph saved to {output_path}")
+
+
+def onnx_session(onnx_path: str):
+    import onnxruntime  # optional dependency, only needed to check or serve ONNX graphs
+    return onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+
+
+def exported_runners(args, output_dir: str) -> dict:
+    """
+    Callables (input_ids, attention_mask) -> logits tensor for each exported format.
+    """
+    runners = {}
+    if 'torchscript' in args.formats:
+        scripted = torch.jit.load(os.path.join(output_dir, 'sentiment.pt'))
+        runners['torchscript'] = lambda input_ids, attention_mask: scripted(input_ids, attention_mask)
+    if 'onnx' in args.formats:
+        session = onnx_session(os.path.join(output_dir, 'sentiment.onnx'))
+        runners['onnx'] = lambda input_ids, attention_mask: torch.from_numpy(session.run(
+            ['logits'], {'input_ids': input_ids.numpy(), 'attention_mask': attention_mask.numpy()}
+        )[0])
+    return runners
+
+
+@torch.inference_mode()
+def check_parity(model: CausalSent, runners: dict, shapes: list, atol: float) -> dict:
+    """
+    Compare exported logits with eager CausalSent.forward (eval mode) on random inputs of each
+    (batch_size, seq_len) shape, exercising the dynamic axes. Raises if any difference exceeds atol.
+    """
+    max_abs_diffs = {name: 0.0 for name in runners}
+    for shape in shapes:
+        batch_size, seq_length = (int(dim) for dim in shape.split('x'))
+        input_ids, attention_mask = random_inputs(model.backbone.config.vocab_size, batch_size, seq_length)
+        eager_logits = model(input_ids, None, None, attention_mask, None, None).squeeze(-1)
+        for name, runner in runners.items():
+            diff = (runner(input_ids, attention_mask) - eager_logits).abs().max().item()
+            max_abs_diffs[name] = max(max_abs_diffs[name], diff)
+
+    for name, diff in max_abs_diffs.items():
+        print(f"Parity {name} vs. eager: max |logit diff| = {diff:.2e} over shapes {shapes}")
+        if diff > atol:
+            raise AssertionError(f"[ERROR] {name} export differs from eager CausalSent by {diff:.2e} > atol {atol}.")
+    return max_abs_diffs
+
+
+@torch.inference_mode()
+def benchmark_exports(model: CausalSent, runners: dict, batch_size: int, seq_length: int, steps: int) -> dict:
+    """
+    Seconds per batch of eager PyTorch and each exported format on the same inputs.
+    """
+    input_ids, attention_mask = random_inputs(model.backbone.config.vocab_size, batch_size, seq_length)
+    all_runners = {'eager': lambda input_ids, attention_mask: model(input_ids, None, None, attention_mask, None, None),
+                **runners}
+    timings = {}
+    for name, runner in all_runners.items():
+        runner(input_ids, attention_mask)  # warmup
+        start = time.perf_counter()
+        for _ in range(steps):
+            runner(input_ids, attention_mask)
+        timings[name] = (time.perf_counter() - start) / steps
+
+    print(f"\n{'format':<13}{'ms/batch':>10}{'ex/s':>10}{'speedup':>10}  (batch {batch_size}, seq_len {seq_length})")
+    for name, seconds in timings.items():
+        print(f"{name:<13}{1000 * seconds:>10.2f}{batch_size / seconds:>10.1f}{timings['eager'] / seconds:>9.2f}x")
+    return timings
+
+
+def export_causal_sent(args):
+    """
+    Export, parity-check, and optionally benchmark the sentiment path of a checkpoint.
+    """
+    model, model_args = load_model_inference(args.model_path)
+    model.eval()
+    output_dir = args.output_dir or os.path.join(os.path.dirname(args.model_path), 'export')
+    os.makedirs(output_dir, exist_ok=True)
+
+    sentiment_path = SentimentPath(model).eval()
+    max_seq_length = model.max_seq_length or 128
+    example_inputs = random_inputs(model.backbone.config.vocab_size, 2, max_seq_length)
+
+    if 'torchscript' in args.formats:
+        export_torchscript(sentiment_path, example_inputs, os.path.join(output_dir, 'sentiment.pt'))
+    if 'onnx' in args.formats:
+        export_onnx(sentiment_path, example_inputs, os.path.join(output_dir, 'sentiment.onnx'), args.opset)
+
+    # everything serving needs besides the graph
+    model.get_tokenizer().save_pretrained(output_dir)
+    with open(os.path.join(output_dir, 'export_meta.json'), 'w') as f:
+        json.dump({
+            'pretrained_model_name': model.pretrained_model_name,
+            'sentiment_head_type': model.sentiment_head_type,
+            'max_seq_length': model.max_seq_length,
+            'temperature': model.temperature,
+            'inputs': ['input_ids', 'attention_mask'],
+            'outputs': ['logits'],
+            'probability': 'sigmoid(logits / temperature)',
+            'pad_to_max_length': not model.pool_sentiment,
+        }, f, indent=2)
+    print(f"Tokenizer and export metadata saved to {output_dir}")
+
+    runners = exported_runners(args, output_dir)
+    check_parity(model, runners, args.parity_shapes, args.atol)
+
+    if args.benchmark:
+        seq_length = args.benchmark_seq_length if args.benchmark_seq_length > 0 else max_seq_length
+        benchmark_exports(model, runners, args.benchmark_batch_size, seq_length, args.steps)
+
+
+if __name__ == "__main__":
+    args = get_export_args()
+    export_causal_sent(args)
@@ -1,16 +1,52 @@
 from transformers import DistilBertModel, LlamaModel
 import torch
-from causalsent.modules.causal_sent_heads import RieszHead, SentimentHead
+from causalsent.modules.causal_sent_heads import RieszHead, SentimentHead, HEAD_TYPES, POOLED_HEAD_TYPES, initialize_head_weights
+from causalsent.modules import distilbert_layers
+from causalsent.modules.checkpointing import set_layer_checkpointing
+from causalsent.modules.lora import LORA_TARGET_MODULES, inject_lora, merge_lora, lora_state_dict
 from causalsent.constants import SUPPORTED_BACKBONES_LIST, HF_TOKEN
-from typing import Union
+from causalsent.data.generators import load_tokenizer
+from typing import Collection, Dict, FrozenSet, List, Sequence, Union
 import warnings
 
+VIEWS = ('real', 'treated', 'control')
+TRAINING_OUTPUTS = frozenset(f"{head}_{view}" for head in ('sentiment', 'riesz') for view in VIEWS)
+# forward_views outputs read by each training term (see CausalSent.required_outputs)
+TERM_OUTPUTS = {
+    'bce': ('sentiment_real',),
+    'reg': ('sentiment_treated', 'sentiment_control'),
+    'riesz': ('riesz_real', 'riesz_treated', 'riesz_control'),
+    'ate': ('sentiment_real', 'riesz_real'),  # Riesz regression ATE, E_n[RR(Z) g(Z)]
+    'dr_ate': ('sentiment_real', 'sentiment_treated', 'sentiment_control', 'riesz_real'),  # doubly robust ATE
+}
+
+
+def per_phrase_outputs(output: torch.Tensor, batch_size: int, num_treatment_phrases: int) -> torch.Tensor:
+    """ 
+    Regroup head outputs of flattened (batch_size * K) counterfactual rows to (batch_size, K). 
+    For the Riesz bank, the row for phrase k keeps only representer k. None and K = 1 outputs 
+    are returned unchanged.
+    """
+    if output is None or num_treatment_phrases == 1:
+        return output
+    output = output.view(batch_size, num_treatment_phrases, -1)
+    if output.size(-1) == 1:
+        return output.squeeze(-1)
+    return output.diagonal(dim1=1, dim2=2)
+
 
 class CausalSent(torch.nn.Module):
     def __init__(self, 
                 pretrained_model_name: str,
                 sentiment_head_type = 'linear', # 'fcn', 'linear', 'conv'
                 riesz_head_type = 'linear', # 'fcn', 'linear', 'conv'
+                fuse_views: bool = False,
+                pack_sequences: bool = False,
+                checkpoint_every: int = 0,
+                lora_rank: int = 0,
+                lora_alpha: float = 16.0,
+                lora_dropout: float = 0.0,
+                num_treatment_phrases: int = 1,
                 ):
         """ 
         Causal Sentence Embedding Model.
@@ -22,11 +58,51 @@ class CausalSent(torch.nn.Module):
             Type of sentiment head to use. Options: 'fcn', 'linear', 'conv'
         - riesz_head_type: str, default='fcn'
             Type of Riesz head to use. Options: 'fcn', 'linear', 'conv'
+        - fuse_views: bool, default=False
+            Whether to stack the real, treated, and control views into a single 
+            batch during training so the backbone runs once per step instead of three times.
+        - pack_sequences: bool, default=False
+            Whether to run the (DistilBERT) backbone on packed real tokens only, skipping pad 
+            tokens (see backbone_hidden_states).
+        - checkpoint_every: int, default=0
+            Activation checkpointing of every k-th backbone layer during training (1 = every 
+            layer, 0 = off). See enable_gradient_checkpointing.
+        - lora_rank: int, default=0
+            Rank of low-rank adapters injected into the backbone's attention and MLP projections 
+            (0 = off). Only the adapters and heads are trained. See enable_lora.
+        - lora_alpha: float, default=16.0
+            Adapter updates are scaled by lora_alpha / lora_rank.
+        - lora_dropout: float, default=0.0
+            Dropout on the adapter inputs.
+        - num_treatment_phrases: int, default=1
+            Number of treatment phrases K. The Riesz head becomes a bank of K representers and 
+            the training views carry one treated and one control row per phrase (see forward_views).
         """
         
         super().__init__()
         self.sentiment_head_type = sentiment_head_type
         self.riesz_head_type = riesz_head_type
+        self.fuse_views = fuse_views
+        self.pack_sequences = pack_sequences
+        self.token_counts = {'real': 0, 'padded': 0}  # backbone tokens processed in packed mode
+        self.pretrained_model_name = pretrained_model_name
+        self.num_treatment_phrases = num_treatment_phrases
+        
+        # ===== Head routing, resolved once so forward only reads plain bools =====
+        for head_name, head_type in [('sentiment', sentiment_head_type), ('Riesz', riesz_head_type)]:
+            if head_type not in HEAD_TYPES:
+                raise ValueError(f"[ERROR] Unsupported {head_name} head type: {head_type}. Options: {HEAD_TYPES}")
+        self.pool_sentiment = sentiment_head_type in POOLED_HEAD_TYPES  # pooled embedding vs. sequence input
+        self.pool_riesz = riesz_head_type in POOLED_HEAD_TYPES
+        self._compiled_forward_views = None  # set by compile_forward
+        self._compiled_forward_sentiment = None
+        
+        # ===== Inference settings (see predict_proba) =====
+        self.max_seq_length = None  # truncation length for raw text inputs, set from training args on load
+        self.temperature = 1.0  # temperature scaling of sentiment logits, fit with calibrate()
+        self.temperature_fitted = False  # whether temperature was fit (1.0 otherwise), saved with checkpoints
+        self._tokenizer = None
+        self.quantized = None  # set by quantize_dynamic
         
         # =========== Load backbone (DistilBERT or LLaMA) =================
         if not pretrained_model_name in SUPPORTED_BACKBONES_LIST:
@@ -46,6 +122,14 @@ class CausalSent(torch.nn.Module):
             
         backbone_hidden_size = self.backbone.config.hidden_size
         self.backbone_hidden_size = backbone_hidden_size
+        self.backbone_type = backbone_type
+        # pool the CLS token for DistilBERT, the last token for LLaMA
+        self.pool_token_index = 0 if backbone_type == "DistilBERT" else -1
+        if pack_sequences and backbone_type != "DistilBERT":
+            raise ValueError("[ERROR] pack_sequences is only supported for DistilBERT backbones.")
+        if pack_sequences and not (self.pool_sentiment and self.pool_riesz):
+            warnings.warn("[WARNING] With pack_sequences, 'conv' heads see zero hidden states at pad positions "
+                        "instead of pad token states. Train and evaluate with the same setting.")
 
         # Freeze backbone parameters initially
         for param in self.backbone.parameters():
@@ -58,29 +142,14 @@ class CausalSent(torch.nn.Module):
         print(f"Backbone Hidden Size: {backbone_hidden_size}")
         print("=" * 50 + "\n")
 
-        def initialize_weights(module):
-            """
-            Initialize weights for the given module using appropriate strategies:
-            - Xavier initialization for linear layers
-            - Kaiming initialization for layers followed by ReLU
-            - Zero initialization for biases
-            """
-            if isinstance(module, torch.nn.Linear):
-                torch.nn.init.xavier_uniform_(module.weight)  # Xavier for linear layers
-                if module.bias is not None:
-                    torch.nn.init.zeros_(module.bias)  # Zero biases
-            elif isinstance(module, torch.nn.Conv1d):
-                torch.nn.init.kaiming_uniform_(module.weight, nonlinearity="relu")  # Kaiming for convolutional layers
-                if module.bias is not None:
-                    torch.nn.init.zeros_(module.bias)
-
         # ====== Build and Init Riesz and Sentiment Heads  ========
         self.riesz = RieszHead(
             backbone_hidden_size=backbone_hidden_size,
             hidden_size=backbone_hidden_size // 2,
-            head_type=riesz_head_type
+            head_type=riesz_head_type,
+            num_outputs=num_treatment_phrases
         )
-        self.riesz.apply(initialize_weights)
+        self.riesz.apply(initialize_head_weights)
         for param in self.riesz.parameters():
             param.requires_grad = True
 
@@ -90,10 +159,117 @@ class CausalSent(torch.nn.Module):
             head_type=sentiment_head_type, 
             probs=False
         )
-        self.sentiment.apply(initialize_weights)
+        self.sentiment.apply(initialize_head_weights)
         for param in self.sentiment.parameters():
             param.requires_grad = True
             
+        # ====== Low-rank adapters (parameter-efficient fine-tuning) ======
+        self.lora_config = None  # set by enable_lora
+        if lora_rank > 0:
+            self.enable_lora(rank=lora_rank, alpha=lora_alpha, dropout_prob=lora_dropout)
+        
+        self.checkpoint_every = 0
+        if checkpoint_every > 0:
+            self.enable_gradient_checkpointing(every=checkpoint_every)
+
+    def backbone_layers(self) -> torch.nn.ModuleList:
+        """ 
+        The backbone's stack of transformer layers (DistilBERT transformer.layer, LLaMA layers, 
+        or a BERT-style encoder.layer).
+        """
+        if isinstance(self.backbone, DistilBertModel):
+            return self.backbone.transformer.layer
+        if isinstance(self.backbone, LlamaModel):
+            return self.backbone.layers
+        encoder = getattr(self.backbone, "encoder", None)
+        if encoder is None:
+            raise AttributeError("The backbone model does not have 'transformer', 'layers', or 'encoder' layers.")
+        return encoder.layer
+
+    def enable_gradient_checkpointing(self, every: int = 1) -> int:
+        """ 
+        Activation checkpointing for every k-th backbone transformer layer (layers 0, k, 2k, ...). 
+        Checkpointed layers store only their inputs and recompute their activations in backward, 
+        for each view and on every backbone path (three-call, fused, dedup, packed, cached layers). 
+        Only applies in training mode with gradients enabled. every<=0 disables it.
+        
+        DistilBERT layers are checkpointed by routing the padded backbone through 
+        distilbert_layers.run_layers (see backbone_hidden_states). Other backbones use the 
+        transformers built-in checkpointing, which only supports every layer (every=1).
+        
+        Returns the number of checkpointed layers.
+        """
+        if self.backbone_type != "DistilBERT":
+            if every > 1:
+                raise ValueError(f"[ERROR] Checkpointing every {every} layers is only supported for DistilBERT backbones. "
+                                "Use every=1 to checkpoint all layers.")
+            if every == 1:
+                self.backbone.gradient_checkpointing_enable(gradient_checkpointing_kwargs={'use_reentrant': False})
+            elif self.backbone.is_gradient_checkpointing:
+                self.backbone.gradient_checkpointing_disable()
+        num_checkpointed = set_layer_checkpointing(self.backbone_layers(), every)
+        if num_checkpointed > 0 and getattr(self.backbone.config, "use_cache", False):
+            self.backbone.config.use_cache = False  # recomputing a layer would append to the KV cache twice
+        self.checkpoint_every = max(every, 0)
+        if num_checkpointed > 0:
+            print(f"Activation checkpointing enabled for {num_checkpointed}/{len(self.backbone_layers())} backbone layers.")
+        return num_checkpointed
+
+    def enable_lora(self, rank: int = 8, alpha: float = 16.0, dropout_prob: float = 0.0) -> List[str]:
+        """ 
+        Inject low-rank adapters into the backbone's attention and MLP projections (see 
+        modules/lora.py). Pretrained backbone weights stay frozen and are shared, not copied; 
+        only the adapters (and the heads) train, so optimizer state scales with the adapter size.
+        
+        Returns the names of the adapted backbone submodules.
+        """
+        for param in self.backbone.parameters():
+            param.requires_grad = False
+        adapted = inject_lora(self.backbone, LORA_TARGET_MODULES[self.backbone_type], rank, alpha, dropout_prob)
+        self.lora_config = {'rank': rank, 'alpha': alpha, 'dropout': dropout_prob}
+        
+        adapter_params = sum(value.numel() for value in lora_state_dict(self.backbone).values())
+        print(f"LoRA (rank {rank}, alpha {alpha}) injected into {len(adapted)} backbone projections: "
+            f"{adapter_params:,} adapter parameters, {self.percentage_trainable_params():.2f}% of the model trainable.")
+        return adapted
+    
+    def merge_lora(self) -> int:
+        """ 
+        Fold the adapters into the backbone weights (plain Linear layers again), e.g. for inference, 
+        export, or quantization. Returns the number of merged projections.
+        """
+        num_merged = merge_lora(self.backbone)
+        self.lora_config = None
+        return num_merged
+    
+    def trainable_state_dict(self, trainable_only: bool = False) -> Dict[str, torch.Tensor]:
+        """ 
+        State dict to checkpoint: with LoRA, only the adapter and head weights (the frozen backbone 
+        is reloaded from pretrained_model_name); with trainable_only, the head weights and the 
+        backbone parameters that require grad; otherwise the full state dict.
+        """
+        if self.lora_config is None and not trainable_only:
+            return self.state_dict()
+        heads = {**self.riesz.state_dict(prefix='riesz.'), **self.sentiment.state_dict(prefix='sentiment.')}
+        if self.lora_config is not None:
+            return {**lora_state_dict(self.backbone, prefix='backbone.'), **heads}
+        return {**{f'backbone.{name}': param for name, param in self.backbone.named_parameters() if param.requires_grad},
+                **heads}
+    
+    def load_trainable_state_dict(self, state_dict: Dict[str, torch.Tensor], trainable_only: bool = False):
+        """ 
+        Load a state dict written by trainable_state_dict. Adapter and trainable_only checkpoints 
+        may only omit pretrained backbone weights.
+        """
+        if self.lora_config is None and not trainable_only:
+            return self.load_state_dict(state_dict)
+        result = self.load_state_dict(state_dict, strict=False)
+        missing = [key for key in result.missing_keys 
+                if not key.startswith('backbone.') or key.endswith('.lora_A') or key.endswith('.lora_B')]
+        if missing or result.unexpected_keys:
+            raise RuntimeError(f"[ERROR] Adapter checkpoint mismatch. Missing: {missing}. Unexpected: {result.unexpected_keys}.")
+        return result
+
     def percentage_trainable_params(self):
         """         
         Returns the percentage of trainable parameters (float).
@@ -125,12 +301,7 @@ class CausalSent(torch.nn.Module):
         """
         eps = 1e-2
         
-        encoder = getattr(self.backbone, "encoder", getattr(self.backbone, "transformer", None))
-        
-        if encoder is None:
-            raise AttributeError("The backbone model does not have an 'encoder' or 'transformer' attribute.")
-            
-        total_backbone_layers = len(list(encoder.layer))
+        total_backbone_layers = len(self.backbone_layers())
         
         num_layers = None
         if fraction > 1.0 - eps:
@@ -159,9 +330,7 @@ class CausalSent(torch.nn.Module):
             print("\n" + "=" * 50)
             print("Unfreezing Backbone Layers:")
 
-            encoder = getattr(self.backbone, "encoder", getattr(self.backbone, "transformer", None))
-            if encoder is None:
-                raise AttributeError("The backbone model does not have an 'encoder' or 'transformer' attribute.")
+            layer_list = list(self.backbone_layers())  # List of layers
 
             if num_layers == 'all':
                 for param in self.backbone.parameters():
@@ -170,7 +339,6 @@ class CausalSent(torch.nn.Module):
             else:
                 # Unfreeze the last `num_layers` layers
                 assert isinstance(num_layers, int), "num_layers must be 'all' or an integer."
-                layer_list = list(encoder.layer)  # List of layers
                 layers_to_unfreeze = layer_list[-num_layers:]   # would break with non-positive ints, but we check that above
 
                 for layer in layers_to_unfreeze:
@@ -197,84 +365,644 @@ class CausalSent(torch.nn.Module):
         return {"trainable_model": self.percentage_trainable_params(),
                 "trainable_backbone": self.percentage_trainable_backbone_params()}
 
+    def pool_embedding(self, last_hidden_state: torch.Tensor) -> torch.Tensor:
+        """ 
+        Pool a sequence of backbone hidden states into a single embedding per example.
+        DistilBERT uses the CLS token, LLaMA uses the last token.
+        """
+        return last_hidden_state[:, self.pool_token_index, :]
+
+    def backbone_hidden_states(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """ 
+        Last hidden state of the backbone, shape (batch_size, seq_len, hidden_size).
+        
+        With pack_sequences, pad tokens are dropped before the backbone: the real tokens are 
+        packed with cumulative sequence offsets, every layer runs on real tokens only, and 
+        attention runs per sequence (see modules/distilbert_layers.py). The packed states are 
+        scattered back with zeros at pad positions. Pooled embeddings match the padded backbone; 
+        'conv' heads see zeros instead of pad token states at pad positions.
+        """
+        if not self.pack_sequences:
+            if self.checkpoint_every > 0 and self.backbone_type == "DistilBERT":
+                # layer-level path, which checkpoints the flagged layers (see enable_gradient_checkpointing)
+                hidden_states = distilbert_layers.embed(self.backbone, input_ids)
+                return distilbert_layers.run_layers(self.backbone, hidden_states, attention_mask)
+            return self.backbone(input_ids, attention_mask=attention_mask).last_hidden_state
+        
+        packed_hidden_states, indices, _ = distilbert_layers.run_packed(self.backbone, input_ids, attention_mask)
+        self.token_counts['real'] += indices.numel()  # size of pack's nonzero result, no further sync
+        self.token_counts['padded'] += input_ids.numel()
+        return distilbert_layers.unpack(packed_hidden_states, indices, *input_ids.shape)
+
+    def _stacked_backbone(self, 
+                        input_ids_list: List[torch.Tensor], 
+                        attention_mask_list: List[torch.Tensor]) -> torch.Tensor:
+        """ 
+        Right-pad (and mask) several views to a common length, stack them along the batch
+        dimension and run the backbone a single time.
+        
+        Returns the stacked last hidden state of shape (sum of batch sizes, max seq_len, hidden_size).
+        """
+        max_seq_length = max(input_ids.size(1) for input_ids in input_ids_list)
+        pad_token_id = self.backbone.config.pad_token_id or 0
+        
+        stacked_input_ids = torch.cat([
+            torch.nn.functional.pad(input_ids, (0, max_seq_length - input_ids.size(1)), value=pad_token_id)
+            for input_ids in input_ids_list
+        ])
+        stacked_attention_mask = torch.cat([
+            torch.nn.functional.pad(attention_mask, (0, max_seq_length - attention_mask.size(1)), value=0)
+            for attention_mask in attention_mask_list
+        ])
+        
+        return self.backbone_hidden_states(stacked_input_ids, stacked_attention_mask)
+
+    def fused_backbone(self, 
+                    input_ids_list: List[torch.Tensor], 
+                    attention_mask_list: List[torch.Tensor]) -> List[torch.Tensor]:
+        """ 
+        Run the backbone a single time over several views stacked along the batch 
+        dimension, then split the last hidden states back out per view.
+        
+        Views padded to different lengths are right-padded (and masked) to a common 
+        length before stacking, and sliced back to their original length afterwards, 
+        so each view's hidden states match a separate backbone call.
+        
+        Parameters:
+        - input_ids_list: List[torch.Tensor]
+            Input ids for each view, each of shape (batch_size, seq_len).
+        - attention_mask_list: List[torch.Tensor]
+            Attention masks for each view, matching input_ids_list.
+            
+        Returns list of last hidden states, one (batch_size, seq_len, hidden_size) tensor per view.
+        """
+        seq_lengths = [input_ids.size(1) for input_ids in input_ids_list]
+        batch_sizes = [input_ids.size(0) for input_ids in input_ids_list]
+        last_hidden_state = self._stacked_backbone(input_ids_list, attention_mask_list)
+        return [hidden[:, :seq_length, :] for hidden, seq_length 
+                in zip(last_hidden_state.split(batch_sizes), seq_lengths)]
+    
+    def dedup_backbone(self,
+                    input_ids_real: torch.Tensor,
+                    input_ids_treated: torch.Tensor,
+                    input_ids_control: torch.Tensor,
+                    attention_mask_real: torch.Tensor,
+                    attention_mask_treated: torch.Tensor,
+                    attention_mask_control: torch.Tensor,
+                    treated_is_real: torch.Tensor,
+                    control_is_real: torch.Tensor) -> List[torch.Tensor]:
+        """ 
+        Encode only the unique real/treated/control rows in one backbone call and scatter 
+        the hidden states back into the three views.
+        
+        The treated text equals the real text whenever the treatment phrase is already 
+        present, and the control text equals the real text whenever it is absent, so 
+        roughly one of every three rows is a duplicate of the real row.
+        
+        Parameters:
+        - input_ids_*, attention_mask_*: torch.Tensor
+            Inputs for each view, each of shape (batch_size, seq_len). With K treatment phrases 
+            the treated and control views are flattened to (batch_size * K, seq_len), example-major.
+        - treated_is_real: torch.Tensor
+            Bool tensor of shape (batch_size,) or (batch_size * K,). True where the treated row 
+            equals the real row.
+        - control_is_real: torch.Tensor
+            Bool tensor matching treated_is_real. True where the control row equals the real row.
+            
+        Returns list of last hidden states [real, treated, control].
+        """
+        batch_size = input_ids_real.size(0)
+        num_phrases = input_ids_treated.size(0) // batch_size
+        seq_lengths = [input_ids_real.size(1), input_ids_treated.size(1), input_ids_control.size(1)]
+        unique_treated = ~treated_is_real
+        unique_control = ~control_is_real
+        
+        stacked_hidden = self._stacked_backbone(
+            [input_ids_real, input_ids_treated[unique_treated], input_ids_control[unique_control]],
+            [attention_mask_real, attention_mask_treated[unique_treated], attention_mask_control[unique_control]]
+        )
+        
+        # row of each view within the stacked [real, unique treated, unique control] hidden states
+        row_index = torch.arange(batch_size, device=stacked_hidden.device)
+        real_row_index = torch.arange(input_ids_treated.size(0), device=stacked_hidden.device) // num_phrases
+        num_unique_treated = unique_treated.sum()
+        treated_index = torch.where(treated_is_real, real_row_index, 
+                                    batch_size + torch.cumsum(unique_treated, dim=0) - 1)
+        control_index = torch.where(control_is_real, real_row_index, 
+                                    batch_size + num_unique_treated + torch.cumsum(unique_control, dim=0) - 1)
+        
+        return [stacked_hidden[index, :seq_length, :] for index, seq_length 
+                in zip([row_index, treated_index, control_index], seq_lengths)]
+    
+    def _views_through_head(self, 
+                            head: torch.nn.Module, 
+                            pooled: bool, 
+                            hidden_states: List[torch.Tensor], 
+                            embeddings: List[torch.Tensor],
+                            needed: Sequence[bool] = None) -> List[torch.Tensor]:
+        """ 
+        Apply a Riesz or sentiment head to each view. Pooled embeddings go to 'fcn' or 
+        'linear' heads, sequences of embeddings go to 'conv' heads. Views not needed 
+        are skipped and returned as None.
+        
+        In fused mode the pooled views are stacked into one head call.
+        """
+        inputs = embeddings if pooled else hidden_states
+        needed = needed or [True] * len(inputs)
+        if pooled and self.fuse_views:
+            selected = [embedding for embedding, is_needed in zip(embeddings, needed) if is_needed]
+            if not selected:
+                return [None] * len(inputs)
+            outputs = iter(head(torch.cat(selected)).split([embedding.size(0) for embedding in selected]))
+            return [next(outputs) if is_needed else None for is_needed in needed]
+        # 'conv' heads always see each view separately: their BatchNorm1d statistics depend on 
+        # the batch, so stacking views would change the training outputs
+        return [head(view_input) if is_needed else None for view_input, is_needed in zip(inputs, needed)]
+
+    @staticmethod
+    def required_outputs(terms: Collection[str] = None) -> FrozenSet[str]:
+        """ 
+        Names of the forward_views outputs (e.g. 'riesz_treated') that a set of active training 
+        terms reads. Terms: 'bce', 'reg', 'riesz', and 'ate' or 'dr_ate' for the (doubly robust) 
+        Riesz ATE estimate. None means every output. The real view's sentiment logits are always 
+        included since training metrics are computed from them.
+        """
+        if terms is None:
+            return TRAINING_OUTPUTS
+        unknown_terms = set(terms) - TERM_OUTPUTS.keys()
+        if unknown_terms:
+            raise ValueError(f"[ERROR] Unknown training terms: {sorted(unknown_terms)}. Options: {list(TERM_OUTPUTS)}")
+        return frozenset(['sentiment_real', *(output for term in terms for output in TERM_OUTPUTS[term])])
+
+    @staticmethod
+    def _needs_counterfactuals(outputs: FrozenSet[str]) -> bool:
+        """Whether any of the outputs is computed from the treated or control view."""
+        return any(output.endswith('_treated') or output.endswith('_control') for output in outputs)
+
+    def _training_heads(self, 
+                        hidden_states: List[torch.Tensor], 
+                        embeddings: List[torch.Tensor],
+                        outputs: FrozenSet[str] = TRAINING_OUTPUTS) -> tuple:
+        """ 
+        Produce the Riesz and sentiment outputs for the real, treated, and control views 
+        from their sequence (hidden_states) and/or pooled (embeddings) backbone outputs. 
+        Head outputs not in outputs are skipped and returned as None.
+        """
+        riesz_output_real, riesz_output_treated, riesz_output_control = self._views_through_head(
+            self.riesz, self.pool_riesz, hidden_states, embeddings, 
+            [f"riesz_{view}" in outputs for view in VIEWS]
+        )
+        sentiment_output_real, sentiment_output_treated, sentiment_output_control = self._views_through_head(
+            self.sentiment, self.pool_sentiment, hidden_states, embeddings,
+            [f"sentiment_{view}" in outputs for view in VIEWS]
+        )
+
+        return (sentiment_output_real, sentiment_output_treated, sentiment_output_control, 
+                riesz_output_real, riesz_output_treated, riesz_output_control)
+
+    def forward_from_embeddings(self,
+                                embedding_real: torch.Tensor,
+                                embedding_treated: torch.Tensor = None,
+                                embedding_control: torch.Tensor = None,
+                                terms: Collection[str] = None) -> Union[torch.Tensor, tuple]:
+        """ 
+        Run only the heads on precomputed backbone outputs (see data/embedding_cache.py). 
+        Valid when the backbone is frozen.
+        
+        Parameters:
+        - embedding_real, embedding_treated, embedding_control: torch.Tensor
+            Either pooled embeddings of shape (batch_size, hidden_size), or sequences of 
+            shape (batch_size, seq_len, hidden_size). Sequences are required for 'conv' heads 
+            and are pooled here for 'fcn'/'linear' heads.
+        - terms: Collection[str], default=None
+            Active training terms, see forward_views.
+            
+        Same outputs as forward: all six head outputs in training mode, sentiment logits for the 
+        real view in eval mode.
+        """
+        views = [embedding_real, embedding_treated, embedding_control] if self.training else [embedding_real]
+        
+        if embedding_real.dim() == 3:
+            hidden_states = views
+            embeddings = [self.pool_embedding(hidden_state) if hidden_state is not None else None 
+                        for hidden_state in hidden_states]
+        else:
+            if not (self.pool_sentiment and self.pool_riesz):
+                raise ValueError("[ERROR] 'conv' heads require cached sequence embeddings, got pooled embeddings.")
+            hidden_states = None
+            embeddings = views
+            
+        if self.training:
+            return self._training_heads(hidden_states, embeddings, self.required_outputs(terms))
+        
+        sentiment_output_real, = self._views_through_head(
+            self.sentiment, self.pool_sentiment, hidden_states, embeddings
+        )
+        return sentiment_output_real
+
+    def frozen_layer_boundary(self) -> int:
+        """ 
+        Number of bottom DistilBERT transformer layers whose outputs cannot change during 
+        training: the embeddings and every parameter of layers [0, k) are frozen. Activations 
+        out of layer k - 1 can then be cached and only layers [k, n_layers) run per step.
+        
+        Returns 0 if the embeddings are trainable or the backbone is not DistilBERT.
+        """
+        if not isinstance(self.backbone, DistilBertModel):
+            return 0
+        if any(param.requires_grad for param in self.backbone.embeddings.parameters()):
+            return 0
+        
+        boundary = 0
+        for layer in self.backbone_layers():
+            if any(param.requires_grad for param in layer.parameters()):
+                break
+            boundary += 1
+        return boundary
+    
+    def encode_lower_layers(self, 
+                            input_ids: torch.Tensor, 
+                            attention_mask: torch.Tensor, 
+                            num_layers: int) -> torch.Tensor:
+        """ 
+        Hidden states out of the first num_layers DistilBERT transformer layers 
+        (the embeddings output if num_layers is 0).
+        """
+        hidden_states = distilbert_layers.embed(self.backbone, input_ids)
+        return distilbert_layers.run_layers(self.backbone, hidden_states, attention_mask, 0, num_layers)
+    
+    def forward_from_hidden_states(self,
+                                hidden_states_real: torch.Tensor,
+                                hidden_states_treated: torch.Tensor,
+                                hidden_states_control: torch.Tensor,
+                                attention_mask_real: torch.Tensor,
+                                attention_mask_treated: torch.Tensor,
+                                attention_mask_control: torch.Tensor,
+                                start_layer: int,
+                                terms: Collection[str] = None) -> Union[torch.Tensor, tuple]:
+        """ 
+        Run DistilBERT layers [start_layer, n_layers) and the heads on cached hidden states 
+        out of layer start_layer - 1 (see encode_lower_layers). Valid when 
+        frozen_layer_boundary() >= start_layer.
+        
+        Same outputs as forward: all six head outputs in training mode, sentiment logits for the 
+        real view in eval mode (treated/control arguments may then be None). In training mode, 
+        terms selects the outputs to compute (see forward_views).
+        """
+        outputs = self.required_outputs(terms)
+        if self.training and self._needs_counterfactuals(outputs):
+            hidden_states_list = [hidden_states_real, hidden_states_treated, hidden_states_control]
+            attention_mask_list = [attention_mask_real, attention_mask_treated, attention_mask_control]
+        else:
+            hidden_states_list = [hidden_states_real]
+            attention_mask_list = [attention_mask_real]
+        
+        if self.fuse_views:
+            batch_sizes = [hidden_states.size(0) for hidden_states in hidden_states_list]
+            last_hidden_states = list(distilbert_layers.run_layers(
+                self.backbone, torch.cat(hidden_states_list), torch.cat(attention_mask_list), start_layer
+            ).split(batch_sizes))
+        else:
+            last_hidden_states = [
+                distilbert_layers.run_layers(self.backbone, hidden_states, attention_mask, start_layer)
+                for hidden_states, attention_mask in zip(hidden_states_list, attention_mask_list)
+            ]
+        embeddings = [self.pool_embedding(hidden_state) for hidden_state in last_hidden_states]
+        
+        if self.training:
+            padding = [None] * (len(VIEWS) - len(last_hidden_states))  # counterfactual views not run
+            return self._training_heads(last_hidden_states + padding, embeddings + padding, outputs)
+        
+        sentiment_output_real, = self._views_through_head(
+            self.sentiment, self.pool_sentiment, last_hidden_states, embeddings
+        )
+        return sentiment_output_real
+
+    def forward_views(self,
+                    input_ids_real: torch.Tensor, 
+                    input_ids_treated: torch.Tensor, 
+                    input_ids_control: torch.Tensor, 
+                    attention_mask_real: torch.Tensor, 
+                    attention_mask_treated: torch.Tensor, 
+                    attention_mask_control: torch.Tensor,
+                    treated_is_real: torch.Tensor = None,
+                    control_is_real: torch.Tensor = None,
+                    terms: Collection[str] = None) -> tuple:
+        """ 
+        Sentiment and Riesz outputs for the real, treated, and control views. This is the 
+        training-mode forward pass; it can also be called in eval mode (no dropout, BatchNorm 
+        running statistics), e.g. to estimate ATEs from a trained model.
+        
+        Passing the treated_is_real and control_is_real flags (from the train split collate) 
+        encodes each unique row once instead of re-encoding views identical to the real text.
+        
+        With K = num_treatment_phrases > 1 the treated and control inputs (and flags) carry one 
+        row per phrase, shape (batch_size, K, seq_len). Every counterfactual row goes through the 
+        same backbone call as the real view, whose embedding is computed once and shared by all 
+        phrases. Riesz outputs are then (batch_size, K): column k of the real view is the phrase-k 
+        representer at the real text, column k of the treated/control views is the phrase-k 
+        representer at the phrase-k counterfactual. Treated/control sentiment outputs are (batch_size, K).
+        
+        terms lists the active training terms ('bce', 'reg', 'riesz', 'ate' or 'dr_ate', see 
+        required_outputs); only the backbone passes and head evaluations they read are computed. 
+        The real view is always encoded; the treated and control views only when a term reads them. 
+        None (the default) computes everything.
+        
+        Returns (sentiment_real, sentiment_treated, sentiment_control, riesz_real, riesz_treated, riesz_control), 
+        with None for outputs no active term reads.
+        """
+        batch_size = input_ids_real.size(0)
+        outputs = self.required_outputs(terms)
+        hidden_states = self.encode_views(
+            input_ids_real, input_ids_treated, input_ids_control,
+            attention_mask_real, attention_mask_treated, attention_mask_control,
+            treated_is_real=treated_is_real, control_is_real=control_is_real, 
+            counterfactuals=self._needs_counterfactuals(outputs)
+        )
+
+        # Produce single embedding for FCN or linear layers 
+        # Retain sequence otherwise 
+        embeddings = None
+        if self.pool_riesz or self.pool_sentiment:
+            embeddings = [self.pool_embedding(hidden_state) if hidden_state is not None else None 
+                        for hidden_state in hidden_states]
+
+        head_outputs = self._training_heads(hidden_states, embeddings, outputs)
+        if self.num_treatment_phrases == 1:
+            return head_outputs
+        
+        (sentiment_output_real, sentiment_output_treated, sentiment_output_control, 
+         riesz_output_real, riesz_output_treated, riesz_output_control) = head_outputs
+        return (sentiment_output_real, 
+                per_phrase_outputs(sentiment_output_treated, batch_size, self.num_treatment_phrases), 
+                per_phrase_outputs(sentiment_output_control, batch_size, self.num_treatment_phrases),
+                riesz_output_real, 
+                per_phrase_outputs(riesz_output_treated, batch_size, self.num_treatment_phrases), 
+                per_phrase_outputs(riesz_output_control, batch_size, self.num_treatment_phrases))
+    
+    def encode_views(self,
+                    input_ids_real: torch.Tensor, 
+                    input_ids_treated: torch.Tensor, 
+                    input_ids_control: torch.Tensor, 
+                    attention_mask_real: torch.Tensor, 
+                    attention_mask_treated: torch.Tensor, 
+                    attention_mask_control: torch.Tensor,
+                    treated_is_real: torch.Tensor = None,
+                    control_is_real: torch.Tensor = None,
+                    counterfactuals: bool = True) -> List[torch.Tensor]:
+        """ 
+        Backbone pass of forward_views: last hidden states [real, treated, control], deduplicated 
+        (treated_is_real and control_is_real flags) or fused (fuse_views) when enabled. With K treatment 
+        phrases the treated and control views are flattened to (batch_size * K, seq_len, hidden_size), 
+        example-major. Without counterfactuals only the real view is encoded, the others are None.
+        """
+        if not counterfactuals:  # treated and control inputs may be None
+            return [self.backbone_hidden_states(input_ids_real, attention_mask_real), None, None]
+        if input_ids_treated.dim() == 3:
+            input_ids_treated, input_ids_control = input_ids_treated.flatten(0, 1), input_ids_control.flatten(0, 1)
+            attention_mask_treated, attention_mask_control = attention_mask_treated.flatten(0, 1), attention_mask_control.flatten(0, 1)
+            if treated_is_real is not None and control_is_real is not None:
+                treated_is_real, control_is_real = treated_is_real.flatten(), control_is_real.flatten()
+        
+        if treated_is_real is not None and control_is_real is not None:
+            return self.dedup_backbone(
+                input_ids_real, input_ids_treated, input_ids_control,
+                attention_mask_real, attention_mask_treated, attention_mask_control,
+                treated_is_real, control_is_real
+            )
+        if self.fuse_views:
+            return self.fused_backbone(
+                [input_ids_real, input_ids_treated, input_ids_control],
+                [attention_mask_real, attention_mask_treated, attention_mask_control]
+            )
+        return [
+            self.backbone_hidden_states(input_ids_real, attention_mask_real),
+            self.backbone_hidden_states(input_ids_treated, attention_mask_treated),
+            self.backbone_hidden_states(input_ids_control, attention_mask_control)
+        ]
+
     def forward(self,
                 input_ids_real, 
                 input_ids_treated, 
                 input_ids_control, 
                 attention_mask_real, 
                 attention_mask_treated, 
-                attention_mask_control)-> Union[torch.Tensor, tuple]:
+                attention_mask_control,
+                treated_is_real: torch.Tensor = None,
+                control_is_real: torch.Tensor = None,
+                terms: Collection[str] = None)-> Union[torch.Tensor, tuple]:
+        """ 
+        Training mode returns sentiment and Riesz outputs for the real, treated, and 
+        control views, computing only those the active training terms read (see forward_views). 
+        Eval mode returns only the sentiment output for the real view.
+        """
         
         if self.training:
-            backbone_output_real = self.backbone(input_ids_real, attention_mask=attention_mask_real)
-            backbone_output_treated = self.backbone(input_ids_treated, attention_mask=attention_mask_treated)
-            backbone_output_control = self.backbone(input_ids_control, attention_mask=attention_mask_control)
-
-            # Produce single embedding for FCN or linear layers 
-            # Retain sequence otherwise 
-            if self.riesz_head_type in ['fcn', 'linear'] or self.sentiment_head_type in ['fcn', 'linear']:
-                if isinstance(self.backbone, DistilBertModel):
-                    embedding_real = backbone_output_real.last_hidden_state[:, 0, :]  # CLS token embedding
-                    embedding_treated = backbone_output_treated.last_hidden_state[:, 0, :]
-                    embedding_control = backbone_output_control.last_hidden_state[:, 0, :]
-                elif isinstance(self.backbone, LlamaModel):
-                    embedding_real = backbone_output_real.last_hidden_state[:, -1, :]  # Last token embedding
-                    embedding_treated = backbone_output_treated.last_hidden_state[:, -1, :]
-                    embedding_control = backbone_output_control.last_hidden_state[:, -1, :]
-                else:
-                    raise ValueError("[ERROR] Unsupported backbone model.")
-
-            # =========== Produce RR and Sentiment Outputs ===========
-            if self.riesz_head_type in ['fcn', 'linear']: # Pass pooled embeddings to fcn or linear
-                riesz_output_real = self.riesz(embedding_real)
-                riesz_output_treated = self.riesz(embedding_treated)
-                riesz_output_control = self.riesz(embedding_control)
-            elif self.riesz_head_type == 'conv':  # pass sequence of embeddings to conv
-                riesz_output_real = self.riesz(backbone_output_real.last_hidden_state)
-                riesz_output_treated = self.riesz(backbone_output_treated.last_hidden_state)
-                riesz_output_control = self.riesz(backbone_output_control.last_hidden_state)
-            else:
-                raise ValueError(f"[ERROR] Unsupported Riesz head type: {self.riesz_head_type}.")
-                
-            if self.sentiment_head_type in ['fcn', 'linear']: # Pass pooled embeddings to fcn or linear
-                sentiment_output_real = self.sentiment(embedding_real)
-                sentiment_output_treated = self.sentiment(embedding_treated)
-                sentiment_output_control = self.sentiment(embedding_control)
-            elif self.sentiment_head_type == 'conv': # pass sequence of embeddings to conv
-                sentiment_output_real = self.sentiment(backbone_output_real.last_hidden_state)
-                sentiment_output_treated = self.sentiment(backbone_output_treated.last_hidden_state)
-                sentiment_output_control = self.sentiment(backbone_output_control.last_hidden_state)
-            else:
-                raise ValueError(f"[ERROR] Unsupported sentiment head type: {self.sentiment_head_type}.")
+            forward_views = self._compiled_forward_views or self.forward_views
+            return forward_views(
+                input_ids_real, input_ids_treated, input_ids_control,
+                attention_mask_real, attention_mask_treated, attention_mask_control,
+                treated_is_real=treated_is_real, control_is_real=control_is_real, terms=terms
+            )
+        forward_sentiment = self._compiled_forward_sentiment or self.forward_sentiment
+        return forward_sentiment(input_ids_real, attention_mask_real)
 
-            return (sentiment_output_real, sentiment_output_treated, sentiment_output_control, 
-                    riesz_output_real, riesz_output_treated, riesz_output_control)
-        else:
-            backbone_output_real = self.backbone(input_ids_real, attention_mask=attention_mask_real)
-            
-            embedding_real = None
-            embeddings_real = None
-            if self.sentiment_head_type in ['fcn', 'linear']: # Pass pooled embeddings to fcn or linear
-                if isinstance(self.backbone, DistilBertModel):
-                    embedding_real = backbone_output_real.last_hidden_state[:, 0, :]  # CLS token embedding
-                elif isinstance(self.backbone, LlamaModel):
-                    embedding_real = backbone_output_real.last_hidden_state[:, -1, :]  # Last token embedding
-                else:
-                    raise ValueError("[ERROR] Unsupported backbone model.")
-            elif self.sentiment_head_type == 'conv': # pass sequence of embeddings to conv
-                embeddings_real = backbone_output_real.last_hidden_state
-            else:
-                raise ValueError(f"[ERROR] Unsupported sentiment head type: {self.sentiment_head_type}.")
-            
-            # pass either pooled or sequence embeddings depending on sentiment head type
-            if embedding_real is not None:
-                sentiment_output_real = self.sentiment(embedding_real)
-            elif embeddings_real is not None:
-                sentiment_output_real = self.sentiment(embeddings_real)
-            else:
-                raise ValueError("[ERROR] No valid embeddings found for sentiment head.")
+    def forward_sentiment(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """ 
+        Sentiment logits of shape (batch_size, 1) for a single view; the eval-mode forward pass. 
+        Pooled embeddings go to 'fcn'/'linear' heads, sequences of embeddings to 'conv' heads.
+        """
+        last_hidden_state = self.backbone_hidden_states(input_ids, attention_mask)
+        if self.pool_sentiment:
+            return self.sentiment(self.pool_embedding(last_hidden_state))
+        return self.sentiment(last_hidden_state)
 
-            return sentiment_output_real
+    # ==== torch.compile ====
+    def compile_forward(self, dynamic: bool = True, mode: str = None, backend: str = "inductor"):
+        """ 
+        Compile the training (forward_views) and eval (forward_sentiment) forward passes with 
+        torch.compile; forward dispatches to the compiled versions afterwards. Head routing and 
+        pooling are resolved at construction, so neither pass branches on head types.
+        
+        Parameters:
+        - dynamic: bool, default=True
+            Compile with symbolic batch size and sequence length, so dynamically padded batches 
+            and the smaller last batch reuse one graph instead of recompiling per shape.
+        - mode: str, default=None
+            torch.compile mode, e.g. 'reduce-overhead' or 'max-autotune'.
+        - backend: str, default='inductor'
+        
+        Note that the dedup path (treated_is_real/control_is_real) selects a data-dependent 
+        number of rows and falls back to eager around that selection, and that Conv1d backward 
+        specializes on sequence length, so training 'conv' heads compiles one graph per padded 
+        length (a single graph with the max_length-padded training splits).
+        
+        Returns self.
+        """
+        self._compiled_forward_views = torch.compile(self.forward_views, dynamic=dynamic, mode=mode, backend=backend)
+        self._compiled_forward_sentiment = torch.compile(self.forward_sentiment, dynamic=dynamic, mode=mode, backend=backend)
+        return self
+        
+    # ==== quantized CPU inference ====
+    def quantize_dynamic(self, quantize_heads: bool = False):
+        """ 
+        Convert the backbone's Linear layers (and optionally the heads' Linear layers) to dynamic 
+        int8 for CPU inference: weights are stored as int8, activations are quantized on the fly. 
+        Moves the model to the CPU. Inference only, quantized layers are not trainable.
+        
+        Parameters:
+        - quantize_heads: bool, default=False
+            Also quantize the Riesz and sentiment heads. Heads are small, so this mostly 
+            trades accuracy for little speedup.
+        """
+        self.to('cpu')
+        if self.lora_config is not None:
+            self.merge_lora()
+        self.eval()
+        modules = ['backbone', 'riesz', 'sentiment'] if quantize_heads else ['backbone']
+        for module_name in modules:
+            setattr(self, module_name, torch.ao.quantization.quantize_dynamic(
+                getattr(self, module_name), {torch.nn.Linear}, dtype=torch.qint8
+            ))
+        self.quantized = 'backbone+heads' if quantize_heads else 'backbone'
+        print(f"Dynamically quantized ({self.quantized}) Linear layers to int8.")
+        return self
+    
+    # ==== low-latency inference ====
+    def get_tokenizer(self):
+        """ 
+        Tokenizer matching the backbone, loaded on first use.
+        """
+        if self._tokenizer is None:
+            self._tokenizer = load_tokenizer(self.pretrained_model_name)
+        return self._tokenizer
+    
+    def _inference_sequences(self, 
+                            inputs: Union[str, Sequence[str], Sequence[Sequence[int]], Dict[str, torch.Tensor]],
+                            max_seq_length: int) -> List[List[int]]:
+        """ 
+        Convert raw strings, lists of token ids, or a pre-tokenized batch (dict with 'input_ids' 
+        and optionally 'attention_mask') into unpadded lists of token ids.
+        """
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if hasattr(inputs, 'keys') and 'input_ids' in inputs:
+            input_ids = inputs['input_ids']
+            attention_mask = inputs.get('attention_mask')
+            if attention_mask is None:
+                attention_mask = torch.ones_like(input_ids)
+            return [ids[mask.bool()].tolist() for ids, mask in zip(input_ids, attention_mask)]
+        inputs = list(inputs)
+        if len(inputs) > 0 and isinstance(inputs[0], str):
+            return self.get_tokenizer()(inputs, 
+                                        truncation=True, 
+                                        max_length=max_seq_length,
+                                        return_token_type_ids=False,
+                                        return_attention_mask=False)['input_ids']
+        return [list(ids) for ids in inputs]
+    
+    @torch.inference_mode()
+    def predict_logits(self, 
+                    inputs: Union[str, Sequence[str], Sequence[Sequence[int]], Dict[str, torch.Tensor]],
+                    batch_size: int = 64,
+                    max_seq_length: int = None) -> torch.Tensor:
+        """ 
+        Sentiment logits (before temperature scaling) for bulk inference. Runs the backbone and 
+        sentiment head only, never the Riesz head.
+        
+        Inputs are sorted by length and padded per batch to the longest sequence in the batch 
+        (dynamic padding) rather than to max_seq_length. 'conv' sentiment heads average over 
+        every position, so they are still padded to max_seq_length to match training.
+        
+        Parameters:
+        - inputs: raw string(s), lists of token ids, or a pre-tokenized batch 
+            (dict with 'input_ids' and optionally 'attention_mask' tensors).
+        - batch_size: int, default=64
+        - max_seq_length: int, default=None
+            Truncation length for raw strings. Defaults to the training max_seq_length if known.
+            
+        Returns float tensor of shape (num_inputs,) on the CPU, in input order.
+        """
+        tokenizer = self.get_tokenizer()
+        max_seq_length = max_seq_length or self.max_seq_length or tokenizer.model_max_length
+        sequences = self._inference_sequences(inputs, max_seq_length)
+        
+        was_training = self.training
+        self.eval()
+        device = next(self.parameters()).device
+        order = sorted(range(len(sequences)), key=lambda idx: len(sequences[idx]), reverse=True)
+        logits = torch.empty(len(sequences))
+        pad_to_max_length = not self.pool_sentiment
+        try:
+            for start in range(0, len(order), batch_size):
+                batch_index = order[start:start + batch_size]
+                padded = tokenizer.pad({'input_ids': [sequences[idx] for idx in batch_index]},
+                                    padding='max_length' if pad_to_max_length else 'longest',
+                                    max_length=max_seq_length if pad_to_max_length else None,
+                                    return_tensors='pt')
+                last_hidden_state = self.backbone_hidden_states(padded['input_ids'].to(device), 
+                                                            padded['attention_mask'].to(device))
+                embedding = last_hidden_state if pad_to_max_length else self.pool_embedding(last_hidden_state)
+                logits[batch_index] = self.sentiment(embedding).squeeze(-1).float().cpu()
+        finally:
+            self.train(was_training)  # also when a batch raises, e.g. calibrate() in the middle of training
+        return logits
+    
+    def predict_proba(self, 
+                    inputs: Union[str, Sequence[str], Sequence[Sequence[int]], Dict[str, torch.Tensor]],
+                    batch_size: int = 64,
+                    max_seq_length: int = None) -> torch.Tensor:
+        """ 
+        Calibrated positive-class probabilities, sigmoid(logits / temperature). See predict_logits 
+        for accepted inputs. Returns float tensor of shape (num_inputs,).
+        """
+        logits = self.predict_logits(inputs, batch_size=batch_size, max_seq_length=max_seq_length)
+        return torch.sigmoid(logits / self.temperature)
+    
+    def predict(self, 
+                inputs: Union[str, Sequence[str], Sequence[Sequence[int]], Dict[str, torch.Tensor]],
+                batch_size: int = 64,
+                max_seq_length: int = None,
+                threshold: float = 0.5) -> torch.Tensor:
+        """ 
+        Binary sentiment predictions (long tensor of 0/1). See predict_logits for accepted inputs.
+        """
+        probs = self.predict_proba(inputs, batch_size=batch_size, max_seq_length=max_seq_length)
+        return (probs > threshold).long()
+    
+    def fit_temperature(self, logits: torch.Tensor, targets: torch.Tensor, max_iter: int = 100) -> float:
+        """ 
+        Temperature scaling: fit a single temperature T minimizing the BCE of sigmoid(logits / T) 
+        on held-out (validation) logits and binary targets. Sets and returns self.temperature.
+        """
+        logits = logits.detach().float().flatten().cpu()
+        targets = targets.detach().float().flatten().cpu()
+        log_temperature = torch.zeros(1, requires_grad=True)
+        optimizer = torch.optim.LBFGS([log_temperature], lr=0.1, max_iter=max_iter)
+        
+        def closure():
+            optimizer.zero_grad()
+            loss = torch.nn.functional.binary_cross_entropy_with_logits(logits / log_temperature.exp(), targets)
+            loss.backward()
+            return loss
+        
+        with torch.enable_grad():
+            optimizer.step(closure)
+        self.temperature = log_temperature.exp().item()
+        self.temperature_fitted = True
+        print(f"Fitted sentiment temperature: {self.temperature:.4f}")
+        return self.temperature
+    
+    def calibrate(self, 
+                inputs: Union[Sequence[str], Sequence[Sequence[int]], Dict[str, torch.Tensor]], 
+                targets: Sequence[int],
+                batch_size: int = 64,
+                max_seq_length: int = None) -> float:
+        """ 
+        Fit the temperature used by predict_proba on held-out inputs and binary targets.
+        """
+        logits = self.predict_logits(inputs, batch_size=batch_size, max_seq_length=max_seq_length)
+        return self.fit_temperature(logits, torch.as_tensor(targets))
         
     # ==== components for partial freezing/ unfreezing ====
     # needed for interleaved training, riesz-only training, etc.   
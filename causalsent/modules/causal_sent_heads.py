@@ -1,5 +1,8 @@
 import torch
 
+HEAD_TYPES = ['fcn', 'linear', 'conv']
+POOLED_HEAD_TYPES = ['fcn', 'linear']  # heads fed the pooled (CLS / last token) embedding; 'conv' gets the sequence
+
 class Lambda(torch.nn.Module):
     """
     A simple Lambda layer for inline tensor transformations. Needed for 
@@ -12,10 +15,24 @@ class Lambda(torch.nn.Module):
     def forward(self, x):
         return self.func(x)
 
+class Transpose(torch.nn.Module):
+    """
+    Swap two tensor dimensions. Used instead of a Lambda in the 'conv' head so the
+    head has no Python closures and traces/compiles as a plain module.
+    """
+    def __init__(self, dim0: int, dim1: int):
+        super(Transpose, self).__init__()
+        self.dim0 = dim0
+        self.dim1 = dim1
+
+    def forward(self, x):
+        return x.transpose(self.dim0, self.dim1)
+
 def get_head(backbone_hidden_size: int,
             head_hidden_size: int,
             head_type: str,
-            dropout_prob: float = 0.1) -> torch.nn.Module:
+            dropout_prob: float = 0.1,
+            output_size: int = 1) -> torch.nn.Module:
     """ 
     Produce a head for a given backbone hidden size and head type.
     
@@ -28,6 +45,8 @@ def get_head(backbone_hidden_size: int,
         Type of head to construct ('fcn', 'conv', 'linear').
     - dropout_prob: float, default=0.1
         Dropout probability for regularization.
+    - output_size: int, default=1
+        Number of outputs of the final layer.
         
     Returns:
     - torch.nn.Module
@@ -43,12 +62,12 @@ def get_head(backbone_hidden_size: int,
             torch.nn.LayerNorm(head_hidden_size // 2),
             torch.nn.ReLU(),
             torch.nn.Dropout(dropout_prob),
-            torch.nn.Linear(head_hidden_size // 2, 1)
+            torch.nn.Linear(head_hidden_size // 2, output_size)
         )
     elif head_type == 'conv':
         head = torch.nn.Sequential(
             # Expect input shape: (batch_size, sequence_length, hidden_size)
-            Lambda(lambda x: x.transpose(1, 2)),  # Transpose for Conv1d: (batch_size, hidden_size, sequence_length)
+            Transpose(1, 2),  # Transpose for Conv1d: (batch_size, hidden_size, sequence_length)
             torch.nn.Conv1d(backbone_hidden_size, head_hidden_size, kernel_size=3, padding=1),
             torch.nn.BatchNorm1d(head_hidden_size),
             torch.nn.ReLU(),
@@ -57,26 +76,49 @@ def get_head(backbone_hidden_size: int,
             torch.nn.ReLU(),
             torch.nn.AdaptiveAvgPool1d(1),  # Pool to fixed size: (batch_size, hidden_size // 2, 1)
             torch.nn.Flatten(start_dim=1),  # Flatten to (batch_size, hidden_size // 2)
-            torch.nn.Linear(head_hidden_size // 2, 1)  # Final prediction layer
+            torch.nn.Linear(head_hidden_size // 2, output_size)  # Final prediction layer
         )
     elif head_type == 'linear':
-        head = torch.nn.Sequential(torch.nn.Linear(backbone_hidden_size,1))
+        head = torch.nn.Sequential(torch.nn.Linear(backbone_hidden_size, output_size))
     else:
         raise ValueError(f"Invalid sentiment head type: {head_type}.")
     
     return head
+
+def initialize_head_weights(module: torch.nn.Module):
+    """
+    Initialize weights for the given module using appropriate strategies (apply to a head):
+    - Xavier initialization for linear layers
+    - Kaiming initialization for layers followed by ReLU
+    - Zero initialization for biases
+    """
+    if isinstance(module, torch.nn.Linear):
+        torch.nn.init.xavier_uniform_(module.weight)  # Xavier for linear layers
+        if module.bias is not None:
+            torch.nn.init.zeros_(module.bias)  # Zero biases
+    elif isinstance(module, torch.nn.Conv1d):
+        torch.nn.init.kaiming_uniform_(module.weight, nonlinearity="relu")  # Kaiming for convolutional layers
+        if module.bias is not None:
+            torch.nn.init.zeros_(module.bias)
+
 class RieszHead(torch.nn.Module):
     def __init__(self, 
                 backbone_hidden_size: int, 
                 hidden_size: int,  
-                head_type: str):
+                head_type: str,
+                num_outputs: int = 1):
+        """ 
+        Riesz representer head. With num_outputs=K it is a bank of K representers (one per 
+        treatment phrase) sharing every layer but the last.
+        """
         super().__init__()
         self.backbone_hidden_size = backbone_hidden_size
-        self.head = get_head(backbone_hidden_size, hidden_size, head_type)
+        self.num_outputs = num_outputs
+        self.head = get_head(backbone_hidden_size, hidden_size, head_type, output_size=num_outputs)
         
     def forward(self, backbone_embedding):
         """ 
-        Output Riesz Representers from the backbone embedding.
+        Output Riesz Representers from the backbone embedding, shape (batch_size, num_outputs).
         Note that the embedding can be either pooled ('fcn' or 'linear' Riesz uses CLS or last-token pooled embedding), 
         or sequence ('conv' Riesz uses sequence of embeddings).
         """
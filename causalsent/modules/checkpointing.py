@@ -0,0 +1,46 @@
+"""
+Activation (gradient) checkpointing for backbone transformer layers.
+
+A checkpointed layer keeps only its inputs for backward and recomputes its
+internal activations (attention scores, FFN intermediates) during the backward
+pass. Enabling it on every k-th layer trades roughly 1/k of an extra backbone
+forward per step for that share of activation memory, for each of the real,
+treated and control views.
+
+Layers are only flagged (a plain checkpoint_activations attribute), so parameter
+names, state_dict keys, deepcopies and compiled graphs see the unmodified layer.
+DistilBERT backbones run their layers through the layer-level helpers in
+distilbert_layers.py while checkpointing is on, which honour the flag. Other
+backbones use the transformers built-in checkpointing, which covers every layer.
+"""
+
+import torch
+from torch.utils.checkpoint import checkpoint
+from typing import Callable, Sequence
+
+
+def checkpointed(layer: torch.nn.Module, forward: Callable, *args, determinism_check: str = 'default', **kwargs):
+    """
+    Call forward(*args, **kwargs) under activation checkpointing if the layer is flagged
+    (see set_layer_checkpointing), in training mode, and gradients are being recorded.
+    Dropout masks are reproduced in the recomputation (RNG state is preserved).
+    determinism_check='none' skips torch's shape/dtype comparison of the recomputed saved
+    tensors, which does not support nested tensors.
+    """
+    if getattr(layer, 'checkpoint_activations', False) and layer.training and torch.is_grad_enabled():
+        return checkpoint(forward, *args, use_reentrant=False, determinism_check=determinism_check, **kwargs)
+    return forward(*args, **kwargs)
+
+
+def set_layer_checkpointing(layers: Sequence[torch.nn.Module], every: int) -> int:
+    """
+    Flag every k-th layer of a backbone for checkpointing (layers 0, k, 2k, ...). every=1
+    flags all layers, every<=0 turns checkpointing off. The flag is read by checkpointed.
+
+    Returns the number of checkpointed layers.
+    """
+    num_checkpointed = 0
+    for index, layer in enumerate(layers):
+        layer.checkpoint_activations = every > 0 and index % every == 0
+        num_checkpointed += layer.checkpoint_activations
+    return num_checkpointed
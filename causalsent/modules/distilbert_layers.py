@@ -0,0 +1,181 @@
+"""
+Layer-level execution of a DistilBERT backbone.
+
+`DistilBertModel.forward` always runs the embeddings and every transformer layer.
+These helpers run the same computation from the module weights (embeddings,
+q/k/v/out projections, layer norms, FFN) so that CausalSent can start or stop
+at any layer, e.g. to resume from cached activations of frozen bottom layers.
+Only the submodule names are relied upon, which are stable across transformers
+versions.
+
+The packed variants drop pad tokens entirely: the real tokens of a batch are
+concatenated into one (total_tokens, hidden_size) tensor with cumulative sequence
+offsets (cu_seqlens), every Linear/LayerNorm/FFN runs on real tokens only, and
+attention runs as one variable-length call per layer: the packed queries, keys, and
+values are viewed as jagged nested tensors over cu_seqlens, so each sequence attends
+over its own tokens only.
+"""
+
+import torch
+import torch.nn.functional as F
+from typing import Tuple
+from causalsent.modules.checkpointing import checkpointed
+
+
+def attention_bias(attention_mask: torch.Tensor) -> torch.Tensor:
+    """
+    Convert a (batch_size, seq_len) 0/1 padding mask into a boolean
+    (batch_size, 1, 1, seq_len) mask for scaled_dot_product_attention (True = attend).
+    """
+    return attention_mask.bool()[:, None, None, :]
+
+
+def embed(backbone, input_ids: torch.Tensor) -> torch.Tensor:
+    """
+    DistilBERT input embeddings (word + position embeddings, LayerNorm, dropout).
+    """
+    return backbone.embeddings(input_ids)
+
+
+def transformer_block(layer, hidden_states: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+    """
+    Forward pass of a single DistilBERT TransformerBlock.
+
+    Parameters:
+    - layer: DistilBERT TransformerBlock.
+    - hidden_states: torch.Tensor of shape (batch_size, seq_len, hidden_size).
+    - attention_mask: Boolean mask from attention_bias.
+
+    Returns the block output of shape (batch_size, seq_len, hidden_size).
+    """
+    attention = layer.attention
+    batch_size, seq_len, hidden_size = hidden_states.shape
+    head_shape = (batch_size, seq_len, attention.n_heads, hidden_size // attention.n_heads)
+
+    query = attention.q_lin(hidden_states).view(head_shape).transpose(1, 2)
+    key = attention.k_lin(hidden_states).view(head_shape).transpose(1, 2)
+    value = attention.v_lin(hidden_states).view(head_shape).transpose(1, 2)
+    context = F.scaled_dot_product_attention(query, key, value, attn_mask=attention_mask,
+                                            dropout_p=attention.dropout.p if layer.training else 0.0)
+    context = context.transpose(1, 2).reshape(batch_size, seq_len, hidden_size)
+    attention_output = layer.sa_layer_norm(attention.out_lin(context) + hidden_states)
+
+    ffn = layer.ffn
+    ffn_output = ffn.dropout(ffn.lin2(ffn.activation(ffn.lin1(attention_output))))
+    return layer.output_layer_norm(ffn_output + attention_output)
+
+
+def run_layers(backbone,
+            hidden_states: torch.Tensor,
+            attention_mask: torch.Tensor,
+            start_layer: int = 0,
+            end_layer: int = None) -> torch.Tensor:
+    """
+    Run DistilBERT transformer layers [start_layer, end_layer) on hidden states.
+
+    Parameters:
+    - backbone: DistilBertModel.
+    - hidden_states: torch.Tensor of shape (batch_size, seq_len, hidden_size). Either the
+        embeddings output (start_layer=0) or the output of layer start_layer - 1.
+    - attention_mask: torch.Tensor of shape (batch_size, seq_len), 1 for real tokens, 0 for padding.
+    - start_layer: int, default=0
+    - end_layer: int, default=None (run through the last layer)
+
+    Returns the hidden states after layer end_layer - 1.
+    """
+    layers = backbone.transformer.layer
+    end_layer = len(layers) if end_layer is None else end_layer
+    mask = attention_bias(attention_mask)
+    for layer in layers[start_layer:end_layer]:
+        hidden_states = checkpointed(layer, transformer_block, layer, hidden_states, mask)
+    return hidden_states
+
+
+# ====== Packed (unpadded) execution ======
+def pack(attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Locate the real tokens of a right-padded batch.
+
+    Parameters:
+    - attention_mask: torch.Tensor of shape (batch_size, seq_len), 1 for real tokens, 0 for padding.
+
+    Returns:
+    - indices: torch.Tensor of shape (total_tokens,), flat (batch_size * seq_len) index of each real token.
+    - position_ids: torch.Tensor of shape (total_tokens,), position of each real token within its sequence.
+    - cu_seqlens: torch.Tensor of shape (batch_size + 1,), offset of each sequence in the packed tokens
+        (on the mask's device, never read back to the host).
+    """
+    mask = attention_mask.bool()
+    indices = mask.flatten().nonzero().squeeze(1)
+    position_ids = torch.arange(mask.size(1), device=mask.device).expand_as(mask)[mask]
+    cu_seqlens = F.pad(torch.cumsum(mask.sum(dim=1), dim=0), (1, 0))
+    return indices, position_ids, cu_seqlens
+
+
+def unpack(packed: torch.Tensor, indices: torch.Tensor, batch_size: int, seq_len: int) -> torch.Tensor:
+    """
+    Scatter packed (total_tokens, hidden_size) states back into a zero-padded
+    (batch_size, seq_len, hidden_size) tensor.
+    """
+    padded = packed.new_zeros(batch_size * seq_len, packed.size(-1))
+    padded[indices] = packed
+    return padded.view(batch_size, seq_len, packed.size(-1))
+
+
+def embed_packed(backbone, packed_input_ids: torch.Tensor, position_ids: torch.Tensor) -> torch.Tensor:
+    """
+    DistilBERT input embeddings of packed tokens, shape (total_tokens, hidden_size).
+    """
+    embeddings = backbone.embeddings
+    hidden_states = embeddings.word_embeddings(packed_input_ids) + embeddings.position_embeddings(position_ids)
+    return embeddings.dropout(embeddings.LayerNorm(hidden_states))
+
+
+def transformer_block_packed(layer, hidden_states: torch.Tensor, cu_seqlens: torch.Tensor, max_seqlen: int) -> torch.Tensor:
+    """
+    Forward pass of a single DistilBERT TransformerBlock on packed tokens.
+
+    Parameters:
+    - layer: DistilBERT TransformerBlock.
+    - hidden_states: torch.Tensor of shape (total_tokens, hidden_size).
+    - cu_seqlens: Sequence offsets from pack. Attention runs in one call over jagged
+        (batch_size, n_heads, seq_len_i, head_dim) tensors, so no compute is spent on
+        (or masked out for) pad tokens.
+    - max_seqlen: Upper bound on the sequence lengths (the padded length), known on the host
+        so the jagged tensors never read cu_seqlens back.
+
+    Returns the block output of shape (total_tokens, hidden_size).
+    """
+    attention = layer.attention
+    total_tokens, hidden_size = hidden_states.shape
+    head_shape = (total_tokens, attention.n_heads, hidden_size // attention.n_heads)
+    dropout_p = attention.dropout.p if layer.training else 0.0
+
+    def jagged_heads(projection):
+        # (total_tokens, n_heads, head_dim) -> jagged (batch_size, n_heads, seq_len_i, head_dim)
+        packed = projection(hidden_states).view(head_shape)
+        return torch.nested.nested_tensor_from_jagged(packed, cu_seqlens, max_seqlen=max_seqlen).transpose(1, 2)
+    context = F.scaled_dot_product_attention(jagged_heads(attention.q_lin), jagged_heads(attention.k_lin),
+                                            jagged_heads(attention.v_lin), dropout_p=dropout_p)
+    context = context.transpose(1, 2).values().reshape(total_tokens, hidden_size)
+    attention_output = layer.sa_layer_norm(attention.out_lin(context) + hidden_states)
+
+    ffn = layer.ffn
+    ffn_output = ffn.dropout(ffn.lin2(ffn.activation(ffn.lin1(attention_output))))
+    return layer.output_layer_norm(ffn_output + attention_output)
+
+
+def run_packed(backbone, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Run the full DistilBERT backbone on the real tokens of a right-padded batch.
+
+    Returns (packed last hidden states of shape (total_tokens, hidden_size), indices, cu_seqlens),
+    see pack and unpack.
+    """
+    indices, position_ids, cu_seqlens = pack(attention_mask)
+    hidden_states = embed_packed(backbone, input_ids.flatten()[indices], position_ids)
+    for layer in backbone.transformer.layer:
+        # attention saves jagged nested tensors for backward
+        hidden_states = checkpointed(layer, transformer_block_packed, layer, hidden_states, cu_seqlens, input_ids.size(1),
+                                    determinism_check='none')
+    return hidden_states, indices, cu_seqlens
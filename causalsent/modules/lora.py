@@ -0,0 +1,122 @@
+"""
+Low-rank adapters (LoRA, Hu et al. 2021. https://arxiv.org/abs/2106.09685) for backbone projections.
+
+A LoRALinear layer keeps the frozen pretrained weight W and adds a trainable
+low-rank update: y = x W^T + b + (alpha / rank) * dropout(x) A^T B^T, with
+A of shape (rank, in_features) and B of shape (out_features, rank). B starts at
+zero, so an injected model initially matches the pretrained backbone exactly.
+
+Injection reuses the pretrained weight and bias Parameters (no copy) and keeps
+their state_dict keys (e.g. 'q_proj.weight'); the adapters add 'q_proj.lora_A'
+and 'q_proj.lora_B'. Adapters can be merged back into plain Linear layers for
+inference, export, or quantization.
+"""
+
+import math
+import torch
+import torch.nn.functional as F
+from typing import Dict, List, Sequence
+
+
+# attention and MLP projections per backbone
+LORA_TARGET_MODULES = {
+    "DistilBERT": ['q_lin', 'k_lin', 'v_lin', 'out_lin', 'lin1', 'lin2'],
+    "LLaMA": ['q_proj', 'k_proj', 'v_proj', 'o_proj', 'gate_proj', 'up_proj', 'down_proj'],
+}
+
+
+class LoRALinear(torch.nn.Module):
+    def __init__(self,
+                linear: torch.nn.Linear,
+                rank: int,
+                alpha: float = 16.0,
+                dropout_prob: float = 0.0):
+        """
+        Wrap a pretrained Linear layer with a trainable low-rank update.
+
+        Parameters:
+        - linear: torch.nn.Linear
+            Pretrained layer. Its weight and bias Parameters are reused and frozen.
+        - rank: int
+            Rank of the update.
+        - alpha: float, default=16.0
+            The update is scaled by alpha / rank.
+        - dropout_prob: float, default=0.0
+            Dropout on the adapter input.
+        """
+        super().__init__()
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+        self.rank = rank
+        self.scaling = alpha / rank
+        self.weight = linear.weight
+        self.bias = linear.bias
+        self.weight.requires_grad = False
+        if self.bias is not None:
+            self.bias.requires_grad = False
+
+        factory_kwargs = {'device': self.weight.device, 'dtype': self.weight.dtype}
+        self.lora_A = torch.nn.Parameter(torch.empty(rank, self.in_features, **factory_kwargs))
+        self.lora_B = torch.nn.Parameter(torch.zeros(self.out_features, rank, **factory_kwargs))
+        torch.nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+        self.lora_dropout = torch.nn.Dropout(dropout_prob) if dropout_prob > 0 else torch.nn.Identity()
+
+    def forward(self, x):
+        output = F.linear(x, self.weight, self.bias)
+        return output + F.linear(F.linear(self.lora_dropout(x), self.lora_A), self.lora_B) * self.scaling
+
+    def merged_linear(self) -> torch.nn.Linear:
+        """Plain Linear layer with the adapter folded into the weight, W + (alpha / rank) * B A."""
+        linear = torch.nn.Linear(self.in_features, self.out_features, bias=self.bias is not None,
+                                device=self.weight.device, dtype=self.weight.dtype)
+        with torch.no_grad():
+            linear.weight.copy_(self.weight + (self.lora_B @ self.lora_A) * self.scaling)
+            if self.bias is not None:
+                linear.bias.copy_(self.bias)
+        linear.requires_grad_(False)
+        return linear
+
+    def extra_repr(self):
+        return f"in_features={self.in_features}, out_features={self.out_features}, rank={self.rank}, scaling={self.scaling}"
+
+
+def inject_lora(module: torch.nn.Module,
+                target_modules: Sequence[str],
+                rank: int,
+                alpha: float = 16.0,
+                dropout_prob: float = 0.0) -> List[str]:
+    """
+    Replace every Linear submodule whose attribute name is in target_modules with a LoRALinear.
+
+    Returns the qualified names of the adapted submodules.
+    """
+    targets = [(name, child_name, child) for name, submodule in module.named_modules()
+            for child_name, child in submodule.named_children()
+            if child_name in target_modules and isinstance(child, torch.nn.Linear)]
+    adapted = []
+    for name, child_name, child in targets:
+        parent = module.get_submodule(name) if name else module
+        setattr(parent, child_name, LoRALinear(child, rank, alpha, dropout_prob))
+        adapted.append(f"{name}.{child_name}" if name else child_name)
+    return adapted
+
+
+def merge_lora(module: torch.nn.Module) -> int:
+    """
+    Fold every LoRALinear in module back into a plain Linear layer. Returns the number merged.
+    """
+    targets = [(name, child_name, child) for name, submodule in module.named_modules()
+            for child_name, child in submodule.named_children()
+            if isinstance(child, LoRALinear)]
+    for name, child_name, child in targets:
+        parent = module.get_submodule(name) if name else module
+        setattr(parent, child_name, child.merged_linear())
+    return len(targets)
+
+
+def lora_state_dict(module: torch.nn.Module, prefix: str = '') -> Dict[str, torch.Tensor]:
+    """
+    Only the adapter weights (lora_A, lora_B) of a module's state_dict.
+    """
+    return {key: value for key, value in module.state_dict(prefix=prefix).items()
+            if key.endswith('.lora_A') or key.endswith('.lora_B')}
@@ -0,0 +1,150 @@
+"""
+A bank of independent sentiment/Riesz head pairs trained off one frozen backbone forward.
+
+Every member is a (SentimentHead, RieszHead) pair with the architecture of a CausalSent model's
+heads, so a member's heads can be swapped into a CausalSent and saved or loaded as its own model.
+The backbone views of a batch are encoded once and fed to every member.
+
+Members with the same pooled head type ('fcn' or 'linear') have identically shaped parameters and
+run as one vectorized call: their parameters are stacked along a new leading dimension and the
+head is mapped over it (torch.func.vmap of torch.func.functional_call). Stacking is differentiable,
+so each member's own parameters receive its gradients. 'conv' members run one at a time and see
+each view separately, like CausalSent._views_through_head.
+"""
+
+import torch
+from torch.func import functional_call, vmap
+from causalsent.modules.causal_sent import VIEWS, per_phrase_outputs
+from causalsent.modules.causal_sent_heads import RieszHead, SentimentHead, HEAD_TYPES, POOLED_HEAD_TYPES, initialize_head_weights
+from typing import Dict, FrozenSet, List, Sequence
+
+
+class MultiHead(torch.nn.Module):
+    def __init__(self,
+                backbone_hidden_size: int,
+                head_configs: List[Dict],
+                num_treatment_phrases: int = 1):
+        """
+        Bank of sentiment/Riesz head pairs.
+
+        Parameters:
+        - backbone_hidden_size: int
+            Size of the backbone's hidden output.
+        - head_configs: List[Dict]
+            One dict per member with its 'sentiment_head_type', 'riesz_head_type', and 'seed'
+            (initial weights of the member's heads).
+        - num_treatment_phrases: int, default=1
+            Number of treatment phrases K, the outputs of every Riesz head.
+        """
+        super().__init__()
+        self.num_treatment_phrases = num_treatment_phrases
+        self.head_types = {'sentiment': [], 'riesz': []}
+        self.sentiment = torch.nn.ModuleList()
+        self.riesz = torch.nn.ModuleList()
+        for config in head_configs:
+            for head_name, head_type in [('sentiment', config['sentiment_head_type']), ('Riesz', config['riesz_head_type'])]:
+                if head_type not in HEAD_TYPES:
+                    raise ValueError(f"[ERROR] Unsupported {head_name} head type: {head_type}. Options: {HEAD_TYPES}")
+            # same construction and initialization order as CausalSent, under the member's seed
+            with torch.random.fork_rng(devices=[]):
+                torch.manual_seed(config['seed'])
+                riesz = RieszHead(backbone_hidden_size=backbone_hidden_size, hidden_size=backbone_hidden_size // 2,
+                                head_type=config['riesz_head_type'], num_outputs=num_treatment_phrases)
+                riesz.apply(initialize_head_weights)
+                sentiment = SentimentHead(backbone_hidden_size=backbone_hidden_size, hidden_size=backbone_hidden_size // 2,
+                                        head_type=config['sentiment_head_type'], probs=False)
+                sentiment.apply(initialize_head_weights)
+            self.riesz.append(riesz)
+            self.sentiment.append(sentiment)
+            self.head_types['riesz'].append(config['riesz_head_type'])
+            self.head_types['sentiment'].append(config['sentiment_head_type'])
+
+    def __len__(self):
+        return len(self.sentiment)
+
+    @property
+    def needs_sequences(self) -> bool:
+        """Whether any member has a 'conv' head, which reads the sequence of backbone hidden states."""
+        return any(head_type not in POOLED_HEAD_TYPES for head_types in self.head_types.values() for head_type in head_types)
+
+    def member_parameters(self, member: int) -> List[torch.nn.Parameter]:
+        """Parameters of one member's sentiment and Riesz heads."""
+        return [*self.sentiment[member].parameters(), *self.riesz[member].parameters()]
+
+    def _stacked_heads(self, heads: Sequence[torch.nn.Module], inputs: torch.Tensor) -> torch.Tensor:
+        """
+        Outputs of several identically shaped pooled heads on the same inputs, (num_heads, rows, outputs),
+        in one call mapped over their stacked parameters. Dropout draws differ between heads.
+        """
+        if len(heads) == 1:
+            return heads[0](inputs).unsqueeze(0)
+        names = [name for name, _ in heads[0].named_parameters()]
+        params = {name: torch.stack([dict(head.named_parameters())[name] for head in heads]) for name in names}
+
+        def head_forward(head_params, head_inputs):
+            return functional_call(heads[0], head_params, (head_inputs,))
+        return vmap(head_forward, in_dims=(0, None), randomness='different')(params, inputs)
+
+    def _head_outputs(self, head_name: str, members: Sequence[int], hidden_states: List[torch.Tensor],
+                    embeddings: List[torch.Tensor], needed: Sequence[bool]) -> Dict[int, List[torch.Tensor]]:
+        """{member: [real, treated, control] outputs} of the head_name heads, None for views not needed."""
+        heads = self.sentiment if head_name == 'sentiment' else self.riesz
+        results = {member: [None] * len(needed) for member in members}
+        # pooled members, one vectorized call per head type over the needed views stacked along the batch
+        for head_type in POOLED_HEAD_TYPES:
+            group = [member for member in members if self.head_types[head_name][member] == head_type]
+            selected = [embedding for embedding, is_needed in zip(embeddings, needed) if is_needed] if group else []
+            if not selected:
+                continue
+            stacked_outputs = self._stacked_heads([heads[member] for member in group], torch.cat(selected))
+            for member, member_outputs in zip(group, stacked_outputs):
+                outputs = iter(member_outputs.split([embedding.size(0) for embedding in selected]))
+                results[member] = [next(outputs) if is_needed else None for is_needed in needed]
+        # 'conv' members, one call per view
+        for member in members:
+            if self.head_types[head_name][member] not in POOLED_HEAD_TYPES:
+                results[member] = [heads[member](hidden_state) if is_needed else None
+                                for hidden_state, is_needed in zip(hidden_states, needed)]
+        return results
+
+    def forward(self,
+                hidden_states: List[torch.Tensor],
+                embeddings: List[torch.Tensor],
+                outputs: Sequence[FrozenSet[str]],
+                members: Sequence[int] = None) -> Dict[int, tuple]:
+        """
+        Sentiment and Riesz outputs of several members on the same backbone outputs.
+
+        Parameters:
+        - hidden_states: List[torch.Tensor]
+            Last hidden states [real, treated, control] (see CausalSent.encode_views), None for views
+            not encoded. Required for 'conv' members, may be None otherwise.
+        - embeddings: List[torch.Tensor]
+            Pooled embeddings of the same views (see CausalSent.pool_embedding).
+        - outputs: Sequence[FrozenSet[str]]
+            Per member, the outputs its active training terms read (see CausalSent.required_outputs).
+            Pooled members of the same head type are computed together, on the union of their views.
+        - members: Sequence[int], default=None
+            Members to run, e.g. those not stopped early. None runs every member.
+
+        Returns {member: (sentiment_real, sentiment_treated, sentiment_control, riesz_real, riesz_treated,
+        riesz_control)}, laid out like CausalSent.forward_views, with None for outputs no member reads.
+        """
+        members = list(range(len(self))) if members is None else list(members)
+        batch_size = (embeddings or hidden_states)[0].size(0)
+        head_outputs = {}
+        for head_name in ['sentiment', 'riesz']:
+            needed = [any(f"{head_name}_{view}" in outputs[member] for member in members) for view in VIEWS]
+            head_outputs[head_name] = self._head_outputs(head_name, members, hidden_states, embeddings, needed)
+
+        results = {}
+        for member in members:
+            sentiment_real, sentiment_treated, sentiment_control = head_outputs['sentiment'][member]
+            riesz_real, riesz_treated, riesz_control = head_outputs['riesz'][member]
+            results[member] = (sentiment_real,
+                            per_phrase_outputs(sentiment_treated, batch_size, self.num_treatment_phrases),
+                            per_phrase_outputs(sentiment_control, batch_size, self.num_treatment_phrases),
+                            riesz_real,
+                            per_phrase_outputs(riesz_treated, batch_size, self.num_treatment_phrases),
+                            per_phrase_outputs(riesz_control, batch_size, self.num_treatment_phrases))
+        return results
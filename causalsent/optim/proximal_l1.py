@@ -0,0 +1,67 @@
+"""
+Proximal (decoupled) L1 regularization.
+
+Adding lambda * sum(|theta|) to the loss builds a graph over every trainable
+parameter each step (an abs and a sum per tensor forward, a sign per tensor
+backward), which with an unfrozen backbone is as large as the model itself.
+The proximal alternative leaves the loss alone and, after each optimizer step,
+applies the L1 proximal operator (soft-thresholding) to the parameters:
+
+    theta <- sign(theta) * max(|theta| - lr * lambda, 0) = theta - clamp(theta, -lr * lambda, lr * lambda)
+
+This is decoupled from the adaptive gradient scaling, like AdamW's weight decay
+is for L2: every weight moves toward zero by lr * lambda per step and small
+weights become exactly zero. Because Adam rescales the coupled L1 gradient, the
+same lambda is not equivalent between the two formulations.
+"""
+
+import torch
+from typing import List
+
+
+class ProximalL1:
+    def __init__(self,
+                optimizer: torch.optim.Optimizer,
+                lambda_l1: float):
+        """
+        Soft-threshold the parameters of an optimizer after each of its steps.
+
+        Parameters:
+        - optimizer: torch.optim.Optimizer
+            The optimizer whose parameter groups (and per-group learning rates) are regularized.
+        - lambda_l1: float
+            L1 strength. The per-step threshold is the group's current lr * lambda_l1.
+        """
+        self.optimizer = optimizer
+        self.lambda_l1 = lambda_l1
+
+    def _group_params(self, group: dict) -> List[torch.Tensor]:
+        # same parameters the optimizer just updated (grad is None for frozen or unused ones)
+        return [param for param in group['params'] if param.requires_grad and param.grad is not None]
+
+    @torch.no_grad()
+    def step(self):
+        """
+        Apply theta <- theta - clamp(theta, -t, t), t = lr * lambda_l1, with fused multi-tensor ops
+        (one foreach kernel per op and parameter group).
+        """
+        if self.lambda_l1 <= 0:
+            return
+        for group in self.optimizer.param_groups:
+            params = self._group_params(group)
+            if not params:
+                continue
+            threshold = group['lr'] * self.lambda_l1
+            shrink = torch._foreach_clamp_max(params, threshold)
+            torch._foreach_clamp_min_(shrink, -threshold)
+            torch._foreach_sub_(params, shrink)
+
+    @torch.no_grad()
+    def l1_norm(self) -> torch.Tensor:
+        """
+        sum(|theta|) over the trainable parameters, for logging (no autograd graph).
+        """
+        params = [param for group in self.optimizer.param_groups for param in group['params'] if param.requires_grad]
+        if not params:
+            return torch.zeros(())
+        return torch.stack(torch._foreach_norm(params, 1)).sum()
@@ -0,0 +1,90 @@
+"""
+Bulk sentiment scoring with a trained CausalSent checkpoint.
+
+Reads texts from a csv or parquet file, scores them with CausalSent.predict_proba
+(inference mode, no Riesz head, length-sorted dynamic padding, calibrated
+probabilities), and writes the input rows plus `prob` and `pred` columns.
+
+Example usage:
+    python score_causal_sent.py --model_path out/experiment_1/best_model.pt \
+        --input_path reviews.parquet --text_col text --output_path out/scores.parquet
+"""
+
+import os
+import sys
+TOP_DIR = os.path.abspath(os.path.join(os.getcwd(), '..'))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+import time
+import argparse
+import torch
+import pandas as pd
+import warnings
+from causalsent.utils import load_model_inference
+
+
+def get_scoring_args():
+    """
+    Parse command line arguments for bulk scoring.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, required=True, help="Checkpoint written by training (save_model or the background checkpoint writer), e.g. out/experiment_1/best_model.pt")
+    parser.add_argument("--input_path", type=str, required=True, help="csv or parquet file with a text column.")
+    parser.add_argument("--output_path", type=str, required=True, help="csv or parquet file to write scores to.")
+    parser.add_argument("--text_col", type=str, default="text")
+    parser.add_argument("--batch_size", type=int, default=128, help="Inference batch size.")
+    parser.add_argument("--max_seq_length", type=int, default=0, help="Truncation length. Values <=0 use the training max_seq_length saved with the model.")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Probability threshold for the positive class.")
+    parser.add_argument("--quantize", action='store_true', default=False, help="Dynamic int8 quantization of the backbone (CPU only).")
+    parser.add_argument("--quantize_heads", action='store_true', default=False, help="With --quantize, also quantize the heads.")
+    args, unknown = parser.parse_known_args()
+    return args
+
+
+def read_table(path: str) -> pd.DataFrame:
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def write_table(df: pd.DataFrame, path: str):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def score_causal_sent(args):
+    """
+    Score every text in args.input_path and write the results to args.output_path.
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.quantize
+                        else "mps" if torch.backends.mps.is_available() and not args.quantize
+                        else "cpu")  # dynamically quantized models run on the CPU
+    model, _ = load_model_inference(args.model_path, quantize=args.quantize, quantize_heads=args.quantize_heads)
+    model.to(device)
+    if not model.temperature_fitted:
+        warnings.warn(f"[WARNING] {args.model_path} has no fitted temperature, probabilities are uncalibrated sigmoid outputs. "
+                    "Training fits it on the validation split; otherwise fit it with CausalSent.calibrate and update_checkpoint.")
+
+    df = read_table(args.input_path)
+    texts = df[args.text_col].fillna("").astype(str).tolist()
+
+    start = time.perf_counter()
+    probs = model.predict_proba(texts,
+                                batch_size=args.batch_size,
+                                max_seq_length=args.max_seq_length if args.max_seq_length > 0 else None)
+    elapsed = time.perf_counter() - start
+
+    df['prob'] = probs.numpy()
+    df['pred'] = (probs > args.threshold).long().numpy()
+    write_table(df, args.output_path)
+    print(f"Scored {len(texts)} texts in {elapsed:.2f}s ({len(texts) / max(elapsed, 1e-9):.1f} texts/s). "
+        f"Temperature: {model.temperature:.4f}. Wrote {args.output_path}")
+
+
+if __name__ == "__main__":
+    args = get_scoring_args()
+    score_causal_sent(args)
@@ -5,65 +5,308 @@ sentiment analysis. CausalSent.
 
 import os
 import sys
+import time
+from functools import partial
 TOP_DIR = os.path.abspath(os.path.join(os.getcwd(), '..'))
 if TOP_DIR not in sys.path:
     sys.path.insert(0, TOP_DIR)
 import torch
-from torch.utils.data import DataLoader
-from torch.amp import autocast, GradScaler
-from sklearn.metrics import accuracy_score, f1_score
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
 from causalsent.data.utils import load_imdb_data, load_civil_comments_data
 from causalsent.data.generators import IMDBDataset, CivilCommentsDataset
 from causalsent.modules.causal_sent import CausalSent
+from causalsent.optim.proximal_l1 import ProximalL1
 from causalsent.data.generators import SimilarityDataset
-from causalsent.utils import (save_model, load_model_inference, 
+from causalsent.data.embedding_cache import build_embedding_store, build_layer_store, CachedEmbeddingDataset
+from causalsent.data.prefetch import DevicePrefetcher
+from causalsent.data.samplers import ResumableSampler
+from causalsent.checkpoint_io import AsyncCheckpointWriter, checkpoint_contents, read_checkpoint, set_rng_state
+from causalsent.utils import (load_model_inference, 
                     get_default_sent_training_args, seed_everything, 
                     EarlyStopper, initialize_database, save_arguments_to_db,
-                    save_metrics_to_db, save_model_weights_to_db, save_outputs_to_db,
-                    process_unfreeze_param)
+                    save_metrics_to_db, save_model_weights_to_db, save_outputs_to_db, save_epoch_metrics_to_db,
+                    process_unfreeze_param, update_checkpoint,
+                    reset_peak_memory, peak_memory_mb, SyncCounter, StreamingBinaryMetrics,
+                    mixed_precision, is_main_process, rank_shard, all_gather_list, gather_list_to_main)
 import wandb
 import pandas as pd
 import warnings
 
 
-def train_causal_sent(args):
+def training_forward(model, batch, args, device, num_frozen_layers: int = 0, terms: set = None):
     """ 
-    Dataset preparation and training loop for the CausalSent model.
+    Training-mode forward pass for a batch of token ids, cached backbone embeddings, 
+    or cached hidden states out of the first num_frozen_layers backbone layers.
+    With args.autocast the backbone and heads run in bfloat16.
+    
+    Returns the six sentiment and Riesz outputs for the real, treated, and control views, 
+    in fp32 for the loss and ATE computations. Outputs not read by the active training 
+    terms (see CausalSent.required_outputs) are None.
     """
-    seed_everything(args.seed)
+    with mixed_precision(device, args.autocast):
+        outputs = _training_forward(model, batch, args, device, num_frozen_layers=num_frozen_layers, terms=terms)
+    return tuple(output.float() if output is not None else None for output in outputs)
+
+
+def _training_forward(model, batch, args, device, num_frozen_layers: int = 0, terms: set = None):
+    if 'embedding_real' in batch:
+        return model.forward_from_embeddings(
+            batch['embedding_real'].to(device),
+            batch['embedding_treated'].to(device),
+            batch['embedding_control'].to(device),
+            terms=terms,
+        )
+    if 'hidden_states_real' in batch:
+        return model.forward_from_hidden_states(
+            batch['hidden_states_real'].to(device),
+            batch['hidden_states_treated'].to(device),
+            batch['hidden_states_control'].to(device),
+            batch['attention_mask_real'].to(device),
+            batch['attention_mask_treated'].to(device),
+            batch['attention_mask_control'].to(device),
+            start_layer=num_frozen_layers,
+            terms=terms,
+        )
     
-    # ====== Check Args ========
-    if not args.interleave_training and args.lambda_reg > 0:
-        warnings.warn("Regularization loss is enabled but interleave_training is disabled. Competing objectives will yield bad ATEs and bad model.")
-        
-    if args.interleave_training and not args.running_ate:
-        raise ValueError("Interleaved training requires running_ate to be enabled. Pass --running_ate. We need a running ATE to compute the epoch ATEs for interleaved training.")
+    input_ids_real = batch['input_ids_real'].to(device)
+    input_ids_treated = batch['input_ids_treated'].to(device)
+    input_ids_control = batch['input_ids_control'].to(device)
+    attention_mask_real = batch['attention_mask_real'].to(device)
+    attention_mask_treated = batch['attention_mask_treated'].to(device)
+    attention_mask_control = batch['attention_mask_control'].to(device)
+    treated_is_real = batch['treated_is_real'].to(device) if args.dedup_views else None
+    control_is_real = batch['control_is_real'].to(device) if args.dedup_views else None
     
-    project_name = args.project_name
+    return model(
+        input_ids_real,
+        input_ids_treated,
+        input_ids_control,
+        attention_mask_real,
+        attention_mask_treated,
+        attention_mask_control,
+        treated_is_real=treated_is_real,
+        control_is_real=control_is_real,
+        terms=terms,
+    )
+
+
+def sentiment_logits(model, batch, device, num_frozen_layers: int = 0, autocast: bool = False):
+    """ 
+    Eval-mode sentiment logits (fp32) for the real view of a batch, from token ids, cached 
+    backbone embeddings, or cached hidden states out of the first num_frozen_layers layers.
+    With autocast the backbone and heads run in bfloat16.
+    """
+    with mixed_precision(device, autocast):
+        return _sentiment_logits(model, batch, device, num_frozen_layers=num_frozen_layers).float()
+
+
+def _sentiment_logits(model, batch, device, num_frozen_layers: int = 0):
+    if 'embedding_real' in batch:
+        return model.forward_from_embeddings(batch['embedding_real'].to(device))
+    if 'hidden_states_real' in batch:
+        return model.forward_from_hidden_states(
+            batch['hidden_states_real'].to(device), None, None, 
+            batch['attention_mask_real'].to(device), None, None, 
+            start_layer=num_frozen_layers,
+        )
+    input_ids_real = batch['input_ids_real'].to(device)
+    attention_mask_real = batch['attention_mask_real'].to(device)
+    return model(input_ids_real, None, None, attention_mask_real, None, None)
+
+
+def loader_options(args, device) -> dict:
+    """ 
+    DataLoader options for the token datasets: --num_workers background workers kept alive 
+    across epochs, and pinned host memory for asynchronous copies to CUDA.
+    """
+    return {
+        'num_workers': args.num_workers,
+        'pin_memory': device.type == 'cuda',
+        'persistent_workers': args.num_workers > 0,
+    }
+
+
+def inference_collate(batch: list, dynamic_padding: bool = True) -> dict:
+    """ 
+    Collate the real view of token dataset items for scoring. With dynamic_padding, columns that are 
+    padding in every row are dropped, so the batch is padded to its longest sequence rather than 
+    max_seq_length ('conv' sentiment heads need max_seq_length inputs, see CausalSent.predict_logits).
+    """
+    input_ids = torch.cat([item['input_ids_real'] for item in batch])
+    attention_mask = torch.cat([item['attention_mask_real'] for item in batch])
+    if dynamic_padding:
+        keep = attention_mask.any(dim=0)
+        input_ids, attention_mask = input_ids[:, keep], attention_mask[:, keep]
+    return {
+        'input_ids_real': input_ids,
+        'attention_mask_real': attention_mask,
+        'targets': torch.tensor([item['target'] for item in batch]),
+    }
+
+
+def inference_loader(dataset, batch_size: int, args, device, dynamic_padding: bool = True) -> DataLoader:
+    """ 
+    DataLoader for scoring a token dataset: batches of batch_size examples of similar length (sorted 
+    longest first, so padding is small and the memory peak comes first), collated by inference_collate 
+    in --num_workers workers.
+    """
+    # real view lengths from the stored encodings, without building every example
+    base_dataset = dataset.dataset if isinstance(dataset, Subset) else dataset
+    lengths = torch.cat([encoding['attention_mask'] for encoding in base_dataset.encodings_real]).sum(dim=1)
+    if isinstance(dataset, Subset):
+        lengths = lengths[torch.as_tensor(dataset.indices, dtype=torch.long)]
+    order = torch.argsort(lengths, descending=True, stable=True).tolist()
+    batches = [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+    return DataLoader(dataset, batch_sampler=batches, collate_fn=partial(inference_collate, dynamic_padding=dynamic_padding), 
+                    **{**loader_options(args, device), 'persistent_workers': False})  # one pass
+
+
+@torch.no_grad()
+def evaluate_splits(model, loaders: dict, device, num_frozen_layers: int = 0, autocast: bool = False, 
+                    num_bins: int = 0, calibration_split: str = None) -> dict:
+    """ 
+    Score several splits in one sweep: sentiment logits for every batch of every loader, then optionally 
+    the model's temperature fit on the calibration_split logits (of all ranks), then calibrated 
+    probabilities, 0/1 predictions, and metrics for every split.
     
-    # ====== Verbose Argument Printout ======
-    print("\n" + "="*50)
-    print("Running CausalSent Training with the following arguments:")
-    for arg, value in vars(args).items():
-        print(f"{arg}: {value}")
-    print("="*50 + "\n")
+    Parameters:
+    - model: CausalSent
+        The model to score (put in eval mode).
+    - loaders: Dict[str, DataLoader]
+        Split name to a loader with a fixed batch order (e.g. inference_loader). Per-example outputs 
+        are returned in the order of the loader's dataset.
+    - device: torch.device
+    - num_frozen_layers: int, default=0
+        Layer boundary of cached hidden state batches (see sentiment_logits).
+    - autocast: bool, default=False
+        Run the backbone and heads in bfloat16.
+    - num_bins: int, default=0
+        Probability histogram bins for the AUC, 0 disables it.
+    - calibration_split: str, default=None
+        Split whose logits and targets fit model.temperature before the probabilities are computed.
+        
+    Returns {split: {'logits', 'probabilities', 'predictions', 'targets', 'metrics'}}, per-example CPU 
+    tensors of this rank's dataset and metrics (accuracy, f1, auc) over all ranks.
+    """
+    model.eval()
+    results = {}
+    for split, loader in loaders.items():
+        order = torch.tensor([idx for batch_index in loader.batch_sampler for idx in batch_index], dtype=torch.long)
+        batch_logits, batch_targets = [], []
+        for batch in loader:
+            batch_logits.append(sentiment_logits(model, batch, device, num_frozen_layers=num_frozen_layers, autocast=autocast).squeeze(-1))
+            batch_targets.append(batch['targets'])
+        logits, targets = torch.empty(len(order)), torch.empty(len(order), dtype=torch.long)
+        if len(order) > 0:
+            logits[order] = torch.cat(batch_logits).cpu()  # one device to host copy per split
+            targets[order] = torch.cat(batch_targets).long()
+        results[split] = {'logits': logits, 'targets': targets}
     
-    # ====== Initialize Experiment Tracking DB ======
-    initialize_database()
-    experiment_id = save_arguments_to_db(args=args, project_name=project_name)
+    if calibration_split is not None:
+        model.fit_temperature(torch.cat(all_gather_list([results[calibration_split]['logits']])), 
+                            torch.cat(all_gather_list([results[calibration_split]['targets']])))
     
-    # ======= Setup Tracking and Device ========
-    # Initialize wandb
-    wandb.init(project=project_name, config=args)
-    # Device setup
-    device = torch.device("cuda" if torch.cuda.is_available() 
-                        else "mps" if torch.backends.mps.is_available() 
-                        else "cpu")
-    print(f"Using device: {device}")
-    if str(device) == "mps" and args.autocast:
-        raise ValueError("Mixed precision training not supported with MPS. Disable autocast.")
+    for result in results.values():
+        probabilities = torch.sigmoid(result['logits'] / model.temperature)
+        metrics = StreamingBinaryMetrics(torch.device('cpu'), num_bins=num_bins)
+        metrics.update(probabilities, result['targets'])
+        if dist.is_initialized():
+            metrics.all_reduce()
+        result.update(probabilities=probabilities, predictions=(probabilities > metrics.threshold).long(), 
+                    metrics=metrics.compute())
+    return results
+
+
+def micro_batch_rows(batch: dict, micro_batch_tokens: int, views_per_row: int) -> int:
+    """ 
+    Rows per micro-batch so a micro-batch holds at most micro_batch_tokens padded tokens over 
+    the views_per_row views each row runs through the backbone (all rows if micro_batch_tokens <= 0). 
+    Cached embedding batches count one token per view.
+    """
+    batch_rows = batch['targets'].size(0)
+    if micro_batch_tokens <= 0:
+        return batch_rows
+    attention_mask = batch.get('attention_mask_real')
+    seq_length = attention_mask.size(-1) if attention_mask is not None else 1
+    return max(1, min(batch_rows, micro_batch_tokens // (seq_length * views_per_row)))
+
+
+def accumulation_windows(loader, grad_accum_steps: int = 1, micro_batch_tokens: int = 0, views_per_row: int = 1, 
+                        start_batch: int = 0):
+    """ 
+    Iterate a training loader as micro-batches grouped into optimizer steps of grad_accum_steps 
+    loader batches (the last step of an epoch may have fewer). Each loader batch is split into 
+    micro-batches of at most micro_batch_tokens padded tokens (see micro_batch_rows).
     
-    # =========== Load Data ==============
+    Yields (batch_index, micro_batch, batch_fraction, loss_weight, starts_step, ends_step), where 
+    batch_fraction is the micro-batch's share of the rows of its loader batch and loss_weight 
+    scales the micro-batch mean loss so the accumulated gradient is the gradient of the mean loss 
+    over the effective batch (exact when the loader batches of a step have equal sizes).
+    
+    A loader resumed mid-epoch (see ResumableSampler) yields the batches from start_batch on, 
+    which is numbered start_batch and must start an optimizer step.
+    """
+    num_batches = start_batch + len(loader)
+    for i, batch in enumerate(loader, start=start_batch):
+        window_start = i - i % grad_accum_steps
+        window_batches = min(grad_accum_steps, num_batches - window_start)
+        batch_rows = batch['targets'].size(0)
+        rows = micro_batch_rows(batch, micro_batch_tokens, views_per_row)
+        for start in range(0, batch_rows, rows):
+            micro_batch = {key: value[start:start + rows] if torch.is_tensor(value) else value 
+                        for key, value in batch.items()}
+            batch_fraction = micro_batch['targets'].size(0) / batch_rows
+            starts_step = i == window_start and start == 0
+            ends_step = i == window_start + window_batches - 1 and start + rows >= batch_rows
+            yield i, micro_batch, batch_fraction, batch_fraction / window_batches, starts_step, ends_step
+
+
+def per_phrase_estimates(name: str, estimates: torch.Tensor, treatment_phrases: list) -> dict:
+    """ 
+    {f"{name}_{phrase}": estimate} for a (num_phrases,) tensor of per-phrase ATE estimates.
+    All values are None if estimates is None.
+    """
+    values = estimates.tolist() if estimates is not None else [None] * len(treatment_phrases)
+    return {f"{name}_{phrase}": value for phrase, value in zip(treatment_phrases, values)}
+
+
+def _stack_ranks(tensor: torch.Tensor) -> torch.Tensor:
+    # (world_size, ...) stack of every rank's copy of a per-rank tensor
+    return torch.stack(all_gather_list([tensor.detach().cpu()]))
+
+
+def resumable_training_state(epoch: int, start_batch: int, optimizer_steps: int, experiment_id: int, 
+                            early_stopper: EarlyStopper, epoch_ate: torch.Tensor, 
+                            running_ate_numer: torch.Tensor, running_ate_denom: int, 
+                            total_loss: torch.Tensor, train_metrics: StreamingBinaryMetrics, token_counts: dict) -> dict:
+    """ 
+    Training loop state of a resumable checkpoint that continues at loader batch start_batch of epoch. 
+    The running ATE is global, the loss sum and train metric counts are per rank and stored for every 
+    rank, so it must be called on every rank.
+    """
+    return {
+        'epoch': epoch,
+        'start_batch': start_batch,
+        'optimizer_steps': optimizer_steps,
+        'world_size': dist.get_world_size() if dist.is_initialized() else 1,
+        'experiment_id': experiment_id,
+        'early_stopper': early_stopper.state_dict(),
+        'epoch_ate': epoch_ate,
+        'running_ate_numer': running_ate_numer,
+        'running_ate_denom': running_ate_denom,
+        'total_loss': _stack_ranks(total_loss),
+        'train_confusion': _stack_ranks(train_metrics.confusion),
+        'train_histogram': _stack_ranks(train_metrics.histogram) if train_metrics.histogram is not None else None,
+        'token_counts': token_counts,
+    }
+
+
+def load_splits(args) -> tuple:
+    """ 
+    Train, validation, and test datasets of args.dataset (IMDB: validation is 20% of the train split).
+    """
     if args.dataset == "imdb":
         imdb_train_original = load_imdb_data(split = "train")
         imdb_train_splits = imdb_train_original.train_test_split(test_size=0.2)
@@ -82,9 +325,7 @@ def train_causal_sent(args):
         imdb_ds_test: IMDBDataset = IMDBDataset(imdb_test,
                                             split = "test", 
                                             args = args)
-        ds_train = imdb_ds_train
-        ds_val = imdb_ds_val
-        ds_test = imdb_ds_test
+        return imdb_ds_train, imdb_ds_val, imdb_ds_test
     else: 
         civil_train = load_civil_comments_data(split = "train")
         civil_val = load_civil_comments_data(split = "validation")
@@ -99,9 +340,151 @@ def train_causal_sent(args):
         civil_ds_test: CivilCommentsDataset = CivilCommentsDataset(civil_test,
                                                     split = "test", 
                                                     args = args)
-        ds_train = civil_ds_train
-        ds_val = civil_ds_val
-        ds_test = civil_ds_test
+        return civil_ds_train, civil_ds_val, civil_ds_test
+
+
+def cached_loaders(model, datasets, args, device, batch_size: int, num_frozen_layers: int = None):
+    """ 
+    Build embedding stores for the train, val, and test datasets and return DataLoaders over them
+    along with the stores. Caches the full frozen backbone output if num_frozen_layers is None, 
+    otherwise the hidden states out of the first num_frozen_layers layers.
+    """
+    loaders, stores = [], []
+    for ds in datasets:
+        if num_frozen_layers is None:
+            store = build_embedding_store(model=model, dataset=ds, args=args, device=device, 
+                                        cache_dir=args.embedding_cache_dir)
+        else:
+            store = build_layer_store(model=model, dataset=ds, args=args, device=device, 
+                                    cache_dir=args.embedding_cache_dir, num_frozen_layers=num_frozen_layers)
+        stores.append(store)
+        cached_ds = CachedEmbeddingDataset(store, ds)
+        loaders.append(DataLoader(cached_ds, 
+                                batch_size=batch_size, 
+                                sampler=ResumableSampler(cached_ds, seed=args.seed) if ds.split == 'train' else None,
+                                generator=torch.Generator().manual_seed(args.seed),
+                                collate_fn=CachedEmbeddingDataset.collate_fn))
+    return loaders, stores
+
+
+def train_causal_sent(args):
+    """ 
+    Dataset preparation and training loop for the CausalSent model.
+    """
+    # ====== Resume an Interrupted Run (with its saved arguments) ======
+    resume_checkpoint: dict = None
+    resume_state: dict = None
+    if args.resume:
+        resume_checkpoint = read_checkpoint(args.resume)
+        if 'training_state' not in resume_checkpoint:
+            raise ValueError(f"[ERROR] {args.resume} holds no training state. Resume from an experiment's last.safetensors checkpoint.")
+        resume_path, stop_after_epoch = args.resume, args.stop_after_epoch
+        args = resume_checkpoint['args']
+        args.resume, args.stop_after_epoch = resume_path, stop_after_epoch
+        resume_state = resume_checkpoint['training_state']
+        print(f"Resuming experiment {resume_state['experiment_id']} at epoch {resume_state['epoch'] + 1}, "
+            f"batch {resume_state['start_batch'] + 1}")
+    
+    seed_everything(args.seed)
+    
+    # ====== Check Args ========
+    if not args.interleave_training and args.lambda_reg > 0:
+        warnings.warn("Regularization loss is enabled but interleave_training is disabled. Competing objectives will yield bad ATEs and bad model.")
+        
+    if args.interleave_training and not args.running_ate:
+        raise ValueError("Interleaved training requires running_ate to be enabled. Pass --running_ate. We need a running ATE to compute the epoch ATEs for interleaved training.")
+    
+    if args.cache_embeddings and process_unfreeze_param(args.unfreeze_backbone) != 0:
+        raise ValueError("Embedding caching requires a fully frozen backbone. Pass --unfreeze_backbone top0.")
+    
+    if args.cache_frozen_layers and args.cache_embeddings:
+        raise ValueError("Pass only one of --cache_embeddings and --cache_frozen_layers.")
+    
+    if args.cache_frozen_layers and not "bert" in args.pretrained_model_name:
+        raise ValueError("Frozen layer caching is only supported for DistilBERT backbones.")
+    
+    if args.lora_rank > 0 and process_unfreeze_param(args.unfreeze_backbone) != 0:
+        raise ValueError("LoRA trains adapters on a frozen backbone. Pass --unfreeze_backbone top0.")
+    
+    if args.lora_rank > 0 and args.cache_embeddings:
+        raise ValueError("Embedding caching requires a frozen backbone, but LoRA adapters change its outputs.")
+    
+    if args.grad_accum_steps < 1:
+        raise ValueError(f"[ERROR] --grad_accum_steps must be at least 1, got {args.grad_accum_steps}.")
+    
+    # every epoch's loss must be a tensor to backpropagate (L1 is a separate proximal step, see ProximalL1)
+    loss_weights = {'lambda_bce': args.lambda_bce, 'lambda_reg': args.lambda_reg, 'lambda_riesz': args.lambda_riesz}
+    if not all(weight >= 0 for weight in loss_weights.values()):
+        raise ValueError(f"[ERROR] Loss weights must be non-negative, got {loss_weights}.")
+    if args.interleave_training:
+        # sentiment epochs train bce (+ reg after the first epoch), Riesz epochs train riesz only
+        phases = {'Interleaved sentiment epochs need --lambda_bce > 0 (the first one trains without --lambda_reg)': args.lambda_bce > 0,
+                'Interleaved Riesz epochs need --lambda_riesz > 0': args.lambda_riesz > 0 or args.epochs < 2}
+    else:
+        phases = {'Training needs at least one of --lambda_bce, --lambda_reg, --lambda_riesz > 0': any(weight > 0 for weight in loss_weights.values())}
+    for requirement, satisfied in phases.items():
+        if not satisfied:
+            raise ValueError(f"[ERROR] {requirement}, got {loss_weights}.")
+    
+    treatment_phrases: list = args.treatment_phrases or [args.treatment_phrase]
+    if len(treatment_phrases) > 1 and (args.cache_embeddings or args.cache_frozen_layers):
+        raise ValueError("Embedding and frozen layer caches hold a single treated and control view. "
+                        "Multiple --treatment_phrases require token inputs.")
+    
+    if args.distributed and (args.cache_embeddings or args.cache_frozen_layers):
+        raise ValueError("[ERROR] --distributed trains from token inputs. Disable --cache_embeddings and --cache_frozen_layers.")
+    
+    # ====== Distributed Data Parallel (torchrun, gloo) ======
+    distributed: bool = args.distributed
+    world_size: int = 1
+    if distributed:
+        dist.init_process_group(backend="gloo")
+        world_size = dist.get_world_size()
+        # torchrun defaults every rank to 1 thread, split the node's cores between its ranks instead
+        local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+        print(f"Rank {dist.get_rank()}/{world_size}: {torch.get_num_threads()} threads")
+    if resume_state is not None and resume_state['world_size'] != world_size:
+        raise ValueError(f"[ERROR] The checkpoint was trained on {resume_state['world_size']} rank(s), resume it on the same number (got {world_size}).")
+    
+    project_name = args.project_name
+    
+    # ====== Verbose Argument Printout ======
+    print("\n" + "="*50)
+    print("Running CausalSent Training with the following arguments:")
+    for arg, value in vars(args).items():
+        print(f"{arg}: {value}")
+    print("="*50 + "\n")
+    
+    # ====== Initialize Experiment Tracking DB ======
+    # DB rows, wandb logs, and checkpoints are written by rank 0 only
+    experiment_id = None
+    if resume_state is not None:
+        experiment_id = resume_state['experiment_id']  # continue the interrupted run's DB rows and checkpoints
+    elif args.experiment_id is not None:
+        experiment_id = args.experiment_id  # row created by a sweep
+    elif is_main_process():
+        initialize_database()
+        experiment_id = save_arguments_to_db(args=args, project_name=project_name)
+    if distributed and resume_state is None and args.experiment_id is None:
+        experiment_id = all_gather_list([experiment_id])[0]  # checkpoint paths on every rank
+    
+    # ======= Setup Tracking and Device ========
+    # Initialize wandb
+    wandb.init(project=project_name, config=args, mode=None if is_main_process() else "disabled")
+    # Device setup
+    device = torch.device("cpu" if distributed  # gloo data parallel training is CPU only
+                        else "cuda" if torch.cuda.is_available() 
+                        else "mps" if torch.backends.mps.is_available() 
+                        else "cpu")
+    print(f"Using device: {device}")
+    if str(device) == "mps" and args.autocast:
+        raise ValueError("Mixed precision training not supported with MPS. Disable autocast.")
+    if device.type == "cpu" and args.autocast and not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+        warnings.warn("[WARNING] This CPU has no native bfloat16 support (AVX-512 BF16 / AMX). --autocast will likely be slower than fp32.")
+    
+    # =========== Load Data ==============
+    ds_train, ds_val, ds_test = load_splits(args)
 
     # ======== Setup Training ==========
     # Hyperparameters
@@ -111,6 +494,9 @@ def train_causal_sent(args):
     lambda_l1: float = args.lambda_l1
     batch_size: int = args.batch_size
     epochs: int = args.epochs
+    if args.grad_accum_steps > 1 or args.micro_batch_tokens > 0:
+        print(f"Effective batch size: {batch_size * args.grad_accum_steps} ({args.grad_accum_steps} x {batch_size}), "
+            f"micro-batch budget: {args.micro_batch_tokens if args.micro_batch_tokens > 0 else 'none'} tokens")
     
     # ======== Setup Interleaved Training if Req =========
     sentiment_epochs = None
@@ -119,7 +505,7 @@ def train_causal_sent(args):
         sentiment_epochs = {epoch: (epoch % 2 == 0) for epoch in range(epochs)}   # even epochs for sentiment, start w sentiment
         riesz_epochs = {epoch: (epoch % 2 != 0) for epoch in range(epochs)}   # odd epochs for riesz
     
-    log_every: int = args.log_every
+    log_every: int = args.log_every  # optimizer steps
     running_ate: bool = args.running_ate # whether to track a running average or batch average to compute the RR ATE
     pretrained_model_name: str = args.pretrained_model_name
     lr: float = args.lr
@@ -127,15 +513,33 @@ def train_causal_sent(args):
     
     
     
-    # DataLoaders
-    train_loader = DataLoader(ds_train, batch_size=batch_size, shuffle=True, collate_fn=SimilarityDataset.collate_fn)
-    val_loader = DataLoader(ds_val, batch_size=batch_size, collate_fn=SimilarityDataset.collate_fn)
-    test_loader = DataLoader(ds_test, batch_size=batch_size, collate_fn=SimilarityDataset.collate_fn)
+    # DataLoaders (each rank trains on its shard of a (seed, epoch) shuffle and evaluates an unpadded shard).
+    # Distributed training drops the uneven tail of the shuffle, padded shards would count duplicated rows 
+    # in the all-reduced running ATE. The loader's own generator seeds its workers, so starting an epoch 
+    # does not draw from the global RNG
+    train_sampler = ResumableSampler(ds_train, num_replicas=world_size, rank=dist.get_rank() if distributed else 0, 
+                                    seed=args.seed, drop_last=distributed)
+    train_loader = DataLoader(ds_train, batch_size=batch_size, sampler=train_sampler, generator=torch.Generator().manual_seed(args.seed),
+                            collate_fn=SimilarityDataset.collate_fn, **loader_options(args, device))
+    val_loader = DataLoader(rank_shard(ds_val), batch_size=batch_size, collate_fn=SimilarityDataset.collate_fn, 
+                            **loader_options(args, device))
+    test_loader = DataLoader(rank_shard(ds_test), batch_size=batch_size, collate_fn=SimilarityDataset.collate_fn, 
+                            **loader_options(args, device))
 
     # Model, optimizer, and loss
     model = CausalSent(pretrained_model_name=pretrained_model_name, 
                     sentiment_head_type = args.sentiment_head_type, 
-                    riesz_head_type = args.riesz_head_type).to(device)
+                    riesz_head_type = args.riesz_head_type,
+                    fuse_views = args.fuse_views,
+                    pack_sequences = args.pack_sequences,
+                    checkpoint_every = args.checkpoint_every,
+                    lora_rank = args.lora_rank,
+                    lora_alpha = args.lora_alpha,
+                    lora_dropout = args.lora_dropout,
+                    num_treatment_phrases = len(treatment_phrases)).to(device)
+    
+    if args.compile:
+        model.compile_forward()
     
     percent_trainable_params: dict = {
         'trainable_backbone': model.percentage_trainable_backbone_params(),
@@ -150,26 +554,54 @@ def train_causal_sent(args):
     else:
         raise ValueError("unfreeze_backbone parsed badly: {args.unfreeze_backbone}")
     
+    # ===== Precompute frozen backbone embeddings once, train heads from the cache =====
+    if args.cache_embeddings:
+        (train_loader, val_loader, test_loader), _ = cached_loaders(model, [ds_train, ds_val, ds_test], 
+                                                                    args, device, batch_size)
+    
+    # ===== Cache hidden states out of the frozen bottom layers (rebuilt when more layers unfreeze) =====
+    token_loaders = (train_loader, val_loader, test_loader)
+    num_frozen_layers: int = 0  # layer boundary the current layer stores were built at, 0 = no layer cache
+    layer_stores: list = []
+    
     # Optimizer and BCE (sentiment) loss    
     optimizer = torch.optim.AdamW(model.parameters(), lr=lr)
+    proximal_l1 = ProximalL1(optimizer, lambda_l1)  # decoupled L1 regularization, no-op when lambda_l1 == 0
     bce_loss = torch.nn.BCEWithLogitsLoss()  # for binary IMDB labels
-
-    # ===== scale gradients for mixed precision training =====
-    scaler = GradScaler() if args.autocast else None
     
-    # track full epoch ATE estimates
-    epoch_ate: float = None
+    # best checkpoints are snapshot in the loop and written to disk in the background
+    checkpoint_writer = AsyncCheckpointWriter()
+    best_model_path = os.path.join("out", f"experiment_{experiment_id}", f"best_model.{getattr(args, 'checkpoint_format', 'safetensors')}")  # runs resumed from before --checkpoint_format keep .safetensors
+    # resumable checkpoint with the training loop state, at epoch ends and every --checkpoint_every_steps steps
+    last_checkpoint_writer = AsyncCheckpointWriter()
+    last_model_path = os.path.join("out", f"experiment_{experiment_id}", "last.safetensors")
+    
+    # track full epoch ATE estimates, one per treatment phrase
+    epoch_ate: torch.Tensor = None
+    ate_dtype = torch.float32 if device.type == 'mps' else torch.float64  # MPS has no float64
+    
+    # DDP wrapper of the model, and the (trainable parameters, skips parameters) it was built for
+    train_model: torch.nn.Module = model
+    ddp_signature: tuple = None
     
     # ================ Training Loop =================
     early_stopper = EarlyStopper(patience=args.early_stop_patience, delta=args.early_stop_delta)
-    for epoch in range(epochs):
+    start_epoch: int = 0
+    if resume_state is not None:
+        model.load_trainable_state_dict(resume_checkpoint['model_state_dict'], trainable_only=resume_checkpoint['trainable_only'])
+        optimizer.load_state_dict(resume_checkpoint['optimizer_state_dict'])
+        early_stopper.load_state_dict(resume_state['early_stopper'])
+        epoch_ate = resume_state['epoch_ate']
+        start_epoch = resume_state['epoch']
+    for epoch in range(start_epoch, epochs):
         model.train()
-        total_loss = 0
-        train_targets, train_predictions = [], []
+        # per-step accumulators stay on device, read back only at log_every steps and epoch end
+        total_loss: torch.Tensor = torch.zeros((), device=device)
+        train_metrics = StreamingBinaryMetrics(device, num_bins=args.metric_bins)
         
-        # reset running ATE every epoch
-        running_ate_numer: float = 0 
-        running_ate_denom: float = 0
+        # reset running ATE every epoch (numerator per treatment phrase)
+        running_ate_numer: torch.Tensor = torch.zeros(len(treatment_phrases), dtype=ate_dtype, device=device)
+        running_ate_denom: int = 0  # summed batch sizes, known on the host
         
         # ========= Iterative Unfreezing ==========
         if args.unfreeze_backbone == "iterative":
@@ -177,6 +609,22 @@ def train_causal_sent(args):
             if epoch_fraction > fraction_to_unfreeze:
                 fraction_to_unfreeze = epoch_fraction
                 percent_trainable_params = model.unfreeze_backbone_fraction(fraction_to_unfreeze)  # only unfreeze when something changes (not a bug otherwise, just waste of time)
+        
+        # ========= Frozen Layer Cache (Re)Build ==========
+        if args.cache_frozen_layers and model.frozen_layer_boundary() != num_frozen_layers:
+            # cached activations are only valid for the boundary they were computed at
+            for store in layer_stores:
+                store.remove()
+            num_frozen_layers = model.frozen_layer_boundary()
+            if num_frozen_layers > 0:
+                print(f"Caching hidden states out of the {num_frozen_layers} frozen bottom backbone layers.")
+                (train_loader, val_loader, test_loader), layer_stores = cached_loaders(
+                    model, [ds_train, ds_val, ds_test], args, device, batch_size, num_frozen_layers=num_frozen_layers
+                )
+            else:
+                print("No frozen bottom backbone layers left to cache. Running the full backbone.")
+                train_loader, val_loader, test_loader = token_loaders
+                layer_stores = []
                 
         # ========= Interleaved Training ==========
         training_sentiment: bool = True
@@ -212,265 +660,363 @@ def train_causal_sent(args):
             else: 
                 raise ValueError("Epoch not in sentiment or riesz epochs")
         
-        for i, batch in enumerate(train_loader):
-            input_ids_real = batch['input_ids_real'].to(device)
-            input_ids_treated = batch['input_ids_treated'].to(device)
-            input_ids_control = batch['input_ids_control'].to(device)
-            attention_mask_real = batch['attention_mask_real'].to(device)
-            attention_mask_treated = batch['attention_mask_treated'].to(device)
-            attention_mask_control = batch['attention_mask_control'].to(device)
-            targets = batch['targets'].float().to(device)
+        # ========= Active Training Terms ==========
+        # the forward only computes the views and head outputs these terms read, e.g. the real 
+        # view alone on the first interleaved sentiment epoch
+        estimating_ate: bool = not (args.interleave_training and training_sentiment)  # tau_hat from this epoch's Riesz outputs
+        active_terms: set = {term for term, weight in [('bce', lambda_bce), ('reg', lambda_reg), ('riesz', lambda_riesz)] 
+                            if weight > 0}
+        if estimating_ate:
+            active_terms.add('dr_ate' if doubly_robust else 'ate')
+        # ========= Data Parallel Wrapper ==========
+        # DDP only synchronizes parameters that were trainable when it was built, so it is rebuilt when 
+        # iterative unfreezing changes the trainable set. A zero-weight loss term leaves its head (and 
+        # the views only it reads) without gradients, which DDP has to search for every backward
+        if distributed:
+            skips_parameters: bool = not {'bce', 'reg', 'riesz'} <= active_terms
+            signature = (tuple(param.requires_grad for param in model.parameters()), skips_parameters)
+            if signature != ddp_signature:
+                train_model = DistributedDataParallel(model, find_unused_parameters=skips_parameters)
+                ddp_signature = signature
+        
+        # backbone views per row, for sizing micro-batches to the --micro_batch_tokens budget
+        views_per_row: int = (1 + 2 * len(treatment_phrases) 
+                            if model._needs_counterfactuals(model.required_outputs(active_terms)) else 1)
+        
+        epoch_start = time.perf_counter()
+        model.token_counts = {'real': 0, 'padded': 0}
+        reset_peak_memory(device)
+        sync_counter = SyncCounter(enabled=args.count_syncs)
+        # next batches are collated and moved to the device in the background while this one trains
+        train_batches = DevicePrefetcher(train_loader, device, depth=args.prefetch_batches)
+        optimizer_steps: int = 0
+        # optimizer steps and micro-batches run by this process in this epoch (after a resume, only the 
+        # remaining ones), the denominators of the per-step sync and time reports
+        steps_run: int = 0
+        micro_batches_run: int = 0
+        
+        # ========= Resume the Interrupted Epoch ==========
+        epoch_start_batch: int = 0
+        train_loader.sampler.set_epoch(epoch)  # same shuffle in a resumed run
+        if resume_state is not None:
+            epoch_start_batch = resume_state['start_batch']
+            if epoch_start_batch > 0:  # accumulators of the batches trained before the checkpoint
+                rank = dist.get_rank() if distributed else 0
+                total_loss = resume_state['total_loss'][rank].to(device)
+                train_metrics.confusion = resume_state['train_confusion'][rank].to(device)
+                if train_metrics.histogram is not None:
+                    train_metrics.histogram = resume_state['train_histogram'][rank].to(device)
+                running_ate_numer = resume_state['running_ate_numer'].to(device=device, dtype=ate_dtype)
+                running_ate_denom = resume_state['running_ate_denom']
+                optimizer_steps = resume_state['optimizer_steps']
+                model.token_counts = resume_state['token_counts']
+            set_rng_state(resume_checkpoint)  # dropout continues where the interrupted run stopped
+            resume_state = None
+        train_loader.sampler.set_start_batch(epoch_start_batch, batch_size)
+        num_train_batches: int = epoch_start_batch + len(train_loader)
+        
+        with sync_counter:
+            # micro-batches of the loader batches, one optimizer step per grad_accum_steps batches
+            for i, batch, batch_fraction, loss_weight, starts_step, ends_step in accumulation_windows(
+                train_batches, args.grad_accum_steps, args.micro_batch_tokens, views_per_row, start_batch=epoch_start_batch
+            ):
+                targets = batch['targets'].float().to(device)
             
-            optimizer.zero_grad()  # Clear gradients
-
-            # fwd pass
-            (sentiment_outputs_real, sentiment_outputs_treated, sentiment_outputs_control, 
-            riesz_outputs_real, riesz_outputs_treated, riesz_outputs_control) = model(
-                input_ids_real,
-                input_ids_treated,
-                input_ids_control,
-                attention_mask_real,
-                attention_mask_treated,
-                attention_mask_control,
-            )
-            treat_out = torch.sigmoid(sentiment_outputs_treated)
-            control_out = torch.sigmoid(sentiment_outputs_control)
-            real_out = torch.sigmoid(sentiment_outputs_real)
+                if starts_step:
+                    optimizer.zero_grad()  # Clear gradients
+                    # batch-level ATE sums over the micro-batches of this optimizer step
+                    step_ate_numer: torch.Tensor = torch.zeros(len(treatment_phrases), device=device)
+                    step_ate_denom: int = 0
+
+                # fwd pass
+                if distributed:
+                    train_model.require_backward_grad_sync = ends_step  # all-reduce gradients once per optimizer step
+                with sync_counter.region('forward'):
+                    (sentiment_outputs_real, sentiment_outputs_treated, sentiment_outputs_control, 
+                    riesz_outputs_real, riesz_outputs_treated, riesz_outputs_control) = training_forward(
+                        train_model, batch, args, device, num_frozen_layers=num_frozen_layers, terms=active_terms
+                    )
+                treat_out = torch.sigmoid(sentiment_outputs_treated) if sentiment_outputs_treated is not None else None
+                control_out = torch.sigmoid(sentiment_outputs_control) if sentiment_outputs_control is not None else None
+                real_out = torch.sigmoid(sentiment_outputs_real)
             
-            # Compute tau_hat (estimated average treatment effect (ATE) of the 
-            # selected treatment_phrase as estimated by a riesz representation
-            # formula with RR computed via our simple implementation of RieszNet
+                # Compute tau_hat (estimated average treatment effect (ATE) of the 
+                # selected treatment_phrase as estimated by a riesz representation
+                # formula with RR computed via our simple implementation of RieszNet
             
-            # note, whenever computing g (our estimate of the oracle sentiment analysis function)
-            # we must apply sigmoid to the logits, otherwise treatment effects become nonsense 
-            # in the binary sentiment domain 
-            if not (args.interleave_training and training_sentiment):
-                if running_ate:
-                    # Compute batch-level numerator and denominator
-                    batch_numer = None
-                    batch_denom = None
-                    if doubly_robust:
-                        # TE_direct = g(X_i, 1) - g(X_i, 0), averaged later -> ATE_DIRECT
-                        direct_te = treat_out - control_out
-                        # TE_doublyrobust = TE_direct + RR(Z) * (Y - g(Z)), -> sum, -> averaged later by denom -> DR_ATE_DIRECT
-                        batch_numer = torch.sum(direct_te + riesz_outputs_real * (targets - real_out))
-                    else:
-                        # RR(Z) * g(Z)  -- r.r. ATE, not doubly robust, averaged later
-                        batch_numer = torch.sum(riesz_outputs_real * real_out)
+                # note, whenever computing g (our estimate of the oracle sentiment analysis function)
+                # we must apply sigmoid to the logits, otherwise treatment effects become nonsense 
+                # in the binary sentiment domain 
+            
+                # Riesz outputs and treated/control predictions have one column per treatment phrase, 
+                # (batch_size, num_phrases), so every estimate below is a (num_phrases,) vector
+                if estimating_ate:
+                    if running_ate:
+                        # Compute batch-level numerator and denominator
+                        batch_numer = None
+                        batch_denom = None
+                        if doubly_robust:
+                            # TE_direct = g(X_i, 1) - g(X_i, 0), averaged later -> ATE_DIRECT
+                            direct_te = treat_out - control_out
+                            # TE_doublyrobust = TE_direct + RR(Z) * (Y - g(Z)), -> sum, -> averaged later by denom -> DR_ATE_DIRECT
+                            batch_numer = torch.sum(direct_te + riesz_outputs_real * (targets.unsqueeze(-1) - real_out), dim=0)
+                        else:
+                            # RR(Z) * g(Z)  -- r.r. ATE, not doubly robust, averaged later
+                            batch_numer = torch.sum(riesz_outputs_real * real_out, dim=0)
                         
-                    batch_denom = riesz_outputs_real.size(0)  # Batch size for E_n[.]
+                        batch_denom = riesz_outputs_real.size(0)  # Batch size for E_n[.]
+                        batch_numer = batch_numer.detach().to(ate_dtype)
+                        if distributed:
+                            # global running ATE, so every rank regularizes toward the same estimate. 
+                            # the drop_last sampler gives every rank equally sized batches of distinct rows
+                            dist.all_reduce(batch_numer)
+                            batch_denom *= world_size
 
-                    # Update the running numerator and denominator
-                    running_ate_numer += batch_numer.item()
-                    running_ate_denom += batch_denom
+                        # Update the running numerator and denominator
+                        running_ate_numer += batch_numer
+                        running_ate_denom += batch_denom
 
-                    # Recompute tau_hat as the mean
-                    tau_hat = torch.Tensor([running_ate_numer / running_ate_denom]).to(device)
-                else:
-                    tau_hat = None
-                    if doubly_robust:
-                        # ATE_direct = E_n[g(X_i, 1), g(X_i, 0)]
-                        direct_ate = torch.mean(treat_out - control_out)
-                        # ATE_doublyrobust = ATE_direct + E_n[RR(Z) * (Y - g(Z))]
-                        tau_hat = direct_ate + torch.mean(riesz_outputs_real * (targets - real_out))
+                        # Recompute tau_hat as the mean
+                        tau_hat = (running_ate_numer / running_ate_denom).float()
                     else:
-                        # E_n[RR(Z) * g_0(Z)]  -- r.r. ATE, not doubly robust
-                        tau_hat = torch.mean(riesz_outputs_real * real_out)
-            elif training_reg: # if training sentiment head AND regularization, tau_hat should use the previous epoch_ate. Only when past the two warmup epochs and training reg
-                tau_hat = torch.Tensor([epoch_ate]).to(device)
-            else: # first sentiment epoch, no tau_hat yet and no regularization loss
-                if not epoch == 0: 
-                    raise ValueError("All epochs other than 0 should have a tau_hat. Something went wrong.")
-                tau_hat = None
+                        # Batch average over the effective batch (all micro-batches of this optimizer 
+                        # step so far), earlier micro-batches enter detached
+                        batch_numer = None
+                        if doubly_robust:
+                            # ATE_doublyrobust = E_n[g(X_i, 1) - g(X_i, 0)] + E_n[RR(Z) * (Y - g(Z))]
+                            batch_numer = torch.sum((treat_out - control_out) + riesz_outputs_real * (targets.unsqueeze(-1) - real_out), dim=0)
+                        else:
+                            # E_n[RR(Z) * g_0(Z)]  -- r.r. ATE, not doubly robust
+                            batch_numer = torch.sum(riesz_outputs_real * real_out, dim=0)
+                        step_ate_denom += riesz_outputs_real.size(0)
+                        tau_hat = (step_ate_numer + batch_numer) / step_ate_denom
+                        step_ate_numer = step_ate_numer + batch_numer.detach()
+                elif training_reg: # if training sentiment head AND regularization, tau_hat should use the previous epoch_ate. Only when past the two warmup epochs and training reg
+                    tau_hat = epoch_ate.to(device)
+                else: # first sentiment epoch, no tau_hat yet and no regularization loss
+                    if not epoch == 0: 
+                        raise ValueError("All epochs other than 0 should have a tau_hat. Something went wrong.")
+                    tau_hat = None
             
-            if args.autocast:
-                with autocast(device_type=str(device), dtype=torch.bfloat16):  # Use autocast for MPS
-                    riesz_loss = 0 
-                    reg_loss = 0
-                    bce = 0
-                    l1_loss = 0
-                    if lambda_riesz > 0:
-                        riesz_loss = torch.mean(-2 * (riesz_outputs_treated - riesz_outputs_control) + (riesz_outputs_real ** 2))
-                    if lambda_reg > 0:
-                        reg_loss = torch.mean(((treat_out - control_out) - tau_hat) ** 2)
-                    if lambda_bce > 0:
-                        bce = bce_loss(sentiment_outputs_real.squeeze(), targets)
-                    l1_loss = sum(torch.sum(torch.abs(param)) for param in model.parameters() if param.requires_grad)    # L1 loss on trainable params
-                    loss = lambda_bce * bce + lambda_reg * reg_loss + lambda_riesz * riesz_loss + lambda_l1 * l1_loss
-            else:
-                # Compute losses without autocast
+                # Losses in fp32 (training_forward returns fp32 outputs under --autocast too)
                 riesz_loss = 0 
                 reg_loss = 0
                 bce = 0
-                l1_loss = 0
                 if lambda_riesz > 0:
                     riesz_loss = torch.mean(-2 * (riesz_outputs_treated - riesz_outputs_control) + (riesz_outputs_real ** 2))
                 if lambda_reg > 0:
                     reg_loss = torch.mean(((treat_out - control_out) - tau_hat) ** 2)
                 if lambda_bce > 0:
-                    bce = bce_loss(sentiment_outputs_real.squeeze(), targets)
-                l1_loss = sum(torch.sum(torch.abs(param)) for param in model.parameters() if param.requires_grad)    # L1 loss on trainable params
-                loss = lambda_bce * bce + lambda_reg * reg_loss + lambda_riesz * riesz_loss + lambda_l1 * l1_loss
+                    bce = bce_loss(sentiment_outputs_real.squeeze(-1), targets)
+                loss = lambda_bce * bce + lambda_reg * reg_loss + lambda_riesz * riesz_loss  # L1 is applied after the step (ProximalL1)
                 
-            if args.autocast:
-                # scale gradients to avoid underflow/overflow if autocasting
-                scaler.scale(loss).backward()
-                scaler.step(optimizer)
-                scaler.update()
-            else:
-                loss.backward()
-                optimizer.step()
-
-            total_loss += loss.item()
-
-            # =======   Logging   ========
-            # Compute training metrics
-            preds = torch.sigmoid(sentiment_outputs_real).squeeze().detach().cpu().numpy()
-            # WHY IS THRESHOLD 0.5?
-            preds = (preds > 0.5).astype(int)
-            train_targets.extend(targets.cpu().numpy())
-            train_predictions.extend(preds)
-
-            if (i + 1) % log_every == 0:
-                train_acc = accuracy_score(train_targets, train_predictions)
-                train_f1 = f1_score(train_targets, train_predictions)
-                wandb.log(
-                        {"Train Loss": loss.item(), 
-                            "Train Accuracy": train_acc, 
-                            "Train F1": train_f1, 
-                            f"Tau_Hat_{args.treatment_phrase}": tau_hat.item() if tau_hat else None,
-                            "Batch": i + 1, 
-                            "Backbone %Trainable": percent_trainable_params['trainable_backbone'],
-                            "Model %Trainable": percent_trainable_params['trainable_model'],
-                            "BCE Loss": bce.item() if bce else None,
-                            "Reg Loss": reg_loss.item() if reg_loss else None,
-                            "Riesz Loss": riesz_loss.item() if riesz_loss else None,
-                            "L1 Loss": l1_loss.item() if l1_loss else None
-                        }, 
+                with sync_counter.region('backward'):
+                    # bf16 autocast needs no gradient scaling, gradients and optimizer state are fp32
+                    (loss * loss_weight).backward()  # accumulate the gradient of the effective batch mean
+                if ends_step:
+                    with sync_counter.region('optimizer'):
+                        optimizer.step()
+                        proximal_l1.step()  # soft-threshold trainable params toward zero by lr * lambda_l1
+                    optimizer_steps += 1
+                    steps_run += 1
+                micro_batches_run += 1
+
+                total_loss += loss.detach() * batch_fraction  # per loader batch mean
+
+                # =======   Logging   ========
+                # Compute training metrics (counts on device, read back at log steps)
+                # WHY IS THRESHOLD 0.5?
+                train_metrics.update(torch.sigmoid(sentiment_outputs_real).squeeze(-1), targets)
+
+                with sync_counter.region('logging'):
+                    if ends_step and optimizer_steps % log_every == 0 and is_main_process():
+                        epoch_train_metrics = train_metrics.compute()
+                        train_acc, train_f1 = epoch_train_metrics['accuracy'], epoch_train_metrics['f1']
+                        wandb.log(
+                                {"Train Loss": loss.item(), 
+                                    "Train Accuracy": train_acc, 
+                                    "Train F1": train_f1, 
+                                    "Train AUC": epoch_train_metrics.get('auc'),
+                                    **per_phrase_estimates("Tau_Hat", tau_hat, treatment_phrases),
+                                    "Batch": i + 1, 
+                                    "Backbone %Trainable": percent_trainable_params['trainable_backbone'],
+                                    "Model %Trainable": percent_trainable_params['trainable_model'],
+                                    "BCE Loss": bce.item() if bce else None,
+                                    "Reg Loss": reg_loss.item() if reg_loss else None,
+                                    "Riesz Loss": riesz_loss.item() if riesz_loss else None,
+                                    "L1 Loss": proximal_l1.l1_norm().item() if lambda_l1 > 0 else None
+                                }, 
+                                )
+                        print(
+                            f"Epoch {epoch + 1}/{epochs}, "
+                            f"Batch {i + 1}/{num_train_batches}, "
+                            f"Loss: {loss.item():.4f}, "
+                            f"Accuracy: {train_acc:.4f}, "
+                            f"F1: {train_f1:.4f}, "
+                            + "".join(f"{name}: {f'{value:.4f}' if value is not None else 'None'}, " 
+                                    for name, value in per_phrase_estimates("Tau_Hat", tau_hat, treatment_phrases).items()) +
+                            f"Backbone %Trainable: {percent_trainable_params['trainable_backbone']}, "
+                            f"Model %Trainable: {percent_trainable_params['trainable_model']},"
                         )
-                print(
-                    f"Epoch {epoch + 1}/{epochs}, "
-                    f"Batch {i + 1}/{len(train_loader)}, "
-                    f"Loss: {loss.item():.4f}, "
-                    f"Accuracy: {train_acc:.4f}, "
-                    f"F1: {train_f1:.4f}, "
-                    f"Tau_Hat_{args.treatment_phrase}: {f'{tau_hat.item():.4f}' if tau_hat is not None else 'None'}, "
-                    f"Backbone %Trainable: {percent_trainable_params['trainable_backbone']}, "
-                    f"Model %Trainable: {percent_trainable_params['trainable_model']},"
-                )
+                
+                # ======= Resumable Checkpoint (continues after this optimizer step) ========
+                if ends_step and args.checkpoint_every_steps > 0 and optimizer_steps % args.checkpoint_every_steps == 0:
+                    with sync_counter.pause():
+                        training_state = resumable_training_state(
+                            epoch, i + 1, optimizer_steps, experiment_id, early_stopper, epoch_ate, 
+                            running_ate_numer, running_ate_denom, total_loss, train_metrics, model.token_counts
+                        )
+                        if is_main_process():
+                            last_checkpoint_writer.save(*checkpoint_contents(model, optimizer, args, trainable_only=args.checkpoint_trainable_only, 
+                                                                            training_state=training_state), last_model_path)
 
         # ====** end of epoch stuff **====
+        epoch_train_time = time.perf_counter() - epoch_start
+        if distributed:
+            dist.all_reduce(total_loss)
+            total_loss /= world_size
+        epoch_train_loss = (total_loss / max(num_train_batches, 1)).item()
+        
+        # ====== Input Pipeline (input-bound when the queue is empty and the wait fraction is high) ======
+        input_stats = train_batches.stats()
+        data_wait_fraction = input_stats['data_wait_s'] / max(epoch_train_time, 1e-9)
+        wandb.log({"Train Data Wait (s)": input_stats['data_wait_s'], "Train Data Wait Fraction": data_wait_fraction, 
+                "Train Prefetch Queue Depth": input_stats['queue_depth'], "Epoch": epoch + 1})
+        print(f"Epoch {epoch + 1}/{epochs} Input pipeline: waited {input_stats['data_wait_s']:.2f}s for data "
+            f"({data_wait_fraction:.1%} of the epoch), mean prefetch queue depth {input_stats['queue_depth']:.2f}/{args.prefetch_batches}")
+        
+        # ====== Host Sync Points per Step ======
+        # by source, including the data-dependent ones of --pack_sequences (nonzero in pack) and 
+        # deduplicated views (mask index in dedup_backbone); benchmark_causal_sent.py --benchmark syncs 
+        # measures the loop before it kept its accumulators on the device
+        # per optimizer step (grad_accum_steps loader batches, each split into micro-batches) run this epoch
+        if args.count_syncs:
+            syncs_per_step = sync_counter.count / max(steps_run, 1)
+            syncs_per_micro_batch = sync_counter.count / max(micro_batches_run, 1)
+            wandb.log({"Train Syncs/Step": syncs_per_step, "Train Syncs/Micro-batch": syncs_per_micro_batch, "Epoch": epoch + 1})
+            print(f"Epoch {epoch + 1}/{epochs} Host sync points: {syncs_per_step:.2f}/step, {syncs_per_micro_batch:.2f}/micro-batch "
+                f"over {steps_run} steps ({micro_batches_run} micro-batches) "
+                f"(log_every={log_every}, excluding resumable checkpoint writes)\n{sync_counter.report(steps_run)}")
+        
+        # ====== Step Time and Peak Memory (activation checkpointing trade-off, also logged with it off) ======
+        step_time = epoch_train_time / max(steps_run, 1)
+        micro_batch_time = epoch_train_time / max(micro_batches_run, 1)
+        peak_memory = peak_memory_mb(device)
+        wandb.log({"Train Step Time (s)": step_time, "Train Micro-batch Time (s)": micro_batch_time, 
+                "Train Peak Memory (MB)": peak_memory, "Checkpoint Every": args.checkpoint_every, "Epoch": epoch + 1})
+        checkpointing = f"every {args.checkpoint_every} layer(s)" if args.checkpoint_every > 0 else "off"
+        print(f"Epoch {epoch + 1}/{epochs} Checkpointing {checkpointing}: "
+            f"{step_time:.3f}s/step ({steps_run} optimizer steps), {micro_batch_time:.3f}s/micro-batch, "
+            f"peak memory {peak_memory:.0f} MB")
+        
+        # ====== Packed Sequence Throughput ======
+        if args.pack_sequences and model.token_counts['padded'] > 0:
+            real_tokens, padded_tokens = model.token_counts['real'], model.token_counts['padded']
+            tokens_per_sec = real_tokens / epoch_train_time
+            padding_skipped = 1 - real_tokens / padded_tokens
+            wandb.log({"Train Tokens/sec": tokens_per_sec, "Train Padding Skipped": padding_skipped, "Epoch": epoch + 1})
+            print(f"Epoch {epoch + 1}/{epochs} Packed Sequences: {tokens_per_sec:.1f} tokens/s, "
+                f"skipped {padded_tokens - real_tokens:,} of {padded_tokens:,} padded tokens ({padding_skipped:.1%})")
         
         # ====== Full Epoch ATE is the running ATE at end of Riesz epoch ======
+        # (None without --running_ate, the per-batch estimates are not an epoch ATE)
         if training_riesz:
-            epoch_ate = running_ate_numer / running_ate_denom
+            epoch_ate = (running_ate_numer / running_ate_denom).float() if running_ate_denom > 0 else None
         
         # ======= Validation Metrics (Log Every Epoch) =======
         model.eval()
-        val_targets, val_predictions = [], []
+        val_metrics = StreamingBinaryMetrics(device, num_bins=args.metric_bins)
         with torch.no_grad():
             for batch in val_loader:
-                input_ids_real = batch['input_ids_real'].to(device)
-                attention_mask_real = batch['attention_mask_real'].to(device)
                 targets = batch['targets'].float().to(device)
                 
-                sentiment_output_real = model(input_ids_real, None, None, attention_mask_real, None, None)
-                preds = torch.sigmoid(sentiment_output_real).squeeze().cpu().numpy()
-                preds = (preds > 0.5).astype(int)
-                
-                val_targets.extend(targets.cpu().numpy())
-                val_predictions.extend(preds)
+                sentiment_output_real = sentiment_logits(model, batch, device, num_frozen_layers=num_frozen_layers, autocast=args.autocast)
+                val_metrics.update(torch.sigmoid(sentiment_output_real).squeeze(-1), targets)
         
-        # Compute validation metrics
-        val_acc = accuracy_score(val_targets, val_predictions)
-        val_f1 = f1_score(val_targets, val_predictions)
-        wandb.log({"Val Accuracy": val_acc, "Val F1": val_f1, "Epoch": epoch + 1})
+        # Compute validation metrics (over all ranks' shards, so every rank takes the same early stopping decision)
+        if distributed:
+            val_metrics.all_reduce()
+        epoch_val_metrics = val_metrics.compute()
+        val_acc, val_f1 = epoch_val_metrics['accuracy'], epoch_val_metrics['f1']
+        wandb.log({"Val Accuracy": val_acc, "Val F1": val_f1, "Val AUC": epoch_val_metrics.get('auc'), 
+                "Train Epoch Loss": epoch_train_loss, "Epoch": epoch + 1})
         if running_ate:
-            wandb.log({f"Epoch_ATE_{args.treatment_phrase}": epoch_ate})
+            wandb.log(per_phrase_estimates("Epoch_ATE", epoch_ate, treatment_phrases))
         print(f"Epoch {epoch + 1}/{epochs} Validation Accuracy: {val_acc:.4f}, F1: {val_f1:.4f}")  
+        if is_main_process():
+            save_epoch_metrics_to_db(experiment_id=experiment_id, epoch=epoch + 1, project_name=project_name,
+                                    metrics={'train_loss': epoch_train_loss, 'val_acc': val_acc, 'val_f1': val_f1, 
+                                            'epoch_ate': epoch_ate.tolist() if epoch_ate is not None else None})
         
         # ==== Early Stopping and Checkpointing ====
-        if early_stopper.highest_val_acc(val_acc):
-            model_path = os.path.join("out", f"experiment_{experiment_id}", "best_model.pt")
-            save_model(model=model, optimizer=optimizer, args=args, filepath=model_path)
-            save_model_weights_to_db(experiment_id=experiment_id, weight_path=model_path, project_name=project_name)
+        if early_stopper.highest_val_acc(val_acc) and is_main_process():
+            checkpoint_writer.save(*checkpoint_contents(model, optimizer, args, trainable_only=args.checkpoint_trainable_only), 
+                                best_model_path)
+            save_model_weights_to_db(experiment_id=experiment_id, weight_path=best_model_path, project_name=project_name)
         if early_stopper.early_stop(val_acc):
             break
+        # resumable checkpoint that continues at the next epoch
+        training_state = resumable_training_state(
+            epoch + 1, 0, optimizer_steps, experiment_id, early_stopper, epoch_ate, 
+            running_ate_numer, running_ate_denom, total_loss, train_metrics, model.token_counts
+        )
+        if is_main_process():
+            last_checkpoint_writer.save(*checkpoint_contents(model, optimizer, args, trainable_only=args.checkpoint_trainable_only, 
+                                                            training_state=training_state), last_model_path)
+        if epoch + 1 == args.stop_after_epoch and epoch + 1 < epochs:
+            checkpoint_writer.wait()
+            last_checkpoint_writer.wait()
+            print(f"Paused after epoch {epoch + 1}/{epochs}. Continue with --resume {last_model_path}")
+            if distributed:
+                dist.destroy_process_group()
+            return
         # ==== end epoch ====
         
-    best_model_path = os.path.join("out", f"experiment_{experiment_id}", "best_model.pt")
+    checkpoint_writer.wait()  # best checkpoint is on disk
+    last_checkpoint_writer.wait()
+    if distributed:
+        dist.barrier()  # rank 0 has written the best checkpoint
     best_model, _ = load_model_inference(best_model_path)
-    best_model.eval()
-    
-    # compute outputs for full training, val, and test sets at the end and save
-    # as csvs with verbose model name to out/
-    train_targets, train_predictions = [], []
-    with torch.no_grad():
-        for batch in train_loader:
-            input_ids_real = batch['input_ids_real'].to(device)
-            attention_mask_real = batch['attention_mask_real'].to(device)
-            targets = batch['targets'].float().to(device)
-            
-            sentiment_output_real = model(input_ids_real, None, None, attention_mask_real, None, None)
-            preds = torch.sigmoid(sentiment_output_real).squeeze().cpu().numpy()
-            preds = (preds > 0.5).astype(int)
-            
-            train_targets.extend(targets.cpu().numpy())
-            train_predictions.extend(preds) 
-
-    val_targets, val_predictions = [], []
-    with torch.no_grad():
-        for batch in val_loader:
-            input_ids_real = batch['input_ids_real'].to(device)
-            attention_mask_real = batch['attention_mask_real'].to(device)
-            targets = batch['targets'].float().to(device)
-            
-            sentiment_output_real = model(input_ids_real, None, None, attention_mask_real, None, None)
-            preds = torch.sigmoid(sentiment_output_real).squeeze().cpu().numpy()
-            preds = (preds > 0.5).astype(int)
-            
-            val_targets.extend(targets.cpu().numpy())
-            val_predictions.extend(preds)
-
-    test_targets, test_predictions = [], []
-    with torch.no_grad():
-        for batch in test_loader:
-            input_ids_real = batch['input_ids_real'].to(device)
-            attention_mask_real = batch['attention_mask_real'].to(device)
-            targets = batch['targets'].float().to(device)
-            
-            sentiment_output_real = model(input_ids_real, None, None, attention_mask_real, None, None)
-            preds = torch.sigmoid(sentiment_output_real).squeeze().cpu().numpy()
-            preds = (preds > 0.5).astype(int)
-            
-            test_targets.extend(targets.cpu().numpy())
-            test_predictions.extend(preds)
-    
-    save_outputs_to_db(experiment_id=experiment_id, split="train", targets=train_targets, predictions=train_predictions, project_name=project_name)
-    save_outputs_to_db(experiment_id=experiment_id, split="val", targets=val_targets, predictions=val_predictions, project_name=project_name)
-    save_outputs_to_db(experiment_id=experiment_id, split="test", targets=test_targets, predictions=test_predictions, project_name=project_name)
-    
-    # save final metrics to out/
-    train_acc = accuracy_score(train_targets, train_predictions)
-    train_f1 = f1_score(train_targets, train_predictions)
-
-    val_acc = accuracy_score(val_targets, val_predictions)
-    val_f1 = f1_score(val_targets, val_predictions)
-
-    test_acc = accuracy_score(test_targets, test_predictions)
-    test_f1 = f1_score(test_targets, test_predictions)
-    
-    final_metrics = {
-        "train_acc": train_acc,
-        "train_f1": train_f1,
-        "val_acc": val_acc,
-        "val_f1": val_f1,
-        "test_acc": test_acc,
-        "test_f1": test_f1
-    }
+    best_model.to(device)
+    
+    # ==== Score train, val, and test with the best model in one sweep ====
+    # probabilities are calibrated (temperature scaling) on the validation logits of all ranks, 
+    # and the temperature is written into the best checkpoint for predict_proba
+    if args.cache_embeddings or num_frozen_layers > 0:
+        # cached embeddings or frozen layer hidden states, in dataset order
+        eval_loaders = {split: DataLoader(loader.dataset, batch_size=args.eval_batch_size, collate_fn=loader.collate_fn) 
+                        for split, loader in [('val', val_loader), ('train', train_loader), ('test', test_loader)]}
+    else:
+        eval_loaders = {split: inference_loader(rank_shard(ds), args.eval_batch_size, args, device, 
+                                                dynamic_padding=best_model.pool_sentiment)
+                        for split, ds in [('val', ds_val), ('train', ds_train), ('test', ds_test)]}
+    split_results = evaluate_splits(best_model, eval_loaders, device, num_frozen_layers=num_frozen_layers, 
+                                    autocast=args.autocast, num_bins=args.metric_bins, calibration_split='val')
+    if is_main_process():
+        update_checkpoint(best_model_path, temperature=best_model.temperature, temperature_fitted=True)
+    
+    # per-example outputs of every rank's shard, written by rank 0
+    split_outputs = {split: (gather_list_to_main(result['targets'].tolist()), gather_list_to_main(result['predictions'].tolist())) 
+                    for split, result in split_results.items()}
+    if not is_main_process():
+        dist.destroy_process_group()
+        return
+    
+    for split in ['train', 'val', 'test']:
+        targets, predictions = split_outputs[split]
+        save_outputs_to_db(experiment_id=experiment_id, split=split, targets=targets, predictions=predictions, project_name=project_name)
+    
+    split_metrics = {split: split_results[split]['metrics'] for split in ['train', 'val', 'test']}
+    final_metrics = {}
+    for split, metrics in split_metrics.items():
+        final_metrics[f"{split}_acc"] = metrics['accuracy']
+        final_metrics[f"{split}_f1"] = metrics['f1']
     save_metrics_to_db(experiment_id=experiment_id, metrics=final_metrics, project_name=project_name)
-    wandb.log({f"{k}_final": v for k, v in final_metrics.items()})
-
+    final_aucs = {f"{split}_auc": metrics['auc'] for split, metrics in split_metrics.items() if 'auc' in metrics}
+    wandb.log({f"{k}_final": v for k, v in {**final_metrics, **final_aucs}.items()})
+    
+    if distributed:
+        dist.destroy_process_group()
     return
 
         
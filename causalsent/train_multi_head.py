@@ -0,0 +1,415 @@
+"""
+Train many CausalSent head configurations at once off one frozen backbone forward.
+
+Every configuration of --multi_head_grid (cartesian product of name=value1,value2,... entries) is
+a member: a sentiment/Riesz head pair with its own loss weights, AdamW state, running ATE, early
+stopper, experiments DB row, and best checkpoint out/experiment_<id>/best_model.pt (.safetensors
+with --checkpoint_format safetensors; a regular CausalSent checkpoint, see load_model_inference).
+The backbone views of every batch are encoded once, without gradients, and fed to all members
+still training (see modules/multi_head.py), so one epoch trains a whole hyperparameter grid or
+seed ensemble.
+
+All members see the same batches in the same order (--seed); a member's seed only sets the initial
+weights of its heads. Arguments other than the grid are shared by every member.
+
+Usage (from causalsent/):
+    python train_multi_head.py --multi_head_grid lambda_reg=0,0.1,1 seed=1,2,3 --unfreeze_backbone top0 --running_ate --cache_embeddings
+Boolean flags take true/false grid values, e.g. doubly_robust=true,false.
+"""
+
+import os
+import sys
+import time
+TOP_DIR = os.path.abspath(os.path.join(os.getcwd(), '..'))
+if TOP_DIR not in sys.path:
+    sys.path.insert(0, TOP_DIR)
+import torch
+from torch.utils.data import DataLoader
+from causalsent.modules.causal_sent import CausalSent
+from causalsent.modules.multi_head import MultiHead
+from causalsent.optim.proximal_l1 import ProximalL1
+from causalsent.data.generators import SimilarityDataset
+from causalsent.data.prefetch import DevicePrefetcher
+from causalsent.data.samplers import ResumableSampler
+from causalsent.checkpoint_io import AsyncCheckpointWriter, checkpoint_contents
+from causalsent.train_causal_sent import load_splits, loader_options, inference_loader, cached_loaders, per_phrase_estimates
+from causalsent.utils import (get_default_sent_training_args, seed_everything, parse_grid, config_argv,
+                    EarlyStopper, initialize_database, save_arguments_to_db,
+                    save_metrics_to_db, save_model_weights_to_db, save_outputs_to_db, save_epoch_metrics_to_db,
+                    process_unfreeze_param, update_checkpoint, StreamingBinaryMetrics, mixed_precision)
+import wandb
+import warnings
+
+# arguments a --multi_head_grid entry may set per member
+MEMBER_ARGS = ['sentiment_head_type', 'riesz_head_type', 'lambda_bce', 'lambda_reg', 'lambda_riesz',
+            'lambda_l1', 'lr', 'doubly_robust', 'seed']
+
+
+def member_arguments(grid: list, argv: list) -> tuple:
+    """
+    Configurations of the grid and the full training arguments of each member (argv with the
+    configuration's values appended).
+    """
+    configs = parse_grid(grid)
+    unknown = sorted({name for config in configs for name in config} - set(MEMBER_ARGS))
+    if unknown:
+        raise ValueError(f"[ERROR] --multi_head_grid cannot vary {unknown}, the backbone pass is shared. Options: {MEMBER_ARGS}")
+    return configs, [get_default_sent_training_args("causal_sent", argv=[*argv, *config_argv(config)]) for config in configs]
+
+
+@torch.no_grad()
+def backbone_views(model, batch, args, device, counterfactuals: bool = True) -> tuple:
+    """
+    Frozen backbone outputs of a batch of token ids or cached embeddings, computed once for all
+    members: last hidden states [real, treated, control] (None for pooled cached embeddings) and
+    pooled embeddings. Without counterfactuals only the real view is encoded, the other entries are None.
+    """
+    with mixed_precision(device, args.autocast):
+        if 'embedding_real' in batch:
+            views = [batch['embedding_real'].to(device), None, None]
+            if counterfactuals:
+                views[1:] = [batch['embedding_treated'].to(device), batch['embedding_control'].to(device)]
+            if views[0].dim() == 2:
+                return None, views
+            hidden_states = views
+        elif counterfactuals:
+            hidden_states = model.encode_views(
+                batch['input_ids_real'].to(device), batch['input_ids_treated'].to(device), batch['input_ids_control'].to(device),
+                batch['attention_mask_real'].to(device), batch['attention_mask_treated'].to(device), batch['attention_mask_control'].to(device),
+                treated_is_real=batch['treated_is_real'].to(device) if args.dedup_views else None,
+                control_is_real=batch['control_is_real'].to(device) if args.dedup_views else None,
+            )
+        else:
+            hidden_states = [model.backbone_hidden_states(batch['input_ids_real'].to(device), batch['attention_mask_real'].to(device)), None, None]
+    return hidden_states, [model.pool_embedding(hidden_state) if hidden_state is not None else None for hidden_state in hidden_states]
+
+
+@torch.no_grad()
+def member_logits(model, heads: MultiHead, loader, args, device, members: list) -> tuple:
+    """
+    Eval-mode sentiment logits of several members on every example of a loader, one backbone pass per batch.
+    Returns CPU tensors (len(members), num_examples) of logits and (num_examples,) of targets, in the order of
+    the loader's dataset.
+    """
+    model.eval()
+    heads.eval()
+    order = torch.tensor([idx for batch_index in loader.batch_sampler for idx in batch_index], dtype=torch.long)
+    batch_logits, batch_targets = [], []
+    only_real = [frozenset(['sentiment_real'])] * len(heads)
+    for batch in loader:
+        hidden_states, embeddings = backbone_views(model, batch, args, device, counterfactuals=False)
+        with mixed_precision(device, args.autocast):
+            outputs = heads(hidden_states, embeddings, only_real, members=members)
+        batch_logits.append(torch.stack([outputs[member][0].float().squeeze(-1) for member in members]))
+        batch_targets.append(batch['targets'])
+    logits, targets = torch.empty(len(members), len(order)), torch.empty(len(order), dtype=torch.long)
+    if len(order) > 0:
+        logits[:, order] = torch.cat(batch_logits, dim=1).cpu()
+        targets[order] = torch.cat(batch_targets).long()
+    return logits, targets
+
+
+def swap_heads(model, heads: MultiHead, member: int) -> tuple:
+    """
+    Put a member's heads (the same modules) into the shared CausalSent, e.g. to save the member as its
+    own model. Returns the previous (sentiment, riesz) heads to swap back.
+    """
+    previous = (model.sentiment, model.riesz)
+    model.sentiment, model.riesz = heads.sentiment[member], heads.riesz[member]
+    return previous
+
+
+def train_multi_head(args, argv: list = None):
+    """
+    Dataset preparation and training loop for a bank of CausalSent head pairs sharing one frozen backbone.
+    argv (default: the command line) holds the arguments args was parsed from, the base of every member's arguments.
+    """
+    if not args.multi_head_grid:
+        raise ValueError("[ERROR] Pass the head configurations to train with --multi_head_grid, e.g. lambda_reg=0,0.1 seed=1,2.")
+    configs, members_args = member_arguments(args.multi_head_grid, sys.argv[1:] if argv is None else argv)
+    num_members = len(configs)
+    seed_everything(args.seed)
+
+    # ====== Check Args ========
+    # the backbone runs once, frozen and without gradients, for every member in the same loop
+    unsupported = {
+        '--interleave_training': args.interleave_training,
+        '--distributed': args.distributed,
+        '--lora_rank': args.lora_rank > 0,
+        '--cache_frozen_layers': args.cache_frozen_layers,
+        '--grad_accum_steps': args.grad_accum_steps > 1,
+        '--micro_batch_tokens': args.micro_batch_tokens > 0,
+        '--compile': args.compile,
+        '--resume': args.resume,
+        '--checkpoint_every_steps': args.checkpoint_every_steps > 0,
+        '--stop_after_epoch': args.stop_after_epoch > 0,
+        '--experiment_id': args.experiment_id is not None,
+    }
+    for flag, enabled in unsupported.items():
+        if enabled:
+            raise ValueError(f"[ERROR] {flag} is not supported in multi-head training. Train that configuration with train_causal_sent.py.")
+    if process_unfreeze_param(args.unfreeze_backbone) != 0:
+        raise ValueError("[ERROR] Multi-head training shares a frozen backbone. Pass --unfreeze_backbone top0.")
+    # every member's loss is a tensor to backpropagate, with non-negative weights
+    for member, (config, member_args) in enumerate(zip(configs, members_args)):
+        loss_weights = {'lambda_bce': member_args.lambda_bce, 'lambda_reg': member_args.lambda_reg, 'lambda_riesz': member_args.lambda_riesz}
+        if not all(weight >= 0 for weight in loss_weights.values()) or not any(weight > 0 for weight in loss_weights.values()):
+            raise ValueError(f"[ERROR] Head {member} {config} has loss weights {loss_weights}. "
+                            "Loss weights must be non-negative, with at least one of them > 0.")
+    if any(member_args.lambda_reg > 0 for member_args in members_args):
+        warnings.warn("Regularization loss is enabled but interleave_training is not supported here. Competing objectives will yield bad ATEs and bad model.")
+
+    treatment_phrases: list = args.treatment_phrases or [args.treatment_phrase]
+    if len(treatment_phrases) > 1 and args.cache_embeddings:
+        raise ValueError("Embedding caches hold a single treated and control view. "
+                        "Multiple --treatment_phrases require token inputs.")
+
+    project_name = args.project_name
+    print("\n" + "="*50)
+    print(f"Running multi-head CausalSent training of {num_members} head configurations:")
+    for member, config in enumerate(configs):
+        print(f"Head {member}: {config}")
+    print("="*50 + "\n")
+
+    # ====== Initialize Experiment Tracking DB (one experiment per member) ======
+    initialize_database()
+    experiment_ids = [save_arguments_to_db(args=member_args, project_name=project_name) for member_args in members_args]
+    wandb.init(project=project_name, config={**vars(args), 'experiment_ids': experiment_ids})
+
+    device = torch.device("cuda" if torch.cuda.is_available()
+                        else "mps" if torch.backends.mps.is_available()
+                        else "cpu")
+    print(f"Using device: {device}")
+    if str(device) == "mps" and args.autocast:
+        raise ValueError("Mixed precision training not supported with MPS. Disable autocast.")
+
+    # =========== Load Data ==============
+    ds_train, ds_val, ds_test = load_splits(args)
+    batch_size: int = args.batch_size
+    epochs: int = args.epochs
+    train_loader = DataLoader(ds_train, batch_size=batch_size, sampler=ResumableSampler(ds_train, seed=args.seed),
+                            generator=torch.Generator().manual_seed(args.seed),
+                            collate_fn=SimilarityDataset.collate_fn, **loader_options(args, device))
+    val_loader = DataLoader(ds_val, batch_size=batch_size, collate_fn=SimilarityDataset.collate_fn, **loader_options(args, device))
+    test_loader = DataLoader(ds_test, batch_size=batch_size, collate_fn=SimilarityDataset.collate_fn, **loader_options(args, device))
+
+    # ======== Shared Backbone and Member Heads ==========
+    # the backbone model's own heads are placeholders, a 'conv' one makes it keep (and cache) sequences when a member needs them
+    heads_config = [{'sentiment_head_type': member_args.sentiment_head_type, 'riesz_head_type': member_args.riesz_head_type,
+                    'seed': member_args.seed} for member_args in members_args]
+    needs_sequences = any('conv' in (config['sentiment_head_type'], config['riesz_head_type']) for config in heads_config)
+    model = CausalSent(pretrained_model_name=args.pretrained_model_name,
+                    sentiment_head_type='conv' if needs_sequences else 'linear',
+                    riesz_head_type='linear',
+                    fuse_views=args.fuse_views,
+                    pack_sequences=args.pack_sequences,
+                    num_treatment_phrases=len(treatment_phrases)).to(device)
+    model.eval()  # frozen backbone, no dropout
+    heads = MultiHead(model.backbone_hidden_size, heads_config, num_treatment_phrases=len(treatment_phrases)).to(device)
+
+    if args.cache_embeddings:
+        (train_loader, val_loader, test_loader), _ = cached_loaders(model, [ds_train, ds_val, ds_test], args, device, batch_size)
+
+    # per member optimizer (decoupled L1), early stopper, and best checkpoint
+    optimizers = [torch.optim.AdamW(heads.member_parameters(member), lr=member_args.lr)
+                for member, member_args in enumerate(members_args)]
+    proximal_l1s = [ProximalL1(optimizer, member_args.lambda_l1) for optimizer, member_args in zip(optimizers, members_args)]
+    early_stoppers = [EarlyStopper(patience=member_args.early_stop_patience, delta=member_args.early_stop_delta)
+                    for member_args in members_args]
+    bce_loss = torch.nn.BCEWithLogitsLoss()
+    checkpoint_writer = AsyncCheckpointWriter()
+    best_model_paths = [os.path.join("out", f"experiment_{experiment_id}", f"best_model.{args.checkpoint_format}")
+                        for experiment_id in experiment_ids]
+    best_heads: list = [None] * num_members  # host copies of each member's best head weights
+
+    # active training terms and the head outputs they read, per member
+    member_terms = [{term for term, weight in [('bce', member_args.lambda_bce), ('reg', member_args.lambda_reg),
+                                            ('riesz', member_args.lambda_riesz)] if weight > 0}
+                    | {'dr_ate' if member_args.doubly_robust else 'ate'} for member_args in members_args]
+    member_outputs = [model.required_outputs(terms) for terms in member_terms]
+
+    epoch_ates: list = [None] * num_members
+    ate_dtype = torch.float32 if device.type == 'mps' else torch.float64  # MPS has no float64
+    active: list = list(range(num_members))  # members not stopped early
+
+    # ================ Training Loop =================
+    for epoch in range(epochs):
+        heads.train()
+        total_losses = torch.zeros(num_members, device=device)
+        train_metrics = [StreamingBinaryMetrics(device, num_bins=args.metric_bins) for _ in range(num_members)]
+        # running ATE numerators per member and treatment phrase, every active member sees the same rows
+        running_ate_numer = torch.zeros(num_members, len(treatment_phrases), dtype=ate_dtype, device=device)
+        running_ate_denom: int = 0
+        counterfactuals: bool = any(model._needs_counterfactuals(member_outputs[member]) for member in active)
+
+        epoch_start = time.perf_counter()
+        train_loader.sampler.set_epoch(epoch)
+        train_batches = DevicePrefetcher(train_loader, device, depth=args.prefetch_batches)
+        for i, batch in enumerate(train_batches):
+            targets = batch['targets'].float().to(device)
+            hidden_states, embeddings = backbone_views(model, batch, args, device, counterfactuals=counterfactuals)
+            with mixed_precision(device, args.autocast):
+                head_outputs = heads(hidden_states, embeddings, member_outputs, members=active)
+            running_ate_denom += targets.size(0)
+
+            loss_sum = 0
+            tau_hats, losses = {}, {}
+            for member in active:
+                member_args = members_args[member]
+                (sentiment_outputs_real, sentiment_outputs_treated, sentiment_outputs_control,
+                riesz_outputs_real, riesz_outputs_treated, riesz_outputs_control) = (
+                    output.float() if output is not None else None for output in head_outputs[member])
+                treat_out = torch.sigmoid(sentiment_outputs_treated) if sentiment_outputs_treated is not None else None
+                control_out = torch.sigmoid(sentiment_outputs_control) if sentiment_outputs_control is not None else None
+                real_out = torch.sigmoid(sentiment_outputs_real)
+
+                # (doubly robust) Riesz ATE per treatment phrase, as in train_causal_sent.py
+                if member_args.doubly_robust:
+                    batch_numer = torch.sum((treat_out - control_out) + riesz_outputs_real * (targets.unsqueeze(-1) - real_out), dim=0)
+                else:
+                    batch_numer = torch.sum(riesz_outputs_real * real_out, dim=0)
+                if args.running_ate:
+                    running_ate_numer[member] += batch_numer.detach().to(ate_dtype)
+                    tau_hat = (running_ate_numer[member] / running_ate_denom).float()
+                else:
+                    tau_hat = batch_numer / targets.size(0)
+
+                riesz_loss = 0
+                reg_loss = 0
+                bce = 0
+                if member_args.lambda_riesz > 0:
+                    riesz_loss = torch.mean(-2 * (riesz_outputs_treated - riesz_outputs_control) + (riesz_outputs_real ** 2))
+                if member_args.lambda_reg > 0:
+                    reg_loss = torch.mean(((treat_out - control_out) - tau_hat) ** 2)
+                if member_args.lambda_bce > 0:
+                    bce = bce_loss(sentiment_outputs_real.squeeze(-1), targets)
+                loss = member_args.lambda_bce * bce + member_args.lambda_reg * reg_loss + member_args.lambda_riesz * riesz_loss
+
+                # members share no parameters, so the gradient of the sum is each member's own gradient
+                loss_sum = loss_sum + loss
+                total_losses[member] += loss.detach()
+                train_metrics[member].update(real_out.squeeze(-1), targets)
+                tau_hats[member], losses[member] = tau_hat, loss
+
+            for member in active:
+                optimizers[member].zero_grad()
+            loss_sum.backward()
+            for member in active:
+                optimizers[member].step()
+                proximal_l1s[member].step()  # soft-threshold the member's heads toward zero by lr * lambda_l1
+
+            # =======   Logging   ========
+            if (i + 1) % args.log_every == 0:
+                log = {"Batch": i + 1}
+                for member in active:
+                    member_train_metrics = train_metrics[member].compute()
+                    log.update({f"Head {member}/Train Loss": losses[member].item(),
+                                f"Head {member}/Train Accuracy": member_train_metrics['accuracy'],
+                                f"Head {member}/Train F1": member_train_metrics['f1'],
+                                **{f"Head {member}/{name}": value for name, value
+                                in per_phrase_estimates("Tau_Hat", tau_hats[member].detach(), treatment_phrases).items()}})
+                    print(f"Epoch {epoch + 1}/{epochs}, Batch {i + 1}/{len(train_loader)}, Head {member}, "
+                        f"Loss: {losses[member].item():.4f}, Accuracy: {member_train_metrics['accuracy']:.4f}")
+                wandb.log(log)
+
+        # ====** end of epoch stuff **====
+        epoch_train_time = time.perf_counter() - epoch_start
+        print(f"Epoch {epoch + 1}/{epochs}: trained {len(active)} head configuration(s) off one backbone pass per batch "
+            f"in {epoch_train_time:.2f}s")
+        wandb.log({"Train Epoch Time (s)": epoch_train_time, "Active Heads": len(active), "Epoch": epoch + 1})
+
+        # ======= Validation Metrics (Log Every Epoch) =======
+        val_logits, val_targets = member_logits(model, heads, val_loader, args, device, active)
+        stopped = []
+        for row, member in enumerate(active):
+            if args.running_ate:
+                epoch_ates[member] = (running_ate_numer[member] / running_ate_denom).float()
+            val_metrics = StreamingBinaryMetrics(torch.device('cpu'), num_bins=args.metric_bins)
+            val_metrics.update(torch.sigmoid(val_logits[row]), val_targets)
+            epoch_val_metrics = val_metrics.compute()
+            val_acc, val_f1 = epoch_val_metrics['accuracy'], epoch_val_metrics['f1']
+            epoch_train_loss = (total_losses[member] / max(len(train_loader), 1)).item()
+            wandb.log({f"Head {member}/Val Accuracy": val_acc, f"Head {member}/Val F1": val_f1,
+                    f"Head {member}/Val AUC": epoch_val_metrics.get('auc'), f"Head {member}/Train Epoch Loss": epoch_train_loss,
+                    **{f"Head {member}/{name}": value for name, value
+                        in per_phrase_estimates("Epoch_ATE", epoch_ates[member], treatment_phrases).items()},
+                    "Epoch": epoch + 1})
+            print(f"Epoch {epoch + 1}/{epochs} Head {member} {configs[member]} Validation Accuracy: {val_acc:.4f}, F1: {val_f1:.4f}")
+            save_epoch_metrics_to_db(experiment_id=experiment_ids[member], epoch=epoch + 1, project_name=project_name,
+                                    metrics={'train_loss': epoch_train_loss, 'val_acc': val_acc, 'val_f1': val_f1,
+                                            'epoch_ate': epoch_ates[member].tolist() if epoch_ates[member] is not None else None})
+
+            # ==== Early Stopping and Checkpointing (per member) ====
+            if early_stoppers[member].highest_val_acc(val_acc):
+                best_heads[member] = {name: tensor.detach().to('cpu', copy=True)
+                                    for name, tensor in [*heads.sentiment[member].state_dict(prefix='sentiment.').items(),
+                                                        *heads.riesz[member].state_dict(prefix='riesz.').items()]}
+                previous = swap_heads(model, heads, member)
+                checkpoint_writer.save(*checkpoint_contents(model, optimizers[member], members_args[member],
+                                                            trainable_only=args.checkpoint_trainable_only),
+                                    best_model_paths[member])
+                model.sentiment, model.riesz = previous
+                save_model_weights_to_db(experiment_id=experiment_ids[member], weight_path=best_model_paths[member], project_name=project_name)
+            if early_stoppers[member].early_stop(val_acc):
+                print(f"Head {member} stopped early after epoch {epoch + 1}")
+                stopped.append(member)
+        active = [member for member in active if member not in stopped]
+        if not active:
+            break
+        # ==== end epoch ====
+
+    checkpoint_writer.wait()  # best checkpoints are on disk
+
+    # ==== Score train, val, and test with every member's best heads in one sweep ====
+    # members without a best epoch (--epochs 0, or no finite validation accuracy) have no checkpoint to score
+    members = [member for member in range(num_members) if best_heads[member] is not None]
+    for member in sorted(set(range(num_members)) - set(members)):
+        warnings.warn(f"[WARNING] Head {member} {configs[member]} has no best epoch and no checkpoint. It is not scored.")
+    if not members:
+        return
+    for member in members:
+        heads.sentiment[member].load_state_dict({name[len('sentiment.'):]: tensor for name, tensor in best_heads[member].items()
+                                                if name.startswith('sentiment.')})
+        heads.riesz[member].load_state_dict({name[len('riesz.'):]: tensor for name, tensor in best_heads[member].items()
+                                            if name.startswith('riesz.')})
+    if args.cache_embeddings:
+        eval_loaders = {split: DataLoader(loader.dataset, batch_size=args.eval_batch_size, collate_fn=loader.collate_fn)
+                        for split, loader in [('val', val_loader), ('train', train_loader), ('test', test_loader)]}
+    else:
+        eval_loaders = {split: inference_loader(ds, args.eval_batch_size, args, device, dynamic_padding=not needs_sequences)
+                        for split, ds in [('val', ds_val), ('train', ds_train), ('test', ds_test)]}
+    split_logits = {split: member_logits(model, heads, loader, args, device, members) for split, loader in eval_loaders.items()}
+
+    # per member: temperature fit on its validation logits (written into its checkpoint), calibrated predictions and metrics
+    final_val_accs = {}
+    for row, member in enumerate(members):
+        temperature = model.fit_temperature(split_logits['val'][0][row], split_logits['val'][1])
+        update_checkpoint(best_model_paths[member], temperature=temperature, temperature_fitted=True)
+        final_metrics, final_aucs = {}, {}
+        for split in ['train', 'val', 'test']:
+            logits, targets = split_logits[split]
+            probabilities = torch.sigmoid(logits[row] / temperature)
+            metrics = StreamingBinaryMetrics(torch.device('cpu'), num_bins=args.metric_bins)
+            metrics.update(probabilities, targets)
+            split_metrics = metrics.compute()
+            predictions = (probabilities > metrics.threshold).long()
+            save_outputs_to_db(experiment_id=experiment_ids[member], split=split, targets=targets.tolist(),
+                            predictions=predictions.tolist(), project_name=project_name)
+            final_metrics[f"{split}_acc"] = split_metrics['accuracy']
+            final_metrics[f"{split}_f1"] = split_metrics['f1']
+            if 'auc' in split_metrics:
+                final_aucs[f"{split}_auc"] = split_metrics['auc']
+        save_metrics_to_db(experiment_id=experiment_ids[member], metrics=final_metrics, project_name=project_name)
+        wandb.log({f"Head {member}/{k}_final": v for k, v in {**final_metrics, **final_aucs}.items()})
+        final_val_accs[member] = final_metrics['val_acc']
+
+    print("\n===== Head configurations by final validation accuracy =====")
+    for member in sorted(members, key=lambda member: final_val_accs[member], reverse=True):
+        print(f"Experiment {experiment_ids[member]} (head {member}): val acc {final_val_accs[member]:.4f} {configs[member]}")
+    return
+
+
+if __name__ == "__main__":
+    args = get_default_sent_training_args("causal_sent")
+    train_multi_head(args)
+    print("Training complete :)")
@@ -4,7 +4,15 @@ import numpy as np
 import torch
 import sqlite3
 import os
+import sys
 import json
+import contextlib
+import itertools
+import collections
+import torch.distributed as dist
+from torch.overrides import TorchFunctionMode
+from torch.utils.data import Subset
+from causalsent.checkpoint_io import read_checkpoint, update_checkpoint_metadata
 
 def save_model(model, optimizer, args, filepath):
     """
@@ -21,12 +29,16 @@ def save_model(model, optimizer, args, filepath):
         The path to save the model checkpoint.
     """
     save_info = {
-        'model_state_dict': model.state_dict(),
+        'model_state_dict': model.trainable_state_dict() if hasattr(model, 'trainable_state_dict') else model.state_dict(),  # adapters + heads only with LoRA
         'model_class': model.__class__,
         'pretrained_model_name': args.pretrained_model_name,  # Save the pretrained model name
         'sentiment_head_type': args.sentiment_head_type,      # Save the sentiment head type
         'riesz_head_type': args.riesz_head_type,              # Save the riesz head type
         'model_config': getattr(model, 'config', None),       # Save model config if available
+        'temperature': getattr(model, 'temperature', 1.0),    # Save sentiment calibration temperature
+        'temperature_fitted': getattr(model, 'temperature_fitted', False),  # False: temperature is the 1.0 default
+        'lora_config': getattr(model, 'lora_config', None),   # Save LoRA rank/alpha/dropout if adapters are used
+        'num_treatment_phrases': getattr(model, 'num_treatment_phrases', 1),  # Size of the Riesz head bank
         'optimizer_state_dict': optimizer.state_dict(),
         'args': args,
         'system_rng': random.getstate(),
@@ -38,13 +50,19 @@ def save_model(model, optimizer, args, filepath):
     torch.save(save_info, filepath)
     print(f"Model saved to {filepath}")
 
-def load_model_inference(filepath):
+def load_model_inference(filepath, quantize=False, quantize_heads=False, merge_lora=True):
     """
     Load a model and its components for inference from a saved file.
 
     Parameters:
     - filepath: str
         The path to the saved model file.
+    - quantize: bool, default=False
+        Convert the backbone's Linear layers to dynamic int8 for CPU inference (moves the model to the CPU).
+    - quantize_heads: bool, default=False
+        With quantize, also convert the heads' Linear layers.
+    - merge_lora: bool, default=True
+        For adapter checkpoints, fold the LoRA adapters into the backbone weights after loading.
 
     Returns:
     - model: torch.nn.Module
@@ -52,31 +70,270 @@ def load_model_inference(filepath):
     - args: argparse.Namespace
         Arguments saved with the model.
     """
-    checkpoint = torch.load(filepath, weights_only=False)
+    if filepath.endswith('.safetensors'):
+        checkpoint = read_checkpoint(filepath)  # CheckpointWriter output, same layout
+    else:
+        checkpoint = torch.load(filepath, weights_only=False, map_location='cpu')  # model is rebuilt on the CPU, move it after loading
 
     # Dynamically reconstruct the model
     model_class = checkpoint['model_class']
     pretrained_model_name = checkpoint.get('pretrained_model_name', None)
     sentiment_head_type = checkpoint.get('sentiment_head_type', 'fcn')
     riesz_head_type = checkpoint.get('riesz_head_type', 'fcn')
+    lora_config = checkpoint.get('lora_config', None)
 
     if pretrained_model_name is None:
         raise ValueError("The checkpoint does not contain a 'pretrained_model_name' required to initialize the model.")
 
     # Reconstruct the model with all necessary architecture arguments
+    lora_kwargs = {}
+    if lora_config is not None:  # adapter checkpoint: backbone weights come from pretrained_model_name
+        lora_kwargs = {'lora_rank': lora_config['rank'], 'lora_alpha': lora_config['alpha'], 'lora_dropout': lora_config['dropout']}
+    saved_args = checkpoint['args']
     model = model_class(pretrained_model_name, sentiment_head_type=sentiment_head_type,
-                        riesz_head_type=riesz_head_type)
-    model.load_state_dict(checkpoint['model_state_dict'])  # load best params
+                        riesz_head_type=riesz_head_type, 
+                        num_treatment_phrases=checkpoint.get('num_treatment_phrases', 1),
+                        fuse_views=getattr(saved_args, 'fuse_views', False),
+                        pack_sequences=getattr(saved_args, 'pack_sequences', False),  # 'conv' heads were trained on zero pad states
+                        checkpoint_every=getattr(saved_args, 'checkpoint_every', 0), **lora_kwargs)
+    if lora_config is not None or checkpoint.get('trainable_only', False):
+        # load best adapter / trainable + head params, the rest of the backbone is pretrained
+        model.load_trainable_state_dict(checkpoint['model_state_dict'], trainable_only=checkpoint.get('trainable_only', False))
+        if merge_lora and lora_config is not None:
+            model.merge_lora()
+    else:
+        model.load_state_dict(checkpoint['model_state_dict'])  # load best params
+    
+    # Inference settings used by model.predict_proba
+    model.temperature = checkpoint.get('temperature', 1.0)
+    # checkpoints from before the flag only carry a temperature other than 1.0 if it was fit
+    model.temperature_fitted = checkpoint.get('temperature_fitted', model.temperature != 1.0)
+    model.max_seq_length = getattr(saved_args, 'max_seq_length', None)
+    if quantize:
+        model.quantize_dynamic(quantize_heads=quantize_heads)
 
     print(f"Model loaded from {filepath}")
     return model, checkpoint['args']
 
-def get_default_sent_training_args(regime: str):
+def update_checkpoint(filepath, **fields):
+    """
+    Overwrite or add top-level fields of a checkpoint saved with save_model or an 
+    AsyncCheckpointWriter, e.g. update_checkpoint(path, temperature=1.3).
+    """
+    if filepath.endswith('.safetensors'):
+        update_checkpoint_metadata(filepath, **fields)
+        print(f"Updated {', '.join(fields.keys())} in {filepath}")
+        return
+    checkpoint = torch.load(filepath, weights_only=False)
+    checkpoint.update(fields)
+    torch.save(checkpoint, filepath)
+    print(f"Updated {', '.join(fields.keys())} in {filepath}")
+
+def reset_peak_memory(device: torch.device):
+    """Reset the peak memory counter reported by peak_memory_mb (CUDA only; CPU peak RSS cannot be reset)."""
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+def peak_memory_mb(device: torch.device) -> float:
+    """
+    Peak memory in MB: allocated tensor memory on CUDA (since reset_peak_memory), driver 
+    allocated memory on MPS, peak resident set size of the process on CPU.
+    """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    if device.type == 'mps':
+        return torch.mps.driver_allocated_memory() / 2**20
+    import resource
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10  # bytes on macOS, KB on Linux
+
+def mixed_precision(device: torch.device, enabled: bool = True):
+    """
+    bfloat16 autocast of the backbone and heads on CUDA or CPU (native on AVX-512 BF16 / AMX). 
+    Parameters stay fp32 master weights, and bf16 keeps the fp32 exponent range so no loss 
+    scaling (GradScaler) is needed. A disabled context is a no-op.
+    """
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=enabled)
+
+class SyncCounter(TorchFunctionMode):
+    """
+    Count host synchronization points: calls that read tensor data back to the host (item, tolist, 
+    cpu, bool/float/int conversion, formatting, nonzero, boolean mask indexing) and block until 
+    queued accelerator work finishes. Counting is device-agnostic, so a CPU run reports the syncs 
+    the same code would hit on CUDA or MPS.
+
+    Use as a context manager around the code to count. Each sync is attributed to the current 
+    region (see region, e.g. 'forward' or 'optimizer') and to the causalsent function that issued 
+    it, so data-dependent syncs (packing, deduplication) show up next to avoidable ones. pause() 
+    excludes a region (e.g. an occasional checkpoint write). A disabled counter is a no-op.
+    """
+    SYNC_FUNCTIONS = {
+        torch.Tensor.item, torch.Tensor.tolist, torch.Tensor.cpu, torch.Tensor.__bool__, 
+        torch.Tensor.__float__, torch.Tensor.__int__, torch.Tensor.__format__, 
+        torch.Tensor.nonzero, torch.nonzero,
+    }
+    PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+    def __init__(self, enabled: bool = True):
+        super().__init__()
+        self.enabled = enabled
+        self.count = 0
+        self.sources = collections.Counter()  # (region, 'op in caller') -> count
+        self._region = 'step'
+        self._paused = False
+
+    def __enter__(self):
+        return super().__enter__() if self.enabled else self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.enabled:
+            return super().__exit__(exc_type, exc_value, traceback)
+
+    def __torch_function__(self, func, types, args=(), kwargs=None):
+        if not self._paused and (func in self.SYNC_FUNCTIONS or 
+                                (func is torch.Tensor.__getitem__ and self._is_mask_index(args[1]))):
+            self.count += 1
+            op = 'mask index' if func is torch.Tensor.__getitem__ else func.__name__
+            self.sources[(self._region, f"{op} in {self._caller()}")] += 1
+        return func(*args, **(kwargs or {}))
+
+    @staticmethod
+    def _is_mask_index(index) -> bool:
+        indices = index if isinstance(index, tuple) else (index,)
+        return any(isinstance(item, torch.Tensor) and item.dtype == torch.bool for item in indices)
+
+    def _caller(self) -> str:
+        # innermost causalsent function that (directly or through torch) issued the sync
+        frame = sys._getframe(2)
+        while frame is not None:
+            if os.path.abspath(frame.f_code.co_filename).startswith(self.PACKAGE_DIR):
+                return frame.f_code.co_name
+            frame = frame.f_back
+        return '?'
+
+    @contextlib.contextmanager
+    def region(self, name: str):
+        previous, self._region = self._region, name
+        try:
+            yield
+        finally:
+            self._region = previous
+
+    @contextlib.contextmanager
+    def pause(self):
+        self._paused = True
+        try:
+            yield
+        finally:
+            self._paused = False
+
+    def report(self, steps: int) -> str:
+        """Syncs per step by region and source, most frequent first."""
+        return "\n".join(f"  {count / max(steps, 1):6.2f}/step  {region:<10} {source}" 
+                        for (region, source), count in self.sources.most_common())
+
+class StreamingBinaryMetrics:
+    """
+    Incremental binary classification metrics. Each update adds the batch's confusion counts 
+    (and optionally a per-class histogram of predicted probabilities for AUC) to tensors kept on 
+    the device, without a host sync; compute() reads them back once at O(num_bins) cost, 
+    independent of how many examples were seen.
+    """
+    def __init__(self, 
+                device: torch.device, 
+                threshold: float = 0.5, 
+                num_bins: int = 0):
+        """
+        Parameters:
+        - device: torch.device
+            Device of the probabilities and targets passed to update.
+        - threshold: float, default=0.5
+            Probabilities above the threshold are predicted positive.
+        - num_bins: int, default=0
+            Number of equal-width probability bins for the threshold-sweep (ROC) histograms. 
+            AUC is computed with bin resolution; 0 disables AUC.
+        """
+        self.threshold = threshold
+        self.num_bins = num_bins
+        self.confusion = torch.zeros(4, dtype=torch.long, device=device)  # [tn, fp, fn, tp]
+        self.histogram = torch.zeros(2 * num_bins, dtype=torch.long, device=device) if num_bins > 0 else None  # [negatives | positives]
+
+    def update(self, probs: torch.Tensor, targets: torch.Tensor):
+        """Add a batch of predicted positive-class probabilities and binary targets, both of shape (batch_size,)."""
+        probs = probs.detach()
+        targets = targets.long()
+        confusion_index = 2 * targets + (probs > self.threshold).long()
+        self.confusion.index_add_(0, confusion_index, torch.ones_like(confusion_index))
+        if self.histogram is not None:
+            bins = (probs * self.num_bins).long().clamp_(0, self.num_bins - 1)
+            histogram_index = targets * self.num_bins + bins
+            self.histogram.index_add_(0, histogram_index, torch.ones_like(histogram_index))
+
+    def compute(self) -> dict:
+        """
+        Accuracy, positive-class F1, and (with num_bins > 0) ROC AUC over everything seen so far. 
+        Examples in the same probability bin count as ties in the AUC.
+        """
+        tn, fp, fn, tp = self.confusion.tolist()
+        metrics = {
+            'accuracy': (tp + tn) / max(tn + fp + fn + tp, 1),
+            'f1': 2 * tp / (2 * tp + fp + fn) if tp > 0 else 0.0,
+        }
+        if self.histogram is not None:
+            negatives, positives = np.array(self.histogram.tolist()).reshape(2, self.num_bins)
+            num_negatives, num_positives = negatives.sum(), positives.sum()
+            if num_negatives == 0 or num_positives == 0:
+                metrics['auc'] = float('nan')  # undefined with a single class
+            else:
+                # P(score_pos > score_neg) + 0.5 * P(tie): negatives in lower bins, half of the same bin
+                negatives_below = np.cumsum(negatives) - negatives
+                metrics['auc'] = float(np.sum(positives * (negatives_below + 0.5 * negatives)) / (num_positives * num_negatives))
+        return metrics
+
+    def all_reduce(self):
+        """Sum the counts over all ranks of the default process group (in place). Returns self."""
+        dist.all_reduce(self.confusion)
+        if self.histogram is not None:
+            dist.all_reduce(self.histogram)
+        return self
+
+def is_main_process() -> bool:
+    """True on rank 0 of a torch.distributed run, and always outside of one."""
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def rank_shard(dataset):
+    """
+    This rank's strided, non-overlapping share of a dataset, without the padding DistributedSampler 
+    adds (for evaluation, where every example must count once). The dataset itself outside a 
+    distributed run.
+    """
+    if not dist.is_initialized():
+        return dataset
+    return Subset(dataset, range(dist.get_rank(), len(dataset), dist.get_world_size()))
+
+def all_gather_list(values: list) -> list:
+    """Concatenate a per-rank list of picklable values over all ranks, on every rank."""
+    if not dist.is_initialized():
+        return values
+    gathered = [None] * dist.get_world_size()
+    dist.all_gather_object(gathered, values)
+    return [value for rank_values in gathered for value in rank_values]
+
+def gather_list_to_main(values: list) -> list:
+    """Concatenate a per-rank list of picklable values over all ranks on rank 0 (None on other ranks)."""
+    if not dist.is_initialized():
+        return values
+    gathered = [None] * dist.get_world_size() if dist.get_rank() == 0 else None
+    dist.gather_object(values, gathered, dst=0)
+    return [value for rank_values in gathered for value in rank_values] if gathered is not None else None
+
+def get_default_sent_training_args(regime: str, argv: list = None):
     """ 
     Parse command line arguments for sentiment training.
     
     Params:
         regime: str. Options: 'causal_sent', 'intervention_sent'  # TODO: implement intervention_sent 
+        argv: list. Arguments to parse instead of the command line (e.g. a sweep configuration).
     """
     
     parser = argparse.ArgumentParser()
@@ -96,13 +353,39 @@ def get_default_sent_training_args(regime: str):
         parser.add_argument("--riesz_head_type", type=str, default="fcn", help="Type of Riesz head to use. Options: 'fcn', 'linear', 'conv'")
         parser.add_argument("--seed", type=int, default=11711)
         parser.add_argument("--use_gpu", action='store_true', default = True)
-        parser.add_argument("--autocast", action='store_true', default = False)  # mixed precision training, only good on cuda
+        parser.add_argument("--autocast", action='store_true', default = False, help="bfloat16 mixed precision for the backbone and heads (CUDA, or CPU with AVX-512 BF16 / AMX). Weights and losses stay fp32.")
         parser.add_argument("--num_workers", type=int, default=14)   # tune for your machine 
+        parser.add_argument("--prefetch_batches", type=int, default=2, help="Training batches assembled and moved to the device ahead of the step in a background thread. 0 loads each batch synchronously.")
         parser.add_argument('--batch_size', type=int, default=16, help='Batch size for training')   # tune for your machine
+        parser.add_argument("--eval_batch_size", type=int, default=128, help="Batch size for scoring the splits with the best model at the end of training (inference only, length-sorted and dynamically padded).")
         parser.add_argument('--lr', type=float, default=1e-5, help='Learning rate')
         parser.add_argument('--epochs', type=int, default=20, help='Number of training epochs')
+        parser.add_argument("--grad_accum_steps", type=int, default=1, help="Accumulate gradients over this many batches per optimizer step (effective batch size = batch_size * grad_accum_steps).")
+        parser.add_argument("--micro_batch_tokens", type=int, default=0, help="Split each batch into micro-batches of at most this many padded tokens across the backbone views (memory budget). Values <=0 do not split.")
+        parser.add_argument("--checkpoint_trainable_only", action='store_true', default=False, help="Store only the heads and trainable backbone weights in checkpoints (the frozen backbone is reloaded from --pretrained_model_name).")
+        parser.add_argument("--checkpoint_format", type=str, default="pt", choices=["pt", "safetensors"], help="Format of the best checkpoint out/experiment_{id}/best_model.{format}, written in the background: 'pt' (torch.save, the save_model layout) or 'safetensors' (tensors plus JSON metadata). Resumable checkpoints are always last.safetensors.")
+        parser.add_argument("--checkpoint_every_steps", type=int, default=0, help="Also write the resumable out/experiment_{id}/last.safetensors checkpoint every this many optimizer steps (it is always written at the end of an epoch). 0 writes it at epoch ends only.")
+        parser.add_argument("--resume", type=str, default=None, help="Continue an interrupted run from its last.safetensors checkpoint, mid-epoch, with the run's saved arguments (other arguments except --stop_after_epoch are ignored).")
+        parser.add_argument("--stop_after_epoch", type=int, default=0, help="Pause once this many epochs are trained: write last.safetensors and exit without the final evaluation, to be continued with --resume (sweeps). 0 trains all --epochs.")
+        parser.add_argument("--experiment_id", type=int, default=None, help="Record into this existing row of the experiments DB (created by a sweep) instead of adding one.")
+        parser.add_argument("--multi_head_grid", nargs='+', default=None, help="train_multi_head.py: head configurations trained together off one frozen backbone forward, name=value1,value2,... entries (cartesian product) over sentiment_head_type, riesz_head_type, lambda_bce, lambda_reg, lambda_riesz, doubly_robust, and seed.")
+        parser.add_argument("--distributed", action='store_true', default=False, help="CPU data parallel training over the gloo backend, one process per rank. Launch with torchrun, e.g. torchrun --nproc_per_node 8 train_causal_sent.py --distributed. --batch_size is per rank.")
+        # performance
+        parser.add_argument("--fuse_views", action='store_true', default=False, help="Run the backbone once per step over the stacked real, treated, and control views instead of three separate passes.")
+        parser.add_argument("--dedup_views", action='store_true', default=False, help="Encode treated/control views identical to the real text only once per step (one backbone pass over the unique rows).")
+        parser.add_argument("--cache_embeddings", action='store_true', default=False, help="With a frozen backbone (--unfreeze_backbone top0), encode each split once into a float16 memory-mapped store and train the heads from it.")
+        parser.add_argument("--cache_frozen_layers", action='store_true', default=False, help="With --unfreeze_backbone top{n} or iterative (DistilBERT only), cache hidden states out of the last frozen backbone layer and only run the trainable top layers. Rebuilt whenever more layers unfreeze. The cached states are computed in eval mode, so the embeddings and frozen layers apply no dropout (unlike uncached training).")
+        parser.add_argument("--embedding_cache_dir", type=str, default=os.path.join("out", "embedding_cache"), help="Directory for cached backbone embeddings.")
+        parser.add_argument("--pack_sequences", action='store_true', default=False, help="Run the DistilBERT backbone on packed real tokens only (no compute on padding). Reports tokens/sec and padding skipped per epoch.")
+        parser.add_argument("--checkpoint_every", type=int, default=0, help="Activation checkpointing of every k-th backbone layer (1 = every layer, 0 = off). Trades recompute for activation memory. Peak memory and step time are logged per epoch with it on or off, for comparison.")
+        parser.add_argument("--lora_rank", type=int, default=0, help="Train low-rank adapters of this rank in the backbone's attention and MLP projections plus the heads (0 = off). Requires --unfreeze_backbone top0. Checkpoints hold only adapter and head weights.")
+        parser.add_argument("--lora_alpha", type=float, default=16.0, help="LoRA updates are scaled by lora_alpha / lora_rank.")
+        parser.add_argument("--lora_dropout", type=float, default=0.0, help="Dropout on the LoRA adapter inputs.")
+        parser.add_argument("--compile", action='store_true', default=False, help="torch.compile the training and eval forward passes (dynamic shapes). Cached-embedding/layer paths stay eager.")
+        parser.add_argument("--metric_bins", type=int, default=200, help="Probability histogram bins for streaming ROC AUC in the train/val/test metrics (0 = no AUC).")
+        parser.add_argument("--count_syncs", action='store_true', default=False, help="Count host synchronization points per training step (forward, loss, backward, optimizer step, metrics and logging) and report them by source every epoch. benchmark_causal_sent.py --benchmark syncs compares them with the pre-device-accumulator loop.")
         # logging 
-        parser.add_argument("--log_every", type=int, default=5, help='Log training progress every n batches') # TODO: Revert to >200 for faster training on big dataset
+        parser.add_argument("--log_every", type=int, default=5, help='Log training progress every n optimizer steps') # TODO: Revert to >200 for faster training on big dataset
         # limit data for testing 
         parser.add_argument("--limit_data", type=int, default=0, help='Number of rows to include from the dataset. Values <=0 do no subsetting.') #TODO: revert to full data
         parser.add_argument("--train_regime", type=str, default=regime, choices=['base', 'itvreg'])
@@ -124,6 +407,7 @@ def get_default_sent_training_args(regime: str):
             # to match riesz estimated word-level causal effects.
             # phrases may work, but not currently tested
             parser.add_argument("--treatment_phrase", type = str, default = "love", help = "The treatment word for the causal regularization regime.")
+            parser.add_argument("--treatment_phrases", type = str, nargs='+', default = None, help = "Estimate per-phrase ATEs for several treatment phrases in one run with a bank of Riesz representers sharing one backbone pass. Overrides --treatment_phrase for the counterfactual views.")
             parser.add_argument("--adjust_ate", action='store_true', default = False, help = "Determines whether the ATE is adjusted.")
             parser.add_argument("--synthetic_ate", type=float, default = 0.75, help = "If the ATE is to be adjusted, determines how much the difference will be.")
             parser.add_argument("--synthetic_ate_treat_fraction", type=float, default = 0.5, help = "If the ATE is to be adjusted, determines how big of a treated population should be created.")
@@ -147,9 +431,33 @@ def get_default_sent_training_args(regime: str):
         raise ValueError(f"regime {regime} not recognized. Select one of 'causal_sent', 'intervention_sent'")
     
     # ignore unknown args such as when invoking from a notebook 
-    args, unknown = parser.parse_known_args()
+    args, unknown = parser.parse_known_args(argv)
     return args
 
+def parse_grid(grid: list) -> list:
+    """
+    Configurations (dicts of argument name to string value) of the cartesian product of
+    'name=value1,value2,...' grid entries.
+    """
+    names, values = [], []
+    for entry in grid:
+        name, _, options = entry.partition('=')
+        if not options:
+            raise ValueError(f"[ERROR] Grid entry {entry} must look like name=value1,value2")
+        names.append(name.lstrip('-'))
+        values.append(options.split(','))
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def config_argv(config: dict) -> list:
+    """Command line arguments of a configuration, 'true'/'false' values toggle store_true flags."""
+    argv = []
+    for name, value in config.items():
+        if value.lower() == 'true':
+            argv.append(f"--{name}")
+        elif value.lower() != 'false':
+            argv.extend([f"--{name}", value])
+    return argv
+
 def get_default_sim_training_args(regime: str):
     """
     Parse command line arguments for the similarity training.
@@ -218,6 +526,8 @@ def process_unfreeze_param(unfreeze_param: str):
     """
     Process the unfreeze parameter for the backbone model.
     """
+    if isinstance(unfreeze_param, int):  # already processed, e.g. the arguments saved in a checkpoint
+        return unfreeze_param
     if unfreeze_param == 'all':
         return 'all'
     elif 'top' in unfreeze_param:
@@ -253,13 +563,27 @@ class EarlyStopper:
         
         return False
     
+    def state_dict(self) -> dict:
+        """Best validation accuracy and patience counter, for resumable checkpoints."""
+        return dict(vars(self))
+    
+    def load_state_dict(self, state_dict: dict):
+        self.__dict__.update(state_dict)
+    
 # ======== Simple SQL DB for Experiment Tracking ========
+def connect_db(db_path="out/experiments.db"):
+    """
+    Connect to the experiment database, waiting up to 60 s (instead of sqlite's 5 s) for 
+    the write lock held by concurrent sweep trials.
+    """
+    return sqlite3.connect(db_path, timeout=60)
+
 def initialize_database(db_path="out/experiments.db"):
     """
     Initialize the SQLite database with tables for arguments, metrics, outputs, and model weights.
     """
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cursor = conn.cursor()
 
     # Create table for arguments
@@ -329,7 +653,7 @@ def save_arguments_to_db(args, project_name, db_path="out/experiments.db"):
             ID of the saved experiment row.
     """
     table_name = f"{project_name}_arguments"
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cursor = conn.cursor()
 
     cursor.execute(f"""
@@ -370,7 +694,7 @@ def save_metrics_to_db(experiment_id, metrics, project_name, db_path="out/experi
     Save training, validation, and testing metrics into the '<project_name>_metrics' table in the database.
     """
     table_name = f"{project_name}_metrics"
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cursor = conn.cursor()
 
     cursor.execute(f"""
@@ -397,6 +721,68 @@ def save_metrics_to_db(experiment_id, metrics, project_name, db_path="out/experi
     print(f"Metrics saved for Experiment ID: {experiment_id} in table: {table_name}")
 
 
+def save_epoch_metrics_to_db(experiment_id, epoch, metrics, project_name, db_path="out/experiments.db"):
+    """
+    Save the end of epoch metrics (train_loss, val_acc, val_f1, and the per-phrase epoch_ate list or None) 
+    into the '<project_name>_epoch_metrics' table in the database.
+    """
+    table_name = f"{project_name}_epoch_metrics"
+    conn = connect_db(db_path)
+    cursor = conn.cursor()
+
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        experiment_id INTEGER,
+        epoch INTEGER,
+        train_loss REAL,
+        val_acc REAL,
+        val_f1 REAL,
+        epoch_ate TEXT
+    );
+    """)
+
+    cursor.execute(f"""
+    INSERT INTO {table_name} (experiment_id, epoch, train_loss, val_acc, val_f1, epoch_ate)
+    VALUES (?, ?, ?, ?, ?, ?)
+    """, (experiment_id, epoch, metrics['train_loss'], metrics['val_acc'], metrics['val_f1'], 
+        json.dumps(convert_to_native(metrics['epoch_ate']))))
+
+    conn.commit()
+    conn.close()
+
+
+def save_sweep_trial_to_db(sweep_name, experiment_id, config, rung, epochs, score, status, project_name, db_path="out/experiments.db"):
+    """
+    Save a sweep trial's successive halving decision (status 'promoted', 'pruned', 'completed', or 'failed' 
+    after training epochs epochs at rung rung) into the '<project_name>_sweeps' table in the database.
+    """
+    table_name = f"{project_name}_sweeps"
+    conn = connect_db(db_path)
+    cursor = conn.cursor()
+
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sweep_name TEXT,
+        experiment_id INTEGER,
+        config TEXT,
+        rung INTEGER,
+        epochs INTEGER,
+        score REAL,
+        status TEXT
+    );
+    """)
+
+    cursor.execute(f"""
+    INSERT INTO {table_name} (sweep_name, experiment_id, config, rung, epochs, score, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (sweep_name, experiment_id, json.dumps(config), rung, epochs, score, status))
+
+    conn.commit()
+    conn.close()
+
+
 def convert_to_native(obj):
     """
     Recursively converts NumPy types to native Python types.
@@ -420,7 +806,7 @@ def save_outputs_to_db(experiment_id, split, targets, predictions, project_name,
     Save output targets and predictions into the '<project_name>_outputs' table in the database.
     """
     table_name = f"{project_name}_outputs"
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cursor = conn.cursor()
 
     cursor.execute(f"""
@@ -451,7 +837,7 @@ def save_model_weights_to_db(experiment_id, weight_path, project_name, db_path="
     Save the model weights' file path into the '<project_name>_model_weights' table in the database.
     """
     table_name = f"{project_name}_model_weights"
-    conn = sqlite3.connect(db_path)
+    conn = connect_db(db_path)
     cursor = conn.cursor()
 
     cursor.execute(f"""